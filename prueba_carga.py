@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga del servidor multijugador de la Habitación del Tiempo
+Lanza miles de clientes simulados por TCP y mide la latencia de cada turno
+
+Uso:
+    python prueba_carga.py --clientes 2000 --turnos 10 --embebido --offline
+    python prueba_carga.py --clientes 500 --embebido --stub --rps 200
+    python prueba_carga.py --host 127.0.0.1 --puerto 7777 --clientes 1000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+ACTIONS = ["explorar el bosque oscuro", "buscar enemigos", "atacar", "defender",
+           "descansar", "percepcion", "hablar con el eco", "huir"]
+
+
+async def run_client(host: str, port: int, turns: int, latencies: list, errors: list,
+                     prompt: bytes, start_spread: float, timeout: float):
+    """Cliente simulado: crea un personaje y juega varios turnos"""
+    await asyncio.sleep(random.uniform(0, start_spread))
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        await asyncio.wait_for(reader.readuntil(prompt), timeout)
+        for answer in (f"Bot{random.getrandbits(24):06x}", "Orco", "Guerrero"):
+            writer.write(f"{answer}\n".encode("utf-8"))
+            await asyncio.wait_for(reader.readuntil(prompt), timeout)
+
+        for _ in range(turns):
+            start = time.perf_counter()
+            writer.write(f"{random.choice(ACTIONS)}\n".encode("utf-8"))
+            await writer.drain()
+            await asyncio.wait_for(reader.readuntil(prompt), timeout)
+            latencies.append(time.perf_counter() - start)
+
+        writer.write(b"salir\n")
+        await writer.drain()
+        writer.close()
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+        errors.append(repr(e))
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def main_async(args):
+    server = None
+    stub = None
+    if args.embebido:
+        if args.stub:
+            from servidor_stub import StubServer, FaultConfig
+            stub = StubServer(("127.0.0.1", 0), FaultConfig(latency=args.latencia_stub))
+            stub.start_background()
+            os.environ["OPENAI_BASE_URL"] = stub.base_url
+            os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+        import timeIagame as game
+
+        scheduler = None
+        if not args.offline:
+            client = None
+            if stub:
+                import openai
+                client = openai.AsyncOpenAI(api_key="stub", base_url=stub.base_url, max_retries=0)
+            scheduler = game.SharedLLMScheduler(requests_per_second=args.rps, burst=args.rps,
+                                                max_concurrency=args.concurrencia, client=client)
+        server = game.GameServer("127.0.0.1", 0, scheduler=scheduler, offline=args.offline)
+        await server.start()
+        host, port, prompt = "127.0.0.1", server.port, game.GameServer.PROMPT.encode("utf-8")
+    else:
+        host, port, prompt = args.host, args.puerto, b">>> "
+
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(host, port, args.turnos, latencies, errors, prompt,
+                                      args.escalonado, args.plazo)
+                           for _ in range(args.clientes)))
+    elapsed = time.perf_counter() - start
+
+    print(f"Clientes: {args.clientes}  Turnos: {len(latencies)}  Errores: {len(errors)}  "
+          f"Duración: {elapsed:.2f}s  ({len(latencies) / elapsed:.0f} turnos/s)")
+    if latencies:
+        print(f"Latencia por turno  p50: {percentile(latencies, 0.50) * 1000:.1f} ms  "
+              f"p99: {percentile(latencies, 0.99) * 1000:.1f} ms  "
+              f"máx: {max(latencies) * 1000:.1f} ms")
+    if errors:
+        print(f"Primer error: {errors[0]}")
+
+    if server:
+        if server.scheduler:
+            print(f"Planificador: {server.scheduler.stats}")
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del servidor multijugador")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=7777)
+    parser.add_argument("--clientes", type=int, default=1000)
+    parser.add_argument("--turnos", type=int, default=10)
+    parser.add_argument("--escalonado", type=float, default=1.0,
+                        help="Segundos en los que se reparten las conexiones iniciales")
+    parser.add_argument("--plazo", type=float, default=60.0, help="Plazo máximo por turno en segundos")
+    parser.add_argument("--embebido", action="store_true", help="Arranca el servidor en este mismo proceso")
+    parser.add_argument("--offline", action="store_true", help="Servidor embebido solo con narrador local")
+    parser.add_argument("--stub", action="store_true", help="Servidor embebido contra servidor_stub.py")
+    parser.add_argument("--latencia-stub", type=float, default=0.2)
+    parser.add_argument("--rps", type=int, default=200, help="Peticiones por segundo al LLM")
+    parser.add_argument("--concurrencia", type=int, default=64, help="Peticiones simultáneas al LLM")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Prueba de resistencia de memoria de la Habitación del Tiempo
+Juega miles de turnos sin interfaz y comprueba que la memoria se mantiene plana
+
+La medida de referencia se toma cuando las estructuras acotadas ya están
+llenas. Sin modelo solo uno de cada siete u ocho turnos deja un recuerdo, así
+que el índice del GM tarda unos 4000 turnos en llegar a MAX_MEMORIES +
+FORGET_BLOCK y olvidar por primera vez (después oscila entre 500 y 600), y el
+mapa tarda otro tanto en cargar sus MAX_CHUNKS fragmentos. Por defecto la
+referencia es el primer informe en que ambas cosas han pasado. Lo que crece
+después es estado de partida legítimo (lugares explorados, zonas visitadas)
+y las posiciones tácticas, acotadas por EnemyTactics.MAX_POSITIONS.
+
+Uso:
+    python prueba_memoria.py --turnos 12000
+    python prueba_memoria.py --turnos 20000 --intervalo 2000 --informe memoria.txt
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ACTIONS = ["explorar el bosque oscuro", "buscar enemigos", "hablar con el eco", "investigar las ruinas",
+           "descansar", "percepcion", "inventario", "estado", "equipar espada corta",
+           "entrenar 2 horas", "deshacer", "huir", "ir al norte", "ir al sur", "ir al este",
+           "ir al oeste", "mapa"]
+
+
+def play_turn(session, rng: random.Random):
+    """Un turno: combate si hay enemigo, si no una acción cualquiera"""
+    if session.in_combat:
+        roll = rng.random()
+        if roll < 0.6:
+            session.attack()
+        elif roll < 0.8:
+            session.defend()
+        elif roll < 0.95:
+            session.auto_battle()
+        else:
+            session.process_input("huir")
+    else:
+        session.process_input(rng.choice(ACTIONS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de resistencia de memoria")
+    parser.add_argument("--turnos", type=int, default=12000)
+    parser.add_argument("--calentamiento", type=int, default=0,
+                        help="Turnos antes de la medida de referencia (0: cuando el índice de recuerdos y el mapa están llenos)")
+    parser.add_argument("--intervalo", type=int, default=1000, help="Turnos entre informes")
+    parser.add_argument("--tolerancia-kb", type=float, default=1024.0,
+                        help="Crecimiento máximo permitido tras el calentamiento")
+    parser.add_argument("--informe", default=None, help="Archivo del informe (por defecto solo por pantalla)")
+    parser.add_argument("--semilla", type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="soak-")
+    os.environ["JOURNAL_PATH"] = os.path.join(workdir, "diario.db")
+    os.environ.setdefault("OPENAI_API_KEY", "offline")
+    import timeIagame as game
+
+    random.seed(args.semilla)
+    rng = random.Random(args.semilla)
+    journal = game.SessionJournal()
+    session = game.GameSession(game.AIGameMaster(offline=True), narrate_combat=False, journal=journal)
+    lines = [0]
+    session.subscribe(lambda event: lines.__setitem__(0, lines[0] + 1))
+    session.create_character("Resistente", "Humano", "Guerrero", initial_scene=False)
+
+    diagnostics = game.MemoryDiagnostics(args.informe)
+    diagnostics.watch_session(session)
+    diagnostics.start()
+
+    baseline = None
+    start = time.perf_counter()
+    for turn in range(1, args.turnos + 1):
+        play_turn(session, rng)
+        warm = (turn == args.calentamiento if args.calentamiento
+                else baseline is None and turn % args.intervalo == 0 and session.gm.memory.forgotten
+                and len(session.gm.world_map.chunks) == game.WorldMap.MAX_CHUNKS)
+        if warm:
+            journal.flush()
+            baseline = diagnostics.report(f"turno {turn} (referencia)")
+        elif turn % args.intervalo == 0:
+            journal.flush()
+            sample = diagnostics.report(f"turno {turn}")
+            print(f"Turno {turn}: {sample.traced / 1024:.0f} KiB trazados, {sample.gauges}", flush=True)
+    elapsed = time.perf_counter() - start
+
+    journal.flush()
+    assert baseline is not None, "la partida terminó antes de llenar las estructuras acotadas; sube --turnos"
+    final = diagnostics.report("final")
+    print("\n".join(diagnostics.diff_lines(baseline, final)))
+    journal.close()
+
+    growth_kb = (final.traced - baseline.traced) / 1024
+    print(f"\n{args.turnos} turnos en {elapsed:.1f}s ({lines[0]} eventos). "
+          f"Crecimiento tras el calentamiento: {growth_kb:+.0f} KiB (tolerancia {args.tolerancia_kb:.0f} KiB)")
+    assert growth_kb <= args.tolerancia_kb, "la memoria no se mantiene plana"
+    for name, value in final.gauges.items():
+        assert value <= max(baseline.gauges[name], 1) * 1.5, f"'{name}' sigue creciendo: {value}"
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Servidor stub local compatible con /v1/chat/completions de OpenAI
+Inyecta fallos (429, 5xx, cuelgues y latencia) para probar el cliente de narración
+
+Uso:
+    python servidor_stub.py --port 8765 --error-rate 0.2 --hang-rate 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub python timeIagame.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FaultConfig:
+    """Probabilidades y tiempos de los fallos inyectados"""
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.05,
+                 rate_limit_rate: float = 0.0, error_rate: float = 0.0,
+                 hang_rate: float = 0.0, hang_time: float = 60.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_time = hang_time
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Responde como la API de chat completions, con fallos inyectados"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # El precalentamiento de conexiones hace un GET: se responde sin cerrar la conexión
+        self.send_json(404, {"error": {"message": "no encontrado", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        config = self.server.faults
+        self.server.count("requests")
+
+        if not self.path.rstrip("/").endswith("chat/completions"):
+            self.send_json(404, {"error": {"message": "no encontrado", "type": "invalid_request_error"}})
+            return
+
+        roll = random.random()
+        if roll < config.hang_rate:
+            self.server.count("hangs")
+            time.sleep(config.hang_time)
+        elif roll < config.hang_rate + config.rate_limit_rate:
+            self.server.count("rate_limited")
+            self.send_json(429, {"error": {"message": "límite de peticiones", "type": "rate_limit_error"}},
+                           {"Retry-After": "0"})
+            return
+        elif roll < config.hang_rate + config.rate_limit_rate + config.error_rate:
+            self.server.count("errors")
+            self.send_json(random.choice([500, 502, 503]),
+                           {"error": {"message": "fallo inyectado", "type": "server_error"}})
+            return
+
+        time.sleep(max(0.0, config.latency + random.uniform(-config.jitter, config.jitter)))
+
+        action = ""
+        for message in reversed(request.get("messages", [])):
+            if message.get("role") == "user":
+                action = message.get("content", "").split("Acción del jugador:")[-1][-80:]
+                break
+
+        content = f"La Habitación del Tiempo responde a tu acción ({action.strip()}). ¿Qué harás ahora?"
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            # Respuesta estructurada: elige un encuentro válido del esquema de vez en cuando
+            schema = response_format.get("json_schema", {}).get("schema", {})
+            enemies = [e for e in schema.get("properties", {}).get("encounter", {}).get("enum", []) if e]
+            content = json.dumps({
+                "narration": content,
+                "encounter": random.choice(enemies) if enemies and random.random() < 0.3 else None,
+                "location": None,
+                "quest_updates": [],
+                "npcs_met": []
+            }, ensure_ascii=False)
+
+        self.send_json(200, {
+            "id": f"chatcmpl-stub-{random.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": content
+                },
+                "finish_reason": "stop"
+            }],
+            "usage": self.server.usage_for(request.get("messages", []), content)
+        })
+
+
+class StubServer(ThreadingHTTPServer):
+    """Servidor HTTP multihilo con contadores de peticiones y fallos"""
+
+    daemon_threads = True
+
+    def __init__(self, address, faults: FaultConfig):
+        super().__init__(address, StubHandler)
+        self.faults = faults
+        self.counters = {}
+        self.prompt_prefixes = deque(maxlen=32)
+        self._lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # Los clientes abandonan las peticiones colgadas: no es un error del stub
+        pass
+
+    def usage_for(self, messages: list, content: str) -> dict:
+        """Uso de tokens simulado (~4 caracteres por token) con caché de prefijos"""
+        prompt = json.dumps(messages, ensure_ascii=False)
+        with self._lock:
+            cached = 0
+            for previous in self.prompt_prefixes:
+                common = 0
+                for a, b in zip(previous, prompt):
+                    if a != b:
+                        break
+                    common += 1
+                cached = max(cached, common)
+            self.prompt_prefixes.append(prompt)
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached // 4}
+        }
+
+    def count(self, key: str):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start_background(self) -> threading.Thread:
+        """Arranca el servidor en un hilo demonio (útil en pruebas)"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub local de la API de OpenAI con inyección de fallos")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--hang-time", type=float, default=60.0)
+    args = parser.parse_args()
+
+    faults = FaultConfig(args.latency, args.jitter, args.rate_limit_rate,
+                         args.error_rate, args.hang_rate, args.hang_time)
+    server = StubServer((args.host, args.port), faults)
+    print(f"Stub escuchando en {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"Contadores: {server.counters}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,16 +6,44 @@ Autor: Assistant
 """
 
 import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox, Canvas, Frame
+from tkinter import ttk, scrolledtext, messagebox, simpledialog, Canvas, Frame
 import json
 import random
 import sqlite3
 import os
+import time
+import asyncio
+import argparse
+import threading
+import hashlib
+import base64
+import io
+import queue
+import glob
+import gzip
+import csv
+import bisect
+import heapq
+import itertools
+import math
+import operator
+import zlib
+import array
+import gc
+import tracemalloc
+import struct
+import multiprocessing
+from multiprocessing import shared_memory
+from collections import deque, OrderedDict
+from collections.abc import Mapping
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 from typing import Dict, List, Tuple, Optional
 import re
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field, replace
 import openai
+import httpx
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
@@ -23,11 +51,59 @@ load_dotenv()
 
 # Configuración
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise ValueError("Por favor configura OPENAI_API_KEY en tu archivo .env")
 
+# La clave solo es obligatoria para usar la narración en línea (ver AIGameMaster)
 openai.api_key = OPENAI_API_KEY
 
+# Servidor alternativo (p. ej. el stub local de servidor_stub.py)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+
+# Plazo máximo por narración (segundos) y peticiones de cobertura
+NARRATION_TIMEOUT = float(os.getenv("NARRATION_TIMEOUT", "20"))
+NARRATION_HEDGING = os.getenv("NARRATION_HEDGING", "0") == "1"
+
+# HTTP/2 requiere el paquete opcional h2 (pip install "httpx[http2]")
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# pyarrow es opcional: sin él la telemetría de combate se escribe en CSV comprimido
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# Pillow es opcional: sin él solo se reescalan las imágenes PPM del renderizador local
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# Ilustraciones: "placeholder" (local, sin red) u "openai"
+IMAGE_BACKEND = os.getenv("IMAGE_BACKEND", "placeholder")
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(".cache", "imagenes"))
+
+# Diario de partida con búsqueda de texto completo (SQLite FTS5)
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "diario.db")
+
+# Telemetría de combate para análisis de balance (vacío = desactivada)
+TELEMETRY_DIR = os.getenv("TELEMETRY_DIR", "telemetria")
+
+# Diagnóstico de memoria para sesiones largas (segundos entre informes; 0 = desactivado)
+MEMORY_DIAGNOSTICS = float(os.getenv("MEMORY_DIAGNOSTICS", "0") or 0)
+MEMORY_REPORT_PATH = os.getenv("MEMORY_REPORT_PATH", "memoria.txt")
+
+# Semilla del mapa de zonas (vacío = una distinta en cada partida nueva)
+WORLD_SEED = os.getenv("WORLD_SEED")
+
+# Razas, clases y enemigos se cargan de archivos JSON (ver ContentRegistry)
+CONTENT_DIR = os.getenv("CONTENT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "contenido"))
+
 # ============= SISTEMA DE JUEGO =============
 
 @dataclass
@@ -52,38 +128,53 @@ class Attributes:
     sabiduria: int = 3
     carisma: int = 3
 
+@dataclass(frozen=True)
+class DiceSpec:
+    """Tirada de dados ya interpretada: XdY+Z"""
+    cantidad: int
+    caras: int
+    bonus: int = 0
+    
+    def __str__(self) -> str:
+        return f"{self.cantidad}d{self.caras}{self.bonus:+d}" if self.bonus else f"{self.cantidad}d{self.caras}"
+    
+    def roll(self) -> Tuple[int, str]:
+        rolls = [random.randint(1, self.caras) for _ in range(self.cantidad)]
+        total = sum(rolls) + self.bonus
+        
+        desc = f"{self} = {rolls}"
+        if self.bonus:
+            desc += f" {'+' if self.bonus > 0 else '-'} {abs(self.bonus)}"
+        desc += f" = {total}"
+        
+        return total, desc
+
 class DiceSystem:
     """Sistema de dados del juego"""
     
+    PATTERN = re.compile(r'(\d+)d(\d+)(?:([+-]\d+))?')
+    
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def parse(dice_str: str) -> Optional[DiceSpec]:
+        """Interpreta una cadena de dados una sola vez (resultado en caché)"""
+        match = DiceSystem.PATTERN.match(dice_str)
+        if not match:
+            return None
+        return DiceSpec(int(match.group(1)), int(match.group(2)),
+                        int(match.group(3)) if match.group(3) else 0)
+    
     @staticmethod
     def roll(dice_str: str) -> Tuple[int, str]:
         """
         Realiza una tirada de dados
-        Formato: XdY+Z donde X=cantidad, Y=caras, Z=bonus
+        Formato: XdY+Z donde X=cantidad, Y=caras, Z=bonus (puede ser negativo: XdY-Z)
         Retorna: (resultado, descripción)
         """
-        pattern = r'(\d+)d(\d+)(?:\+(\d+))?'
-        match = re.match(pattern, dice_str)
-        
-        if not match:
+        spec = DiceSystem.parse(dice_str)
+        if not spec:
             return 0, "Formato inválido"
-        
-        cantidad = int(match.group(1))
-        caras = int(match.group(2))
-        bonus = int(match.group(3)) if match.group(3) else 0
-        
-        rolls = [random.randint(1, caras) for _ in range(cantidad)]
-        total = sum(rolls) + bonus
-        
-        desc = f"{cantidad}d{caras}"
-        if bonus > 0:
-            desc += f"+{bonus}"
-        desc += f" = {rolls}"
-        if bonus > 0:
-            desc += f" + {bonus}"
-        desc += f" = {total}"
-        
-        return total, desc
+        return spec.roll()
     
     @staticmethod
     def roll_d100_with_bonus(bonus: int = 0) -> Tuple[int, str]:
@@ -92,71 +183,572 @@ class DiceSystem:
         total = roll + bonus
         return total, f"1d100+{bonus} = {roll} + {bonus} = {total}"
 
-class Character:
-    """Clase que representa un personaje jugador"""
+# ============= EFECTOS DE ESTADO =============
+
+@dataclass
+class StatusEffect:
+    """Efecto temporal o permanente sobre un personaje o enemigo"""
+    name: str
+    turns: Optional[int] = None                                  # None = hasta que se retire
+    modifiers: Dict[str, int] = field(default_factory=dict)      # suma fija por stat
+    multipliers: Dict[str, float] = field(default_factory=dict)  # factor por stat
+    damage_per_turn: int = 0                                     # negativo = curación por turno
+    skip_turn: bool = False                                      # pierde su acción (Aturdido)
+    source: str = ""
+
+# Estados alterados del manual (los valores escalan con el CR a criterio del DM)
+STATUS_PRESETS = {
+    "Aturdido": StatusEffect("Aturdido", turns=1, multipliers={"defensa": 0.5}, skip_turn=True),
+    "Veneno": StatusEffect("Veneno", turns=3, modifiers={"fortaleza": -5, "resistencia": -5}, damage_per_turn=10),
+    "Quemadura": StatusEffect("Quemadura", turns=3, damage_per_turn=15),
+    "Sangrado": StatusEffect("Sangrado", turns=2, damage_per_turn=8),
+    "Desequilibrio": StatusEffect("Desequilibrio", turns=1, modifiers={"fortaleza": -25, "resistencia": -15}),
+    "Bendición": StatusEffect("Bendición", turns=5, modifiers={"fortaleza": 10, "resistencia": 10}),
+    "Regeneración": StatusEffect("Regeneración", turns=5, damage_per_turn=-20)
+}
+
+def make_effect(name: str, **overrides) -> StatusEffect:
+    """Copia de un estado predefinido, con campos opcionalmente sustituidos"""
+    return replace(STATUS_PRESETS[name], **overrides)
+
+@dataclass
+class TickResult:
+    """Lo ocurrido al avanzar un turno de efectos"""
+    damage: int = 0
+    expired: List[str] = field(default_factory=list)
+
+class StatusEffectEngine:
+    """
+    Efectos activos de un personaje o enemigo. Las expiraciones viven en un
+    montículo y los modificadores se agregan de forma incremental al aplicar
+    o retirar cada efecto, así que avanzar un turno cuesta O(log n) por efecto
+    expirado y consultar un stat derivado es O(1) mientras nada cambie.
+    """
     
-    RACES = {
-        "Humano": {
-            "stats": CharacterStats(vitalidad=100, mana=10, ataque=10, defensa=8, 
-                                  ataque_magico=10, defensa_magica=8),
-            "attr_bonus": {"fuerza": 1, "destreza": 1, "constitucion": 1, 
-                          "inteligencia": 1, "sabiduria": 1, "carisma": 1},
-            "description": "Versátiles y adaptables, dominan cualquier disciplina"
-        },
-        "Elfo": {
-            "stats": CharacterStats(vitalidad=120, mana=15, ataque=12, defensa=10,
-                                  ataque_magico=12, defensa_magica=10),
-            "attr_bonus": {"destreza": 2, "sabiduria": 1},
-            "description": "Ágiles y sabios, con afinidad natural por la magia"
-        },
-        "Enano": {
-            "stats": CharacterStats(vitalidad=90, mana=8, ataque=16, defensa=13,
-                                  ataque_magico=16, defensa_magica=16),
-            "attr_bonus": {"constitucion": 2, "fuerza": 2},
-            "description": "Robustos guerreros, resistentes como la roca"
-        },
-        "Orco": {
-            "stats": CharacterStats(vitalidad=150, mana=10, ataque=18, defensa=14,
-                                  ataque_magico=18, defensa_magica=14),
-            "attr_bonus": {"fuerza": 2, "constitucion": 1},
-            "description": "Guerreros feroces nacidos para el combate"
-        }
+    # Versiones únicas entre motores: una caché nunca confunde dos motores distintos
+    _versions = itertools.count(1)
+    
+    def __init__(self):
+        self.turn = 0
+        self.active: Dict[int, StatusEffect] = {}
+        self.expires: Dict[int, int] = {}           # id -> turno de expiración
+        self.expiries: List[Tuple[int, int]] = []   # montículo de (turno, id)
+        self.next_id = 1
+        self.additive: Dict[str, int] = {}
+        self.factors: Dict[str, Dict[float, int]] = {}  # stat -> {factor: efectos que lo aplican}
+        self.damage_per_turn = 0
+        self.stunned = 0
+        self.version = next(self._versions)
+        self._derived: Dict[str, Tuple[int, int, int]] = {}  # stat -> (versión, base, valor)
+    
+    def __len__(self) -> int:
+        return len(self.active)
+    
+    def __iter__(self):
+        return iter(self.active.values())
+    
+    @property
+    def is_stunned(self) -> bool:
+        return self.stunned > 0
+    
+    def names(self) -> List[str]:
+        """Nombres de los efectos activos, sin repetir"""
+        return list(dict.fromkeys(effect.name for effect in self.active.values()))
+    
+    def apply(self, effect: StatusEffect) -> int:
+        """Activa un efecto (se acumulan aunque se repitan) y devuelve su identificador"""
+        effect_id = self.next_id
+        self.next_id += 1
+        self.active[effect_id] = effect
+        if effect.turns is not None:
+            # Dura `turns` turnos completos a partir del siguiente tick
+            self.expires[effect_id] = self.turn + effect.turns
+            heapq.heappush(self.expiries, (self.expires[effect_id], effect_id))
+        self._account(effect, 1)
+        return effect_id
+    
+    def remove(self, effect_id: int) -> Optional[StatusEffect]:
+        """Retira un efecto; su entrada del montículo se descarta al salir"""
+        effect = self.active.pop(effect_id, None)
+        if effect is not None:
+            self.expires.pop(effect_id, None)
+            self._account(effect, -1)
+        return effect
+    
+    def remove_named(self, name: str) -> int:
+        """Retira todos los efectos con ese nombre (p. ej. purgar un veneno)"""
+        ids = [effect_id for effect_id, effect in self.active.items() if effect.name == name]
+        for effect_id in ids:
+            self.remove(effect_id)
+        return len(ids)
+    
+    def _account(self, effect: StatusEffect, sign: int):
+        for stat, value in effect.modifiers.items():
+            self.additive[stat] = self.additive.get(stat, 0) + sign * value
+        for stat, factor in effect.multipliers.items():
+            counts = self.factors.setdefault(stat, {})
+            counts[factor] = counts.get(factor, 0) + sign
+            if not counts[factor]:
+                del counts[factor]
+        self.damage_per_turn += sign * effect.damage_per_turn
+        self.stunned += sign * int(effect.skip_turn)
+        self.version = next(self._versions)
+    
+    def tick(self) -> TickResult:
+        """Avanza un turno: retira lo expirado y devuelve el daño periódico acumulado"""
+        self.turn += 1
+        result = TickResult()
+        while self.expiries and self.expiries[0][0] < self.turn:
+            _, effect_id = heapq.heappop(self.expiries)
+            effect = self.remove(effect_id)
+            if effect is not None:
+                result.expired.append(effect.name)
+        result.damage = self.damage_per_turn
+        return result
+    
+    def fast_forward(self, turns: int) -> List[str]:
+        """Deja pasar `turns` turnos fuera de combate: solo retira lo expirado"""
+        self.turn += max(0, turns - 1)
+        return self.tick().expired
+    
+    def derived(self, stat: str, base: int) -> int:
+        """Valor de un stat con todos los modificadores (en caché hasta el próximo cambio)"""
+        cached = self._derived.get(stat)
+        if cached is not None and cached[0] == self.version and cached[1] == base:
+            return cached[2]
+        value = base + self.additive.get(stat, 0)
+        for factor, count in self.factors.get(stat, {}).items():
+            value *= factor ** count
+        value = int(value)
+        self._derived[stat] = (self.version, base, value)
+        return value
+    
+    def to_list(self) -> List[dict]:
+        """Efectos activos con sus turnos restantes, para guardar partida"""
+        entries = []
+        for effect_id, effect in self.active.items():
+            remaining = self.expires[effect_id] - self.turn if effect_id in self.expires else None
+            entries.append(dict(asdict(effect), turns=remaining))
+        return entries
+    
+    @classmethod
+    def from_list(cls, entries: List[dict]) -> "StatusEffectEngine":
+        engine = cls()
+        for entry in entries:
+            engine.apply(StatusEffect(**entry))
+        return engine
+
+# ============= REGISTRO DE CONTENIDO =============
+
+def compile_race(name: str, data: dict) -> dict:
+    """Valida una raza y construye sus stats una sola vez"""
+    attr_bonus = data.get("attr_bonus", {})
+    unknown = set(attr_bonus) - set(Attributes.__dataclass_fields__)
+    if unknown:
+        raise ValueError(f"atributos desconocidos {sorted(unknown)}")
+    return {
+        "stats": CharacterStats(**data["stats"]),
+        "attr_bonus": attr_bonus,
+        "description": data.get("description", "")
+    }
+
+def compile_class(name: str, data: dict) -> dict:
+    """Valida una clase"""
+    attr_bonus = data.get("attr_bonus", {})
+    unknown = set(attr_bonus) - set(Attributes.__dataclass_fields__)
+    if unknown:
+        raise ValueError(f"atributos desconocidos {sorted(unknown)}")
+    return {
+        "attr_bonus": attr_bonus,
+        "buff_weapons": list(data.get("buff_weapons", [])),
+        "buff_mult": float(data.get("buff_mult", 1.0)),
+        "description": data.get("description", "")
+    }
+
+def compile_enemy(name: str, data: dict) -> dict:
+    """Valida un enemigo e interpreta sus dados una sola vez"""
+    entry = dict(data)
+    for key in ("attack", "defense"):
+        spec = DiceSystem.parse(data[key])
+        if spec is None:
+            raise ValueError(f"dados inválidos en '{key}': {data[key]!r}")
+        entry[f"{key}_spec"] = spec
+    entry["cr"] = int(data["cr"])
+    entry["gold_range"] = tuple(data["gold_range"])
+    on_hit = data.get("on_hit")
+    if on_hit and on_hit.get("effect") not in STATUS_PRESETS:
+        raise ValueError(f"estado desconocido en 'on_hit': {on_hit.get('effect')!r}")
+    return entry
+
+ITEM_SLOTS = ("arma", "armadura", "escudo", "accesorio")
+ITEM_RARITIES = ("común", "poco común", "raro", "épico", "legendario")
+
+def compile_item(name: str, data: dict) -> dict:
+    """Valida un objeto; sus bonus se suman a los stats del portador"""
+    bonus = {stat: int(value) for stat, value in data.get("bonus", {}).items()}
+    unknown = set(bonus) - set(CharacterStats.__dataclass_fields__)
+    if unknown:
+        raise ValueError(f"stats desconocidos {sorted(unknown)}")
+    slot = data.get("slot")
+    if slot is not None and slot not in ITEM_SLOTS:
+        raise ValueError(f"ranura desconocida {slot!r}")
+    rarity = data.get("rarity", "común")
+    if rarity not in ITEM_RARITIES:
+        raise ValueError(f"rareza desconocida {rarity!r}")
+    return {
+        "slot": slot,
+        "type": data.get("type", ""),
+        "rarity": rarity,
+        "rarity_rank": ITEM_RARITIES.index(rarity),
+        "bonus": bonus,
+        "value": int(data.get("value", 0)),
+        "description": data.get("description", "")
+    }
+
+class ContentTable(Mapping):
+    """Vista de solo lectura de una tabla del registro (se recarga sola)"""
+    
+    def __init__(self, registry: "ContentRegistry", kind: str):
+        self.registry = registry
+        self.kind = kind
+    
+    def __getitem__(self, name: str) -> dict:
+        return self.registry.table(self.kind)[name]
+    
+    def __iter__(self):
+        return iter(self.registry.table(self.kind))
+    
+    def __len__(self) -> int:
+        return len(self.registry.table(self.kind))
+    
+    def __contains__(self, name) -> bool:
+        return name in self.registry.table(self.kind)
+
+class ContentRegistry:
+    """
+    Razas, clases, enemigos y objetos cargados de archivos JSON (razas*.json,
+    clases*.json, enemigos*.json, objetos*.json) la primera vez que se consultan. Cada entrada
+    se valida y precompila al cargar, y los índices se construyen una vez por
+    carga. Si cambia algún archivo, la siguiente consulta recarga el contenido.
+    """
+    
+    KINDS = {
+        "races": ("razas", compile_race),
+        "classes": ("clases", compile_class),
+        "enemies": ("enemigos", compile_enemy),
+        "items": ("objetos", compile_item)
     }
     
-    CLASSES = {
-        "Guerrero": {
-            "attr_bonus": {"fuerza": 1, "constitucion": 1},
-            "buff_weapons": ["Espada", "Hacha", "Lanza"],
-            "buff_mult": 1.10,
-            "description": "Maestro del combate cuerpo a cuerpo"
-        },
-        "Mago": {
-            "attr_bonus": {"inteligencia": 1, "sabiduria": 1},
-            "buff_weapons": ["Hechizo"],
-            "buff_mult": 1.30,
-            "description": "Manipulador de las fuerzas arcanas"
-        },
-        "Arquero": {
-            "attr_bonus": {"destreza": 1, "sabiduria": 1},
-            "buff_weapons": ["Arco"],
-            "buff_mult": 1.15,
-            "description": "Experto en combate a distancia"
-        },
-        "Asesino": {
-            "attr_bonus": {"destreza": 1, "inteligencia": 1},
-            "buff_weapons": ["Daga", "Veneno"],
-            "buff_mult": 1.15,
-            "description": "Maestro del sigilo y los golpes críticos"
+    RELOAD_CHECK_SECONDS = 1.0
+    
+    def __init__(self, directory: str = CONTENT_DIR):
+        self.directory = directory
+        self.tables = None
+        self.indexes = {}
+        self.file_mtimes = {}
+        self.last_check = 0.0
+        self.version = 0
+        self.error = None   # último error al recargar; las sesiones lo avisan (GameSession.check_content)
+        self._lock = threading.Lock()
+        
+        self.races = ContentTable(self, "races")
+        self.classes = ContentTable(self, "classes")
+        self.enemies = ContentTable(self, "enemies")
+        self.items = ContentTable(self, "items")
+    
+    def scan(self) -> Dict[str, float]:
+        """Archivos de contenido y su fecha de modificación"""
+        mtimes = {}
+        for prefix, _ in self.KINDS.values():
+            for path in glob.glob(os.path.join(self.directory, f"{prefix}*.json")):
+                mtimes[path] = os.path.getmtime(path)
+        return mtimes
+    
+    def load(self):
+        """Carga y precompila todo el contenido; sustituye las tablas de golpe"""
+        with self._lock:
+            mtimes = self.scan()
+            tables = {kind: {} for kind in self.KINDS}
+            for kind, (prefix, compile_entry) in self.KINDS.items():
+                paths = sorted(p for p in mtimes if os.path.basename(p).startswith(prefix))
+                if not paths:
+                    raise ValueError(f"No hay archivos {prefix}*.json en {self.directory}")
+                for path in paths:
+                    with open(path, "r", encoding="utf-8") as f:
+                        entries = json.load(f)
+                    for name, data in entries.items():
+                        if name in tables[kind]:
+                            raise ValueError(f"{path}: '{name}' está duplicado")
+                        try:
+                            tables[kind][name] = compile_entry(name, data)
+                        except (KeyError, TypeError, ValueError) as e:
+                            raise ValueError(f"{path}: '{name}': {e}") from e
+            
+            self.indexes = self.build_indexes(tables)
+            self.tables = tables
+            self.file_mtimes = mtimes
+            self.last_check = time.monotonic()
+            self.version += 1
+    
+    @staticmethod
+    def build_indexes(tables: dict) -> dict:
+        enemies = tables["enemies"]
+        by_cr = sorted((data["cr"], name) for name, data in enemies.items())
+        
+        by_weapon = {}
+        for name, data in tables["classes"].items():
+            for weapon in data["buff_weapons"]:
+                by_weapon.setdefault(weapon.lower(), []).append(name)
+        
+        # Pesos de encuentro: favorece enemigos débiles (CR 1..4 → 4, 3, 2, 1)
+        encounter_weights = []
+        total = 0
+        for data in enemies.values():
+            total += max(1, 5 - data["cr"])
+            encounter_weights.append(total)
+        
+        # Objetos por ranura, tipo y rareza (conjuntos para intersecar filtros)
+        items_by = {"slot": {}, "type": {}, "rarity": {}}
+        for name, data in tables["items"].items():
+            for key, index in items_by.items():
+                value = normalize_command_text(data[key]) if key == "type" else data[key]
+                index.setdefault(value, set()).add(name)
+        
+        return {
+            "cr_values": [cr for cr, _ in by_cr],
+            "cr_names": [name for _, name in by_cr],
+            "weapons": by_weapon,
+            "encounters": (list(enemies), encounter_weights),
+            "items_by": {key: {value: frozenset(names) for value, names in index.items()}
+                         for key, index in items_by.items()}
         }
+    
+    def ensure_fresh(self):
+        """Carga perezosa y recarga en caliente (como mucho una comprobación por segundo)"""
+        if self.tables is None:
+            self.load()
+            return
+        now = time.monotonic()
+        if now - self.last_check < self.RELOAD_CHECK_SECONDS:
+            return
+        self.last_check = now
+        mtimes = self.file_mtimes
+        try:
+            mtimes = self.scan()
+            if mtimes != self.file_mtimes:
+                self.load()
+                self.error = None
+        except (OSError, ValueError) as e:
+            # Un archivo a medio editar no debe tumbar la partida: se conserva el
+            # contenido anterior y se reintenta cuando el archivo vuelva a cambiar
+            self.file_mtimes = mtimes
+            self.error = str(e)
+    
+    def table(self, kind: str) -> dict:
+        self.ensure_fresh()
+        return self.tables[kind]
+    
+    def enemies_by_cr(self, min_cr: int, max_cr: int) -> List[str]:
+        """Enemigos con CR en [min_cr, max_cr], ordenados por CR"""
+        self.ensure_fresh()
+        values = self.indexes["cr_values"]
+        start = bisect.bisect_left(values, min_cr)
+        end = bisect.bisect_right(values, max_cr)
+        return self.indexes["cr_names"][start:end]
+    
+    def classes_for_weapon(self, weapon: str) -> List[str]:
+        """Clases que potencian un tipo de arma"""
+        self.ensure_fresh()
+        return list(self.indexes["weapons"].get(weapon.lower(), []))
+    
+    def encounter_table(self) -> Tuple[List[str], List[int]]:
+        """Enemigos y pesos acumulados para random.choices"""
+        self.ensure_fresh()
+        return self.indexes["encounters"]
+    
+    def items_where(self, slot: Optional[str] = None, item_type: Optional[str] = None,
+                    rarity: Optional[str] = None) -> Optional[frozenset]:
+        """Objetos que cumplen todos los filtros dados (None si no se filtra nada)"""
+        self.ensure_fresh()
+        index = self.indexes["items_by"]
+        selected = None
+        for key, value in (("slot", slot), ("type", item_type and normalize_command_text(item_type)),
+                           ("rarity", rarity)):
+            if value is not None:
+                names = index[key].get(value, frozenset())
+                selected = names if selected is None else selected & names
+        return selected
+
+CONTENT = ContentRegistry()
+
+# ============= PERSONAJES, ENEMIGOS Y COMBATE =============
+
+class ProgressionTable:
+    """
+    Tablas de experiencia precalculadas. exp_to_next sigue la regla iterativa
+    int(anterior * 1.5) desde 100 y cumulative[n] es la experiencia total
+    necesaria para llegar al nivel n (índice = nivel). Crecen bajo demanda.
+    """
+    
+    BASE_EXP = 100
+    GROWTH = 1.5
+    HP_PER_LEVEL = 20
+    MANA_PER_LEVEL = 5
+    FORTALEZA_PER_LEVEL = 2
+    RESISTENCIA_PER_LEVEL = 2
+    IMPROVEMENT_POINTS_PER_LEVEL = 10
+    ASCENSION_EVERY = 10       # niveles 10, 20, 30...
+    ASCENSION_POINTS = 30
+    # Mejora que compra cada punto (PLAN_DESARROLLO.md) y su coste en puntos
+    IMPROVEMENT_GAINS = {"vitalidad": 180, "ataque": 12, "defensa": 12, "ataque_magico": 3,
+                         "defensa_magica": 3, "fortaleza": 3, "resistencia": 3, "mana": 3}
+    IMPROVEMENT_COSTS = {stat: 1 for stat in IMPROVEMENT_GAINS}
+    
+    def __init__(self, levels: int = 100):
+        self.exp_to_next = [0, self.BASE_EXP]
+        self.cumulative = [0, 0]
+        self.extend_to_level(levels)
+    
+    def extend_to_level(self, level: int):
+        while len(self.exp_to_next) <= level:
+            self.cumulative.append(self.cumulative[-1] + self.exp_to_next[-1])
+            self.exp_to_next.append(int(self.exp_to_next[-1] * self.GROWTH))
+    
+    def level_for_total(self, total_exp: int) -> int:
+        """Nivel alcanzado con una experiencia total acumulada"""
+        while self.cumulative[-1] <= total_exp:
+            self.extend_to_level(len(self.exp_to_next) * 2)
+        return bisect.bisect_right(self.cumulative, total_exp) - 1
+    
+    def improvement_points(self, old_level: int, new_level: int) -> int:
+        """Puntos de mejora ganados al pasar de old_level a new_level"""
+        ascensions = new_level // self.ASCENSION_EVERY - old_level // self.ASCENSION_EVERY
+        return (self.IMPROVEMENT_POINTS_PER_LEVEL * (new_level - old_level)
+                + self.ASCENSION_POINTS * ascensions)
+    
+    def apply(self, character: "Character", amount: int) -> Optional[int]:
+        """
+        Añade experiencia en tiempo constante y devuelve los niveles ganados.
+        Devuelve None si el personaje no sigue la tabla (p. ej. partida editada).
+        """
+        level = character.level
+        self.extend_to_level(level)
+        if character.exp_to_next != self.exp_to_next[level] or character.experience >= character.exp_to_next:
+            return None
+        
+        total = self.cumulative[level] + character.experience + amount
+        new_level = self.level_for_total(total)
+        if new_level <= level:
+            character.experience += amount
+            return 0
+        
+        character.experience = total - self.cumulative[new_level]
+        character.exp_to_next = self.exp_to_next[new_level]
+        character.apply_level_gains(new_level)
+        return new_level - level
+
+PROGRESSION = ProgressionTable()
+
+class Inventory:
+    """
+    Objetos apilados por nombre: añadir, quitar y consultar cantidades es O(1).
+    Los filtros usan los índices del registro de contenido y recorren el lado
+    más pequeño (el inventario o el conjunto de objetos que cumplen el filtro).
+    """
+    
+    SORT_KEYS = {
+        "nombre": lambda name, data: name,
+        "rareza": lambda name, data: (-data["rarity_rank"], name) if data else (1, name),
+        "valor": lambda name, data: (-data["value"], name) if data else (1, name),
+        "ranura": lambda name, data: ((data["slot"] or ""), name) if data else ("~", name)
     }
     
+    def __init__(self, stacks: Optional[Dict[str, int]] = None):
+        self.stacks: Dict[str, int] = dict(stacks or {})
+    
+    def __len__(self) -> int:
+        return len(self.stacks)
+    
+    def __contains__(self, name) -> bool:
+        return name in self.stacks
+    
+    def __iter__(self):
+        return iter(self.stacks)
+    
+    def count(self, name: str) -> int:
+        return self.stacks.get(name, 0)
+    
+    def total(self) -> int:
+        """Número total de objetos contando cada pila"""
+        return sum(self.stacks.values())
+    
+    def add(self, name: str, quantity: int = 1):
+        self.stacks[name] = self.stacks.get(name, 0) + quantity
+    
+    def remove(self, name: str, quantity: int = 1) -> bool:
+        """Quita objetos de una pila; False si no hay suficientes"""
+        held = self.stacks.get(name, 0)
+        if held < quantity:
+            return False
+        if held == quantity:
+            del self.stacks[name]
+        else:
+            self.stacks[name] = held - quantity
+        return True
+    
+    def find(self, text: str) -> Optional[str]:
+        """Nombre exacto de un objeto del inventario a partir de lo que escribe el jugador"""
+        wanted = normalize_command_text(text)
+        for name in self.stacks:
+            if normalize_command_text(name) == wanted:
+                return name
+        for name in self.stacks:
+            if wanted and wanted in normalize_command_text(name):
+                return name
+        return None
+    
+    def filter(self, slot: Optional[str] = None, item_type: Optional[str] = None,
+               rarity: Optional[str] = None, sort_by: str = "nombre") -> List[str]:
+        """Objetos del inventario que cumplen los filtros, ordenados"""
+        selected = CONTENT.items_where(slot, item_type, rarity)
+        if selected is None:
+            names = list(self.stacks)
+        elif len(selected) < len(self.stacks):
+            names = [name for name in selected if name in self.stacks]
+        else:
+            names = [name for name in self.stacks if name in selected]
+        items = CONTENT.items
+        key = self.SORT_KEYS[sort_by]
+        return sorted(names, key=lambda name: key(name, items.get(name)))
+    
+    def to_dict(self) -> Dict[str, int]:
+        return dict(self.stacks)
+    
+    @classmethod
+    def from_saved(cls, saved) -> "Inventory":
+        """Acepta el formato actual ({nombre: cantidad}) y el antiguo (lista de nombres)"""
+        if isinstance(saved, dict):
+            return cls(saved)
+        inventory = cls()
+        for name in saved or []:
+            inventory.add(str(name))
+        return inventory
+
+class Character:
+    """Clase que representa un personaje jugador"""
+    
+    # Tablas respaldadas por el registro de contenido (contenido/razas*.json, clases*.json)
+    RACES = CONTENT.races
+    CLASSES = CONTENT.classes
+    
     def __init__(self, name: str, race: str, char_class: str):
         self.name = name
         self.race = race
         self.char_class = char_class
         self.level = 1
         self.experience = 0
-        self.exp_to_next = 100
+        self.exp_to_next = ProgressionTable.BASE_EXP
+        self.improvement_points = 0
         self.gold = 50
         self.hp_actual = 0
         self.mana_actual = 0
@@ -184,16 +776,14 @@ class Character:
         self.mana_actual = self.mana_max
         
         # Inventario y equipo
-        self.inventory = []
-        self.equipment = {
-            "arma": None,
-            "armadura": None,
-            "accesorio": None
-        }
+        self.inventory = Inventory()
+        self.equipment = {slot: None for slot in ITEM_SLOTS}
+        self._equipment_cache = None  # (clave, bonus por stat, multiplicador de clase)
+        self._dice_cache = {}         # "ataque"/"defensa" -> (clave, dados)
         
         # Estado
         self.in_combat = False
-        self.status_effects = []
+        self.status_effects = StatusEffectEngine()
         self.kills = 0
         self.deaths = 0
         
@@ -213,19 +803,72 @@ class Character:
         else:
             return 0
     
+    def equipment_modifiers(self) -> Tuple[Dict[str, int], float]:
+        """Bonus sumados del equipo y multiplicador de clase (solo cambian al equipar)"""
+        key = (tuple(self.equipment.values()), CONTENT.version)
+        if self._equipment_cache is None or self._equipment_cache[0] != key:
+            bonus, multiplier = {}, 1.0
+            for slot, name in self.equipment.items():
+                item = CONTENT.items.get(name) if name else None
+                if item is None:
+                    continue
+                for stat, value in item["bonus"].items():
+                    bonus[stat] = bonus.get(stat, 0) + value
+                if slot == "arma" and item["type"] in self.CLASSES[self.char_class]["buff_weapons"]:
+                    multiplier = self.CLASSES[self.char_class]["buff_mult"]
+            self._equipment_cache = (key, bonus, multiplier)
+        return self._equipment_cache[1], self._equipment_cache[2]
+    
+    def equipped_stat(self, stat: str, extra: int = 0) -> int:
+        """Stat con el equipo y el arma predilecta de la clase, sin efectos (extra se suma a la base)"""
+        bonus, multiplier = self.equipment_modifiers()
+        value = getattr(self.stats, stat) + extra + bonus.get(stat, 0)
+        if multiplier != 1.0 and stat in ("ataque", "fortaleza", "ataque_magico"):
+            value = int(value * multiplier)
+        return value
+    
+    def effective_stat(self, stat: str) -> int:
+        """Stat con el equipo (y el arma predilecta de la clase) y los efectos activos"""
+        return self.status_effects.derived(stat, self.equipped_stat(stat))
+    
+    def _dice(self, kind: str, faces_stat: str, bonus_stat: str) -> str:
+        # Se recalculan solo si cambian los stats, el equipo o los efectos
+        key = (getattr(self.stats, faces_stat), getattr(self.stats, bonus_stat),
+               tuple(self.equipment.values()), CONTENT.version, self.status_effects.version)
+        cached = self._dice_cache.get(kind)
+        if cached is None or cached[0] != key:
+            dice = str(DiceSpec(1, max(1, self.effective_stat(faces_stat)), self.effective_stat(bonus_stat)))
+            self._dice_cache[kind] = cached = (key, dice)
+        return cached[1]
+    
     def get_attack_dice(self) -> str:
         """Obtiene los dados de ataque del personaje"""
-        base = f"1d{self.stats.ataque}"
-        if self.stats.fortaleza > 0:
-            base += f"+{self.stats.fortaleza}"
-        return base
+        return self._dice("ataque", "ataque", "fortaleza")
     
     def get_defense_dice(self) -> str:
         """Obtiene los dados de defensa del personaje"""
-        base = f"1d{self.stats.defensa}"
-        if self.stats.resistencia > 0:
-            base += f"+{self.stats.resistencia}"
-        return base
+        return self._dice("defensa", "defensa", "resistencia")
+    
+    def equip(self, name: str) -> Optional[str]:
+        """
+        Equipa un objeto del inventario; el que ocupaba su ranura vuelve al
+        inventario. Devuelve la ranura usada o None si no se puede equipar.
+        """
+        item = CONTENT.items.get(name)
+        if item is None or item["slot"] is None or not self.inventory.remove(name):
+            return None
+        slot = item["slot"]
+        self.unequip(slot)
+        self.equipment[slot] = name
+        return slot
+    
+    def unequip(self, slot: str) -> Optional[str]:
+        """Devuelve al inventario lo que haya en una ranura"""
+        name = self.equipment.get(slot)
+        if name:
+            self.inventory.add(name)
+            self.equipment[slot] = None
+        return name
     
     def take_damage(self, damage: int):
         """Recibe daño"""
@@ -247,24 +890,55 @@ class Character:
         self.mana_actual = min(self.mana_max, self.mana_actual + amount)
         
     def add_experience(self, amount: int):
-        """Añade experiencia y verifica subida de nivel"""
-        self.experience += amount
-        while self.experience >= self.exp_to_next:
-            self.level_up()
+        """Añade experiencia y aplica de golpe todos los niveles ganados"""
+        if PROGRESSION.apply(self, amount) is None:
+            self.experience += amount
+            while self.experience >= self.exp_to_next:
+                self.level_up()
     
     def level_up(self):
         """Sube de nivel"""
-        self.level += 1
         self.experience -= self.exp_to_next
-        self.exp_to_next = int(self.exp_to_next * 1.5)
+        self.exp_to_next = int(self.exp_to_next * ProgressionTable.GROWTH)
+        self.apply_level_gains(self.level + 1)
+    
+    def apply_level_gains(self, new_level: int):
+        """Mejoras acumuladas de todos los niveles hasta new_level"""
+        gained = new_level - self.level
+        self.improvement_points += PROGRESSION.improvement_points(self.level, new_level)
+        self.level = new_level
         
         # Mejorar stats
-        self.hp_max += 20
+        self.hp_max += ProgressionTable.HP_PER_LEVEL * gained
         self.hp_actual = self.hp_max
-        self.mana_max += 5
+        self.mana_max += ProgressionTable.MANA_PER_LEVEL * gained
         self.mana_actual = self.mana_max
-        self.stats.fortaleza += 2
-        self.stats.resistencia += 2
+        self.stats.fortaleza += ProgressionTable.FORTALEZA_PER_LEVEL * gained
+        self.stats.resistencia += ProgressionTable.RESISTENCIA_PER_LEVEL * gained
+    
+    def improvement_cost(self, allocation: Dict[str, int]) -> Optional[int]:
+        """Puntos que cuesta un reparto {stat: mejoras}, o None si no es válido"""
+        costs = ProgressionTable.IMPROVEMENT_COSTS
+        if any(stat not in costs or count < 0 for stat, count in allocation.items()):
+            return None
+        return sum(costs[stat] * count for stat, count in allocation.items())
+    
+    def spend_improvement_points(self, allocation: Dict[str, int]) -> bool:
+        """Aplica un reparto de puntos de mejora; False si no es válido o no llegan los puntos"""
+        cost = self.improvement_cost(allocation)
+        if cost is None or cost > self.improvement_points:
+            return False
+        self.improvement_points -= cost
+        for stat, count in allocation.items():
+            gain = ProgressionTable.IMPROVEMENT_GAINS[stat] * count
+            setattr(self.stats, stat, getattr(self.stats, stat) + gain)
+            if stat == "vitalidad":
+                self.hp_max += gain
+                self.hp_actual += gain
+            elif stat == "mana":
+                self.mana_max += gain
+                self.mana_actual += gain
+        return True
     
     def to_dict(self) -> dict:
         """Convierte el personaje a diccionario para guardar"""
@@ -275,58 +949,61 @@ class Character:
             "level": self.level,
             "experience": self.experience,
             "exp_to_next": self.exp_to_next,
+            "improvement_points": self.improvement_points,
             "gold": self.gold,
             "hp_actual": self.hp_actual,
+            "hp_max": self.hp_max,
             "mana_actual": self.mana_actual,
+            "mana_max": self.mana_max,
             "stats": asdict(self.stats),
             "attributes": asdict(self.attributes),
-            "inventory": self.inventory,
-            "equipment": self.equipment,
+            "inventory": self.inventory.to_dict(),
+            "equipment": dict(self.equipment),
             "kills": self.kills,
-            "deaths": self.deaths
+            "deaths": self.deaths,
+            "status_effects": self.status_effects.to_list()
         }
+    
+    @classmethod
+    def from_dict(cls, char_data: dict) -> "Character":
+        """Reconstruye un personaje a partir de to_dict()"""
+        character = cls(char_data["name"], char_data["race"], char_data["class"])
+        
+        # Restaurar stats
+        for key, value in char_data["stats"].items():
+            setattr(character.stats, key, value)
+        for key, value in char_data["attributes"].items():
+            setattr(character.attributes, key, value)
+        
+        # Restaurar otros datos
+        character.level = char_data["level"]
+        character.experience = char_data["experience"]
+        character.exp_to_next = char_data["exp_to_next"]
+        character.improvement_points = char_data.get("improvement_points", 0)
+        character.gold = char_data["gold"]
+        character.hp_actual = char_data["hp_actual"]
+        character.mana_actual = char_data["mana_actual"]
+        # Las partidas antiguas no guardaban los máximos: se deducen de los stats y el nivel
+        gained = character.level - 1
+        character.hp_max = char_data.get("hp_max", character.stats.vitalidad + ProgressionTable.HP_PER_LEVEL * gained)
+        character.mana_max = char_data.get("mana_max", character.stats.mana + ProgressionTable.MANA_PER_LEVEL * gained)
+        character.kills = char_data.get("kills", 0)
+        character.deaths = char_data.get("deaths", 0)
+        character.inventory = Inventory.from_saved(char_data.get("inventory"))
+        for slot, name in char_data.get("equipment", {}).items():
+            if slot in character.equipment:
+                character.equipment[slot] = name
+        character.status_effects = StatusEffectEngine.from_list(char_data.get("status_effects", []))
+        return character
 
 class Enemy:
     """Clase simple para enemigos"""
     
-    ENEMY_TYPES = {
-        "Lobo Sombrío": {
-            "cr": 1,
-            "hp": 150,
-            "attack": "1d20+10",
-            "defense": "1d15+10",
-            "exp": 50,
-            "gold_range": (10, 30),
-            "description": "Un lobo con ojos rojos brillantes y colmillos como dagas"
-        },
-        "Goblin Salvaje": {
-            "cr": 2,
-            "hp": 350,
-            "attack": "1d40+15",
-            "defense": "1d25+15",
-            "exp": 100,
-            "gold_range": (20, 50),
-            "description": "Un goblin cubierto de cicatrices que gruñe amenazante"
-        },
-        "Orco Berserker": {
-            "cr": 3,
-            "hp": 750,
-            "attack": "1d60+30",
-            "defense": "1d40+30",
-            "exp": 200,
-            "gold_range": (40, 100),
-            "description": "Un orco masivo con músculos como rocas y un hacha gigante"
-        },
-        "Espectro Errante": {
-            "cr": 4,
-            "hp": 500,
-            "attack": "1d80+40",
-            "defense": "1d30+20",
-            "exp": 300,
-            "gold_range": (60, 150),
-            "description": "Una figura etérea que flota, emanando frío mortal"
-        }
-    }
+    # Tabla respaldada por el registro de contenido (contenido/enemigos*.json)
+    ENEMY_TYPES = CONTENT.enemies
+    
+    # Cada enemigo es un combate distinto en la telemetría
+    _ids = itertools.count(1)
     
     def __init__(self, enemy_type: str):
         self.type = enemy_type
@@ -339,8 +1016,28 @@ class Enemy:
         self.description = data["description"]
         self.exp_reward = data["exp"]
         self.gold_range = data["gold_range"]
+        self.on_hit = data.get("on_hit")
+        self.id = next(self._ids)
+        self.status_effects = StatusEffectEngine()
+        self.defending = False       # el próximo ataque del jugador le hace la mitad
+        self.special_cooldown = 0    # turnos hasta poder usar el golpe especial
         self.is_alive = True
     
+    def effective_dice(self, dice: str, faces_stat: str, bonus_stat: str) -> str:
+        if not self.status_effects:
+            return dice
+        spec = DiceSystem.parse(dice)
+        return str(DiceSpec(spec.cantidad, max(1, self.status_effects.derived(faces_stat, spec.caras)),
+                            self.status_effects.derived(bonus_stat, spec.bonus)))
+    
+    def get_attack_dice(self) -> str:
+        """Dados de ataque con los efectos activos"""
+        return self.effective_dice(self.attack_dice, "ataque", "fortaleza")
+    
+    def get_defense_dice(self) -> str:
+        """Dados de defensa con los efectos activos"""
+        return self.effective_dice(self.defense_dice, "defensa", "resistencia")
+    
     def take_damage(self, damage: int):
         """Recibe daño"""
         self.hp_current = max(0, self.hp_current - damage)
@@ -350,8 +1047,15 @@ class Enemy:
 class CombatSystem:
     """Sistema de combate del juego"""
     
-    def __init__(self):
+    # Acciones tácticas de los enemigos (ver EnemyTactics)
+    SPECIAL_MULTIPLIER = 1.5   # el golpe especial multiplica la tirada de ataque
+    SPECIAL_COOLDOWN = 3       # turnos del enemigo hasta poder repetirlo
+    ENEMY_FLEE_CHANCE = 0.25
+    ENEMY_FLEE_BELOW = 0.2     # solo intenta huir por debajo de esta fracción de HP
+    
+    def __init__(self, telemetry: Optional["CombatTelemetry"] = None):
         self.dice = DiceSystem()
+        self.telemetry = telemetry
     
     def calculate_damage(self, attack_roll: int, defense_roll: int) -> int:
         """Calcula el daño según las reglas"""
@@ -361,145 +1065,4999 @@ class CombatSystem:
     def player_attack(self, player: Character, enemy: Enemy) -> dict:
         """Ejecuta un ataque del jugador"""
         attack_roll, attack_desc = self.dice.roll(player.get_attack_dice())
-        defense_roll, defense_desc = self.dice.roll(enemy.defense_dice)
+        defense_roll, defense_desc = self.dice.roll(enemy.get_defense_dice())
         
         damage = self.calculate_damage(attack_roll, defense_roll)
+        enemy_defending = enemy.defending
+        if enemy_defending:
+            # La guardia del enemigo reduce el golpe a la mitad, igual que la del jugador
+            damage = int(damage * 0.5)
+            enemy.defending = False
         enemy.take_damage(damage)
         
-        return {
+        result = {
             "attack_roll": attack_roll,
             "attack_desc": attack_desc,
             "defense_roll": defense_roll,
             "defense_desc": defense_desc,
             "damage": damage,
             "enemy_hp": enemy.hp_current,
-            "enemy_defeated": not enemy.is_alive
+            "enemy_defeated": not enemy.is_alive,
+            "enemy_defending": enemy_defending
         }
+        if self.telemetry:
+            self.telemetry.record("jugador", player, enemy, result, player.get_attack_dice(),
+                                  enemy.get_defense_dice(), enemy.hp_current, result["enemy_defeated"])
+        return result
     
-    def enemy_attack(self, enemy: Enemy, player: Character) -> dict:
-        """Ejecuta un ataque del enemigo"""
-        attack_roll, attack_desc = self.dice.roll(enemy.attack_dice)
+    def enemy_attack(self, enemy: Enemy, player: Character, special: bool = False,
+                     defending: bool = False) -> dict:
+        """
+        Ejecuta un ataque del enemigo (special: golpe especial con la tirada
+        multiplicada; defending: el jugador está en guardia y recibe la mitad)
+        """
+        attack_roll, attack_desc = self.dice.roll(enemy.get_attack_dice())
+        if special:
+            attack_roll = int(attack_roll * self.SPECIAL_MULTIPLIER)
+            attack_desc += f" × {self.SPECIAL_MULTIPLIER} = {attack_roll}"
+            enemy.special_cooldown = self.SPECIAL_COOLDOWN
         defense_roll, defense_desc = self.dice.roll(player.get_defense_dice())
         
         damage = self.calculate_damage(attack_roll, defense_roll)
+        if defending:
+            damage = int(damage * 0.5)
         player.take_damage(damage)
         
-        return {
+        # Estado alterado al impactar (p. ej. Sangrado), según los datos del enemigo
+        effect = None
+        if damage > 0 and enemy.on_hit and random.random() < enemy.on_hit.get("chance", 1.0):
+            effect = enemy.on_hit["effect"]
+            player.status_effects.apply(make_effect(effect, source=enemy.type))
+        
+        result = {
             "attack_roll": attack_roll,
             "attack_desc": attack_desc,
             "defense_roll": defense_roll,
             "defense_desc": defense_desc,
             "damage": damage,
             "player_hp": player.hp_actual,
-            "player_defeated": player.hp_actual <= 0
+            "player_defeated": player.hp_actual <= 0,
+            "player_defending": defending,
+            "effect": effect
         }
+        if self.telemetry:
+            self.telemetry.record("enemigo", player, enemy, result, enemy.get_attack_dice(),
+                                  player.get_defense_dice(), player.hp_actual, result["player_defeated"])
+        return result
 
-# ============= SISTEMA DE IA NARRATIVA =============
+# ============= TÁCTICAS ENEMIGAS =============
 
-class AIGameMaster:
-    """IA que actúa como Game Master"""
+@lru_cache(maxsize=1024)
+def roll_distribution(dice_str: str) -> Tuple[Tuple[int, float], ...]:
+    """Distribución exacta (valor, probabilidad) de una tirada XdY+Z"""
+    spec = DiceSystem.parse(dice_str)
+    if not spec:
+        return ((0, 1.0),)
+    if spec.cantidad == 1:
+        face = 1.0 / spec.caras
+        return tuple((value + spec.bonus, face) for value in range(1, spec.caras + 1))
+    totals = {0: 1.0}
+    face = 1.0 / spec.caras
+    for _ in range(spec.cantidad):
+        step = {}
+        for total, prob in totals.items():
+            for value in range(total + 1, total + spec.caras + 1):
+                step[value] = step.get(value, 0.0) + prob * face
+        totals = step
+    return tuple((total + spec.bonus, prob) for total, prob in sorted(totals.items()))
+
+@lru_cache(maxsize=4096)
+def damage_distribution(attack: str, defense: str, multiplier: float = 1.0,
+                        halved: bool = False) -> Tuple[Tuple[int, float], ...]:
+    """Distribución exacta del daño de un ataque con las reglas de CombatSystem"""
+    damages = {}
+    if halved:
+        for damage, prob in damage_distribution(attack, defense, multiplier):
+            damages[int(damage * 0.5)] = damages.get(int(damage * 0.5), 0.0) + prob
+        return tuple(sorted(damages.items()))
     
-    def __init__(self):
-        self.client = openai.OpenAI(api_key=OPENAI_API_KEY)
-        self.conversation_history = []
-        self.world_context = {
-            "current_location": "",
-            "explored_locations": [],
-            "active_quests": [],
-            "npcs_met": []
+    defense_rolls = roll_distribution(defense)
+    for attack_roll, attack_prob in roll_distribution(attack):
+        attack_roll = int(attack_roll * multiplier)
+        for defense_roll, defense_prob in defense_rolls:
+            damage = max(0, attack_roll - defense_roll)
+            damages[damage] = damages.get(damage, 0.0) + attack_prob * defense_prob
+    return tuple(sorted(damages.items()))
+
+class SearchTimeout(Exception):
+    """Se agotó el presupuesto de tiempo de una decisión táctica"""
+
+@dataclass
+class TacticsMatchup:
+    """Distribuciones y tabla de transposición de un enfrentamiento concreto"""
+    dists: Dict[str, tuple]          # distribuciones de daño por nombre
+    targets: Dict[str, int]          # HP máximo del objetivo de cada distribución
+    transitions: dict = field(default_factory=dict)
+    table: Dict[int, float] = field(default_factory=dict)   # posición empaquetada -> valor
+    moves: Dict[int, int] = field(default_factory=dict)     # raíz -> profundidad completa * nº de acciones + mejor acción
+
+class EnemyTactics:
+    """
+    Decide la acción del enemigo (atacar, golpe especial, defender o huir) por
+    expectimax sobre las distribuciones exactas de daño. El HP se discretiza
+    en cubetas con redondeo estocástico (conserva el HP esperado) y cada
+    posición (profundidad, cubetas de HP, enfriamiento, guardia), empaquetada
+    en un entero, guarda su valor en una tabla de transposición por
+    enfrentamiento, compartida por todos los enemigos y sesiones con las
+    mismas tiradas y efectos. La búsqueda se
+    profundiza ronda a ronda hasta agotar el presupuesto de tiempo y usa la
+    mejor acción de la última profundidad completa.
+    """
+    
+    ACTIONS = ("atacar", "especial", "defender", "huir")
+    BUDGET = 0.002          # segundos por decisión
+    MAX_DEPTH = 8           # rondas: acción del enemigo y respuesta del jugador
+    HP_BUCKETS = 20
+    MAX_MATCHUPS = 64
+    MAX_POSITIONS = 8192    # entre todas las tablas (~155 bytes cada una): el doble de las ~4000 que usa prueba_memoria.py
+    WIN, LOSS, ESCAPE = 1.0, -1.0, -0.8   # valor para el enemigo (huir apenas mejor que caer)
+    DISCOUNT = 0.97         # por ronda: mejor ganar pronto que tarde (y perder tarde que pronto)
+    
+    def __init__(self, budget: float = BUDGET, max_depth: int = MAX_DEPTH):
+        self.budget = budget
+        self.max_depth = max_depth
+        self.matchups: "OrderedDict[tuple, TacticsMatchup]" = OrderedDict()
+        self.deadline = 0.0
+        self.stats = {"decisions": 0, "nodes": 0, "cache_hits": 0, "timeouts": 0, "max_depth": 0}
+        # Una búsqueda a la vez: el plazo y las tablas son compartidos y el reparto
+        # de puntos o el entrenamiento pueden buscar desde otro hilo
+        self._lock = threading.RLock()
+    
+    def matchup(self, enemy: Enemy, character: Character) -> TacticsMatchup:
+        """Enfrentamiento (con su tabla) para las tiradas y efectos actuales"""
+        return self.matchup_for(enemy.get_attack_dice(), enemy.get_defense_dice(), enemy.hp_max,
+                                character.get_attack_dice(), character.get_defense_dice(), character.hp_max,
+                                enemy.status_effects.damage_per_turn, character.status_effects.damage_per_turn)
+    
+    def matchup_for(self, enemy_attack: str, enemy_defense: str, enemy_hp: int, player_attack: str,
+                    player_defense: str, player_hp: int, enemy_dot: int = 0, player_dot: int = 0) -> TacticsMatchup:
+        """Enfrentamiento a partir de las tiradas, el HP máximo y el daño por turno de cada bando"""
+        with self._lock:
+            key = (enemy_attack, enemy_defense, player_attack, player_defense, enemy_hp, player_hp,
+                   enemy_dot, player_dot)
+            matchup = self.matchups.get(key)
+            if matchup:
+                self.matchups.move_to_end(key)
+                return matchup
+            
+            special = CombatSystem.SPECIAL_MULTIPLIER
+            matchup = TacticsMatchup(
+                dists={
+                    "ataque": damage_distribution(enemy_attack, player_defense),
+                    "ataque_guardia": damage_distribution(enemy_attack, player_defense, halved=True),
+                    "especial": damage_distribution(enemy_attack, player_defense, special),
+                    "especial_guardia": damage_distribution(enemy_attack, player_defense, special, True),
+                    "jugador": damage_distribution(player_attack, enemy_defense),
+                    "jugador_guardia": damage_distribution(player_attack, enemy_defense, halved=True),
+                    "efectos_jugador": ((player_dot, 1.0),),
+                    "efectos_enemigo": ((enemy_dot, 1.0),),
+                },
+                targets={"ataque": player_hp, "ataque_guardia": player_hp, "especial": player_hp,
+                         "especial_guardia": player_hp, "efectos_jugador": player_hp, "jugador": enemy_hp,
+                         "jugador_guardia": enemy_hp, "efectos_enemigo": enemy_hp}
+            )
+            self.matchups[key] = matchup
+            if len(self.matchups) > self.MAX_MATCHUPS:
+                self.matchups.popitem(last=False)
+            return matchup
+    
+    def bucket(self, hp: int, hp_max: int) -> int:
+        """Cubeta de HP (0 solo si está muerto)"""
+        if hp <= 0:
+            return 0
+        return min(self.HP_BUCKETS, max(1, round(hp * self.HP_BUCKETS / hp_max)))
+    
+    def choose(self, enemy: Enemy, character: Character, player_defending: bool = False) -> str:
+        """Acción del enemigo para este turno"""
+        return self.decide(self.matchup(enemy, character), self.bucket(enemy.hp_current, enemy.hp_max),
+                           self.bucket(character.hp_actual, character.hp_max), enemy.special_cooldown,
+                           player_defending)
+    
+    def decide(self, matchup: TacticsMatchup, enemy_hp: int, player_hp: int, cooldown: int,
+               player_defending: bool = False, budget: Optional[float] = None) -> str:
+        """Acción del enemigo en una posición ya discretizada (cubetas de HP)"""
+        with self._lock:
+            self.stats["decisions"] += 1
+            self.deadline = time.perf_counter() + (self.budget if budget is None else budget)
+            state = (enemy_hp, player_hp, cooldown, player_defending)
+            # Cada raíz recuerda su profundidad completa más honda y la búsqueda sigue desde ahí.
+            # Sin ninguna completa se ataca; lo ya calculado queda en la tabla para la próxima
+            root = self.position(0, *state)
+            known = matchup.moves.pop(root, None)
+            completed, index = divmod(known, len(self.ACTIONS)) if known is not None else (0, 0)
+            for depth in range(completed + 1, self.max_depth + 1):
+                try:
+                    # La raíz se evalúa acción a acción para quedarse con la mejor
+                    best = max(self.action_values(matchup, depth, *state), key=lambda item: item[1])[0]
+                except SearchTimeout:
+                    self.stats["timeouts"] += 1
+                    break
+                completed, index = depth, self.ACTIONS.index(best)
+            if completed:
+                matchup.moves[root] = completed * len(self.ACTIONS) + index
+            self.stats["max_depth"] = max(self.stats["max_depth"], completed)
+            
+            self.trim()
+            return self.ACTIONS[index]
+    
+    def trim(self):
+        """
+        Vuelve al límite de posiciones descartando las usadas hace más tiempo:
+        primero las de los enfrentamientos menos recientes (el que se queda
+        vacío se suelta entero) y después las más antiguas del actual.
+        """
+        excess = sum(len(m.table) + len(m.moves) for m in self.matchups.values()) - self.MAX_POSITIONS
+        while excess > 0:
+            key, oldest = next(iter(self.matchups.items()))
+            for table in (oldest.moves, oldest.table):
+                for position in list(itertools.islice(table, excess)):
+                    del table[position]
+                    excess -= 1
+            if not oldest.table and len(self.matchups) > 1:
+                del self.matchups[key]
+    
+    def transition(self, matchup: TacticsMatchup, dist: str, bucket: int) -> tuple:
+        """Cubetas resultantes (cubeta, probabilidad) de aplicar una distribución de daño"""
+        key = (dist, bucket)
+        outcomes = matchup.transitions.get(key)
+        if outcomes is not None:
+            return outcomes
+        scale = self.HP_BUCKETS / matchup.targets[dist]
+        merged = {}
+        for damage, prob in matchup.dists[dist]:
+            position = min(float(self.HP_BUCKETS), bucket - damage * scale)
+            if position <= 0:
+                merged[0] = merged.get(0, 0.0) + prob
+                continue
+            low = int(position)
+            fraction = position - low
+            merged[low] = merged.get(low, 0.0) + prob * (1 - fraction)
+            if fraction:
+                merged[low + 1] = merged.get(low + 1, 0.0) + prob * fraction
+        outcomes = matchup.transitions[key] = tuple(merged.items())
+        return outcomes
+    
+    def position(self, depth: int, enemy_hp: int, player_hp: int, cooldown: int, player_defending: bool) -> int:
+        """Clave entera de una posición (un entero ocupa menos que una tupla de cinco)"""
+        buckets = self.HP_BUCKETS + 1
+        key = ((depth * buckets + enemy_hp) * buckets + player_hp) * (CombatSystem.SPECIAL_COOLDOWN + 1) + cooldown
+        return key * 2 + player_defending
+    
+    def value(self, matchup: TacticsMatchup, depth: int, enemy_hp: int, player_hp: int,
+              cooldown: int, player_defending: bool) -> float:
+        """Valor esperado para el enemigo de su mejor acción en este estado"""
+        key = self.position(depth, enemy_hp, player_hp, cooldown, player_defending)
+        cached = matchup.table.pop(key, None)
+        if cached is not None:
+            # Se reinserta al final: el orden de la tabla es el de uso (LRU para trim)
+            matchup.table[key] = cached
+            self.stats["cache_hits"] += 1
+            return cached
+        if time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        self.stats["nodes"] += 1
+        
+        best = max(q for _, q in self.action_values(matchup, depth, enemy_hp, player_hp,
+                                                    cooldown, player_defending))
+        matchup.table[key] = best
+        return best
+    
+    def action_values(self, matchup: TacticsMatchup, depth: int, enemy_hp: int, player_hp: int,
+                      cooldown: int, player_defending: bool):
+        """(acción, valor esperado) de cada acción posible del enemigo en este estado"""
+        guard = "_guardia" if player_defending else ""
+        next_cooldown = max(0, cooldown - 1)
+        can_flee = enemy_hp <= CombatSystem.ENEMY_FLEE_BELOW * self.HP_BUCKETS
+        for action in self.ACTIONS:
+            if action == "huir" and not can_flee:
+                continue
+            if action == "atacar" or action == "especial":
+                if action == "especial" and cooldown:
+                    continue
+                dist, after = (("especial", CombatSystem.SPECIAL_COOLDOWN) if action == "especial"
+                               else ("ataque", next_cooldown))
+                q = 0.0
+                for bucket, prob in self.transition(matchup, dist + guard, player_hp):
+                    q += prob * (self.WIN if bucket == 0 else
+                                 self.player_turn(matchup, depth, enemy_hp, bucket, after, False))
+            elif action == "defender":
+                q = self.player_turn(matchup, depth, enemy_hp, player_hp, next_cooldown, True)
+            else:
+                flee = CombatSystem.ENEMY_FLEE_CHANCE
+                q = flee * self.ESCAPE + (1 - flee) * self.player_turn(matchup, depth, enemy_hp, player_hp,
+                                                                       next_cooldown, False)
+            yield action, q
+    
+    def player_turn(self, matchup: TacticsMatchup, depth: int, enemy_hp: int, player_hp: int,
+                    cooldown: int, enemy_defending: bool) -> float:
+        """Nodo de azar: efectos por turno y ataque del jugador (se supone que siempre ataca)"""
+        attack = "jugador_guardia" if enemy_defending else "jugador"
+        total = 0.0
+        for player_bucket, p_player in self.transition(matchup, "efectos_jugador", player_hp):
+            if player_bucket == 0:
+                total += p_player * self.WIN
+                continue
+            for enemy_bucket, p_enemy in self.transition(matchup, "efectos_enemigo", enemy_hp):
+                if enemy_bucket == 0:
+                    total += p_player * p_enemy * self.LOSS
+                    continue
+                for hit_bucket, p_hit in self.transition(matchup, attack, enemy_bucket):
+                    if hit_bucket == 0:
+                        result = self.LOSS
+                    elif depth == 1:
+                        result = 0.5 * (hit_bucket - player_bucket) / self.HP_BUCKETS
+                    else:
+                        result = self.DISCOUNT * self.value(matchup, depth - 1, hit_bucket, player_bucket,
+                                                            cooldown, False)
+                    total += p_player * p_enemy * p_hit * result
+        return total
+
+# Motor táctico compartido: las tablas sirven a todos los enemigos y sesiones del proceso
+ENEMY_TACTICS = EnemyTactics()
+
+# ============= CLIENTE DE NARRACIÓN RESILIENTE =============
+
+class NarrationUnavailable(Exception):
+    """El servicio de narración no respondió a tiempo o está fuera de servicio"""
+
+class CircuitBreaker:
+    """Corta las llamadas al servicio tras varios fallos consecutivos"""
+
+    CLOSED = "cerrado"
+    OPEN = "abierto"
+    HALF_OPEN = "semiabierto"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """Estado actual del cortocircuito"""
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow_request(self) -> bool:
+        """Indica si se puede llamar al servicio (en semiabierto pasa una sola sonda)"""
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        """Registra una llamada exitosa y cierra el circuito"""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        """Registra un fallo y abre el circuito al superar el umbral"""
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+class ConnectionPool:
+    """
+    Cliente httpx compartido con pool de conexiones, keep-alive y HTTP/2.
+    Permite precalentar la conexión (TCP + TLS) en segundo plano y cuenta
+    cuántas peticiones reutilizan una conexión ya abierta.
+    """
+
+    def __init__(self, max_connections: int = 20, max_keepalive: int = 10,
+                 keepalive_expiry: float = 120.0, http2: bool = HTTP2_AVAILABLE):
+        self.http2 = http2
+        self.stats = {
+            "requests": 0,
+            "new_connections": 0,
+            "tls_handshakes": 0,
+            "http2_requests": 0
         }
-        
-        # Prompt del sistema
-        self.system_prompt = """Eres el Narrador de la Habitación del Tiempo, una dimensión mística donde los guerreros entrenan.
+        self._lock = threading.Lock()
+        self.http_client = httpx.Client(
+            http2=http2,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_keepalive,
+                                keepalive_expiry=keepalive_expiry),
+            timeout=httpx.Timeout(NARRATION_TIMEOUT, connect=5.0),
+            event_hooks={"request": [self._on_request], "response": [self._on_response]}
+        )
 
-REGLAS IMPORTANTES:
-1. Siempre describe las escenas de forma inmersiva y atmosférica
-2. La Habitación del Tiempo es un espacio infinito con diferentes zonas de entrenamiento
-3. Cuando el jugador busque enemigos o explore, describe lo que encuentra
-4. NO realices tiradas de dados - solo describe las situaciones
-5. Cuando aparezca un enemigo, describe su apariencia y espera la acción del jugador
-6. Las descripciones deben ser concisas pero evocativas (máximo 3 párrafos)
-7. Siempre termina con una pregunta o situación que requiera decisión del jugador
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _trace(self, event_name: str, info: dict):
+        """Eventos de httpcore: detecta conexiones nuevas y handshakes TLS"""
+        if event_name == "connection.connect_tcp.complete":
+            self._count("new_connections")
+        elif event_name == "connection.start_tls.complete":
+            self._count("tls_handshakes")
+
+    def _on_request(self, request: httpx.Request):
+        request.extensions["trace"] = self._trace
+
+    def _on_response(self, response: httpx.Response):
+        self._count("requests")
+        if response.http_version == "HTTP/2":
+            self._count("http2_requests")
+
+    def reuse_stats(self) -> dict:
+        """Estadísticas de reutilización de conexiones"""
+        with self._lock:
+            stats = dict(self.stats)
+        reused = max(0, stats["requests"] - stats["new_connections"])
+        stats["reused"] = reused
+        stats["reuse_ratio"] = reused / stats["requests"] if stats["requests"] else 0.0
+        return stats
+
+    def prewarm(self, url: str) -> threading.Thread:
+        """Abre la conexión en segundo plano para que la primera narración no pague el handshake"""
+        def warm():
+            try:
+                self.http_client.get(url, timeout=5.0)
+            except httpx.HTTPError:
+                pass
+
+        thread = threading.Thread(target=warm, daemon=True, name="precalentar-conexion")
+        thread.start()
+        return thread
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+def get_connection_pool() -> ConnectionPool:
+    """Pool de conexiones compartido por todos los clientes de narración"""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = ConnectionPool()
+        return _shared_pool
+
+class ResilientNarrationClient:
+    """
+    Envoltorio del cliente de OpenAI con plazo por petición, reintentos con
+    retroceso exponencial y jitter, cortocircuito y peticiones de cobertura
+    (hedging): si la respuesta tarda más que el p95 observado se lanza una
+    segunda petición y se usa la primera que llegue.
+    """
+
+    RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+    def __init__(self, client, timeout: float = NARRATION_TIMEOUT, max_retries: int = 3,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 hedge: bool = NARRATION_HEDGING, hedge_min_samples: int = 20,
+                 breaker: Optional[CircuitBreaker] = None):
+        # Los reintentos los gestionamos aquí, no dentro del SDK
+        self.client = client.with_options(max_retries=0)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = deque(maxlen=200)
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="narracion") if hedge else None
+        self.stats = {
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "short_circuited": 0,
+            "hedges": 0,
+            "hedge_wins": 0
+        }
+
+    def p95_latency(self) -> Optional[float]:
+        """Latencia p95 de las últimas respuestas, o None sin muestras suficientes"""
+        if len(self.latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def is_retryable(self, error: Exception) -> bool:
+        """Determina si un error merece reintento (timeouts, 429 y 5xx)"""
+        if isinstance(error, (TimeoutError, openai.APITimeoutError, openai.APIConnectionError)):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in self.RETRYABLE_STATUS
+        return False
+
+    def backoff_delay(self, attempt: int, error: Optional[Exception] = None) -> float:
+        """Retroceso exponencial con jitter completo, respetando Retry-After"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                delay = max(delay, float(response.headers.get("retry-after", 0)))
+            except (TypeError, ValueError):
+                pass
+        return delay
+
+    def _call(self, timeout: float, kwargs: dict):
+        """Una sola petición con su propio plazo"""
+        return self.client.with_options(timeout=timeout).chat.completions.create(**kwargs)
+
+    def _hedged_call(self, timeout: float, kwargs: dict):
+        """Petición con cobertura: lanza una segunda si la primera supera el p95"""
+        hedge_delay = self.p95_latency()
+        if self._executor is None or hedge_delay is None or hedge_delay >= timeout:
+            return self._call(timeout, kwargs)
+
+        start = time.monotonic()
+        primary = self._executor.submit(self._call, timeout, kwargs)
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        self.stats["hedges"] += 1
+        backup = self._executor.submit(self._call, max(0.1, timeout - (time.monotonic() - start)), kwargs)
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, timeout - (time.monotonic() - start)),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is backup:
+                        self.stats["hedge_wins"] += 1
+                    return future.result()
+                error = future.exception()
+        raise error or TimeoutError("sin respuesta dentro del plazo")
+
+    def create(self, **kwargs):
+        """Equivalente a chat.completions.create con plazo, reintentos y cortocircuito"""
+        if not self.breaker.allow_request():
+            self.stats["short_circuited"] += 1
+            raise NarrationUnavailable("cortocircuito abierto")
+
+        self.stats["requests"] += 1
+        deadline = time.monotonic() + self.timeout
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            start = time.monotonic()
+            try:
+                response = self._hedged_call(remaining, kwargs) if self.hedge else self._call(remaining, kwargs)
+                self.latencies.append(time.monotonic() - start)
+                self.breaker.record_success()
+                return response
+            except Exception as e:
+                last_error = e
+                if not self.is_retryable(e):
+                    break
+
+            if attempt < self.max_retries:
+                delay = self.backoff_delay(attempt, last_error)
+                if time.monotonic() + delay >= deadline:
+                    break
+                self.stats["retries"] += 1
+                time.sleep(delay)
+
+        self.stats["failures"] += 1
+        self.breaker.record_failure()
+        raise NarrationUnavailable(str(last_error) if last_error else "plazo agotado") from last_error
+
+class OfflineNarrator:
+    """Narrador local de respaldo cuando el servicio de IA no está disponible"""
+
+    TEMPLATES = {
+        "explorar": [
+            "Avanzas entre la bruma blanca de la Habitación. El horizonte se pliega sobre sí mismo y a lo lejos distingues siluetas que podrían ser montañas flotantes. ¿Hacia dónde te diriges?",
+            "El suelo cambia bajo tus pies: arena, luego roca, luego nada. La Habitación reacomoda sus zonas a tu alrededor. ¿Qué haces?"
+        ],
+        "descansar": [
+            "El silencio de la Habitación te envuelve. Por un instante el tiempo parece detenerse y recuperas el aliento. ¿Qué harás ahora?"
+        ],
+        "hablar": [
+            "Tu voz se pierde en la inmensidad. Solo el eco de la Habitación te responde, distorsionado y lejano. ¿Qué haces?"
+        ],
+        "default": [
+            "Las energías de la Habitación del Tiempo vibran a tu alrededor mientras actúas. Nada parece interponerse en tu camino... por ahora. ¿Qué harás a continuación?",
+            "Un pulso de energía recorre la dimensión. Sientes que la Habitación observa cada uno de tus movimientos. ¿Cuál es tu siguiente paso?"
+        ]
+    }
+
+    KEYWORDS = {
+        "explorar": ["explorar", "caminar", "avanzar", "buscar", "viajar", "montaña", "bosque", "desierto"],
+        "descansar": ["descansar", "dormir", "meditar", "sentarse"],
+        "hablar": ["hablar", "gritar", "preguntar", "llamar", "decir"]
+    }
+
+    def narrate(self, player_input: str, character: Character) -> str:
+        """Genera una narración genérica a partir de plantillas"""
+        text = player_input.lower()
+        category = "default"
+        for name, keywords in self.KEYWORDS.items():
+            if any(keyword in text for keyword in keywords):
+                category = name
+                break
+        return f"{character.name}: " + random.choice(self.TEMPLATES[category])
+
+# ============= MEMORIA SEMÁNTICA LOCAL =============
+
+@dataclass
+class Memory:
+    """Recuerdo indexado del GM: narración de un turno o evento del mundo"""
+    kind: str
+    text: str
+    turn: int
+
+class MemoryIndex:
+    """
+    Índice vectorial local de recuerdos: embeddings TF-IDF con hashing de
+    palabras y bigramas (sin dependencias) y búsqueda exacta por producto
+    escalar sobre un índice invertido. Solo se recorren las listas de los
+    términos de la consulta, así que el coste no crece con recuerdos ajenos a ella.
+    Cada lista guarda identificadores y pesos en dos arrays compactos (4 bytes
+    por entrada cada uno en lugar de una tupla con su float).
+    En partidas largas se olvidan los recuerdos episódicos más antiguos por
+    bloques; los hechos del mundo (lugares, misiones, personajes) se conservan.
+    """
+    
+    MAX_MEMORIES = 500
+    FORGET_BLOCK = 100
+    EPISODIC = ("turno", "combate", "entrenamiento")
+    DIMENSIONS = 1 << 20
+    STOPWORDS = {"que", "los", "las", "del", "con", "por", "para", "una", "uno", "sus", "como",
+                 "mas", "pero", "sin", "sobre", "entre", "hacia", "desde", "este", "esta", "esto",
+                 "ese", "esa", "eso", "muy", "hay", "son", "fue", "ser", "estas", "tus", "mis",
+                 "accion", "jugador"}
+    
+    def __init__(self, max_memories: int = MAX_MEMORIES):
+        self.memories: List[Memory] = []
+        self.postings: Dict[int, Tuple[array.array, array.array]] = {}
+        self.doc_freq: Dict[int, int] = {}
+        self.max_memories = max_memories
+        self.forgotten = 0
+        self._next_forget = max_memories + self.FORGET_BLOCK
+    
+    def __len__(self) -> int:
+        # Total histórico (incluidos los olvidados): la línea temporal lo usa como marca
+        return self.forgotten + len(self.memories)
+    
+    def features(self, text: str) -> Dict[int, int]:
+        """Frecuencia de cada término (palabra o bigrama) por cubeta de hashing"""
+        words = [w for w in normalize_command_text(text).split() if len(w) > 2 and w not in self.STOPWORDS]
+        counts = {}
+        for token in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            bucket = zlib.crc32(token.encode("utf-8")) & (self.DIMENSIONS - 1)
+            counts[bucket] = counts.get(bucket, 0) + 1
+        return counts
+    
+    def idf(self, bucket: int) -> float:
+        return math.log((1 + len(self.memories)) / (1 + self.doc_freq.get(bucket, 0))) + 1
+    
+    def add(self, kind: str, text: str, turn: int) -> int:
+        """Indexa un recuerdo y devuelve su identificador"""
+        doc_id = len(self.memories)
+        self.memories.append(Memory(kind, text, turn))
+        
+        weights = {bucket: 1 + math.log(count) for bucket, count in self.features(text).items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        for bucket, weight in weights.items():
+            ids, doc_weights = self.postings.setdefault(bucket, (array.array("i"), array.array("f")))
+            ids.append(doc_id)
+            doc_weights.append(weight / norm)
+            self.doc_freq[bucket] = self.doc_freq.get(bucket, 0) + 1
+        
+        if len(self.memories) >= self._next_forget:
+            self.forget(len(self.memories) - self.max_memories)
+            self._next_forget = len(self.memories) + self.FORGET_BLOCK
+        return doc_id
+    
+    def forget(self, count: int):
+        """Olvida los `count` recuerdos episódicos más antiguos y renumera el índice"""
+        dropped = set()
+        for doc_id, memory in enumerate(self.memories):
+            if len(dropped) == count:
+                break
+            if memory.kind in self.EPISODIC:
+                dropped.add(doc_id)
+        if not dropped:
+            return
+        
+        new_ids = {}
+        kept = []
+        for doc_id, memory in enumerate(self.memories):
+            if doc_id not in dropped:
+                new_ids[doc_id] = len(kept)
+                kept.append(memory)
+        self.memories = kept
+        self.forgotten += len(dropped)
+        
+        for bucket, (ids, doc_weights) in list(self.postings.items()):
+            kept_ids = array.array("i", (new_ids[doc_id] for doc_id in ids if doc_id in new_ids))
+            if kept_ids:
+                kept_weights = array.array("f", (weight for doc_id, weight in zip(ids, doc_weights)
+                                                 if doc_id in new_ids))
+                self.postings[bucket] = (kept_ids, kept_weights)
+                self.doc_freq[bucket] = len(kept_ids)
+            else:
+                del self.postings[bucket]
+                del self.doc_freq[bucket]
+    
+    def search(self, query: str, k: int = 5, before_turn: Optional[int] = None) -> List[Memory]:
+        """Los k recuerdos más parecidos a la consulta (opcionalmente anteriores a un turno)"""
+        scores = {}
+        for bucket, count in self.features(query).items():
+            postings = self.postings.get(bucket)
+            if not postings:
+                continue
+            weight = (1 + math.log(count)) * self.idf(bucket)
+            for doc_id, doc_weight in zip(*postings):
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight * doc_weight
+        
+        if before_turn is not None:
+            memories = self.memories
+            scores = {doc_id: score for doc_id, score in scores.items() if memories[doc_id].turn < before_turn}
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [self.memories[doc_id] for doc_id, _ in best]
+    
+    def truncate(self, size: int):
+        """Olvida los recuerdos posteriores a los `size` primeros (al rebobinar)"""
+        while len(self) > size and self.memories:
+            memory = self.memories.pop()
+            # Sus entradas son las últimas de cada lista porque se añadieron las últimas
+            for bucket in self.features(memory.text):
+                ids, doc_weights = self.postings[bucket]
+                ids.pop()
+                doc_weights.pop()
+                if not ids:
+                    del self.postings[bucket]
+                self.doc_freq[bucket] -= 1
+                if not self.doc_freq[bucket]:
+                    del self.doc_freq[bucket]
+    
+    def to_list(self) -> List[dict]:
+        return [asdict(memory) for memory in self.memories]
+    
+    @classmethod
+    def from_list(cls, entries: List[dict]) -> "MemoryIndex":
+        index = cls()
+        for entry in entries:
+            index.add(entry["kind"], entry["text"], entry["turn"])
+        return index
+
+# ============= MAPA DE ZONAS =============
+
+# Biomas de la Habitación: nombre, símbolo en el mapa, enemigos afines y descripción
+ZONE_BIOMES = {
+    "llanura": {"name": "Llanura Blanca", "symbol": "L", "favored": ["Goblin Salvaje"],
+                "description": "Un vacío blanco sin horizonte donde cada paso pesa el doble."},
+    "desierto": {"name": "Desierto Infinito", "symbol": "D", "favored": ["Espectro Errante"],
+                 "description": "Dunas doradas que se repiten hasta el infinito bajo un sol inmóvil."},
+    "montanas": {"name": "Montañas Flotantes", "symbol": "M", "favored": ["Orco Berserker"],
+                 "description": "Picos de roca suspendidos en el aire, unidos por puentes de energía."},
+    "bosque": {"name": "Bosque Oscuro", "symbol": "B", "favored": ["Lobo Sombrío"],
+               "description": "Árboles negros cuyas copas tapan una luz que no viene de ninguna parte."},
+    "ruinas": {"name": "Ruinas del Eco", "symbol": "R", "favored": ["Espectro Errante", "Goblin Salvaje"],
+               "description": "Columnas rotas donde resuenan los golpes de guerreros de otras eras."},
+}
+ZONE_EPITHETS = ["de los Susurros", "del Eco Eterno", "de la Gravedad Rota", "de los Mil Soles",
+                 "del Silencio", "de las Cadenas", "de Ceniza", "del Viento Helado", "de los Caídos",
+                 "del Tiempo Detenido", "de las Sombras Largas", "del Último Guerrero"]
+DIRECTIONS = {"norte": (0, 1), "sur": (0, -1), "este": (1, 0), "oeste": (-1, 0)}
+
+@lru_cache(maxsize=256)
+def zone_enemy_table(biome: str, danger: int, content_version: int) -> Tuple[Tuple[str, ...], Tuple[float, ...]]:
+    """
+    Enemigos y pesos acumulados de una zona: predominan los de CR cercano al
+    peligro y los afines al bioma. Las zonas con igual bioma y peligro comparten tabla.
+    """
+    favored = ZONE_BIOMES[biome]["favored"]
+    names, weights = [], []
+    for name, data in CONTENT.enemies.items():
+        if data["cr"] > danger + 1:
+            continue
+        weight = 1.0 / (1 + abs(data["cr"] - danger)) ** 2
+        names.append(name)
+        weights.append(weight * 3 if name in favored else weight)
+    if not names:
+        names, weights = [min(CONTENT.enemies, key=lambda name: CONTENT.enemies[name]["cr"])], [1.0]
+    return tuple(names), tuple(itertools.accumulate(weights))
+
+@lru_cache(maxsize=1024)
+def zone_region(seed: int, region_x: int, region_y: int) -> Tuple[str, str]:
+    """Bioma y nombre de una región del mapa (todas sus casillas los comparten)"""
+    rng = random.Random(f"{seed}:región:{region_x}:{region_y}")
+    biome = rng.choice(sorted(ZONE_BIOMES))
+    return biome, f"{ZONE_BIOMES[biome]['name']} {rng.choice(ZONE_EPITHETS)}"
+
+@dataclass
+class Zone:
+    """Casilla del mapa: lo generado sale de la semilla; visitas, victorias y nombre propio se guardan"""
+    x: int
+    y: int
+    biome: str
+    name: str
+    danger: int
+    enemies: Tuple[str, ...]
+    cum_weights: Tuple[float, ...]
+    visits: int = 0
+    kills: int = 0
+    custom_name: Optional[str] = None
+    
+    @property
+    def title(self) -> str:
+        return self.custom_name or self.name
+    
+    def encounter_table(self) -> Tuple[Tuple[str, ...], Tuple[float, ...]]:
+        """Enemigos y pesos acumulados de la zona, como ContentRegistry.encounter_table"""
+        return self.enemies, self.cum_weights
+    
+    def roll_enemy(self) -> str:
+        return random.choices(self.enemies, cum_weights=self.cum_weights)[0]
+
+class WorldMap:
+    """
+    Mapa infinito de zonas. Cada zona se genera de forma determinista a partir
+    de la semilla del mundo y sus coordenadas (el bioma y el nombre por
+    regiones de REGION_SIZE casillas, el peligro por anillos alrededor de la
+    entrada), así que nada de lo generado se guarda. Las zonas se generan por
+    fragmentos de CHUNK_SIZE x CHUNK_SIZE al primer acceso y solo MAX_CHUNKS
+    fragmentos quedan cargados (LRU). Lo único persistente son los cambios
+    (visitas, victorias, nombres dados por el GM) de las zonas tocadas, de
+    modo que memoria y partida guardada crecen con lo que el jugador recorre.
+    """
+    
+    CHUNK_SIZE = 8
+    REGION_SIZE = 4
+    DANGER_RING = 3          # casillas por nivel de peligro desde la entrada
+    DANGER_JITTER = 0.2      # probabilidad de que una zona sea un nivel más peligrosa
+    MAX_CHUNKS = 16          # ~25 KB por fragmento cargado
+    ENTRANCE = "Entrada de la Habitación del Tiempo"
+    
+    def __init__(self, seed: Optional[int] = None):
+        if seed is None:
+            seed = int(WORLD_SEED) if WORLD_SEED else random.getrandbits(32)
+        self.seed = seed
+        self.chunks: "OrderedDict[Tuple[int, int], Dict[Tuple[int, int], Zone]]" = OrderedDict()
+        # Cambios por fragmento y zona: [visitas, victorias, nombre propio]
+        self.touched: Dict[Tuple[int, int], Dict[Tuple[int, int], list]] = {}
+        self.content_version = CONTENT.version
+        self.stats = {"generated": 0, "hits": 0, "evicted": 0}
+    
+    def chunk_of(self, x: int, y: int) -> Tuple[int, int]:
+        return x // self.CHUNK_SIZE, y // self.CHUNK_SIZE
+    
+    def zone(self, x: int, y: int) -> Zone:
+        """Zona de unas coordenadas (genera su fragmento si no está cargado)"""
+        if self.content_version != CONTENT.version:
+            # Las tablas de enemigos dependen del contenido: se regeneran con la semilla
+            self.chunks.clear()
+            self.content_version = CONTENT.version
+        key = self.chunk_of(x, y)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.chunks[key] = self.generate_chunk(key)
+            if len(self.chunks) > self.MAX_CHUNKS:
+                self.chunks.popitem(last=False)
+                self.stats["evicted"] += 1
+        else:
+            self.chunks.move_to_end(key)
+            self.stats["hits"] += 1
+        return chunk[(x, y)]
+    
+    def generate_chunk(self, key: Tuple[int, int]) -> Dict[Tuple[int, int], Zone]:
+        """Todas las zonas de un fragmento con los cambios guardados aplicados"""
+        self.stats["generated"] += 1
+        size = self.CHUNK_SIZE
+        chunk = {}
+        for x in range(key[0] * size, (key[0] + 1) * size):
+            for y in range(key[1] * size, (key[1] + 1) * size):
+                chunk[(x, y)] = self.generate_zone(x, y)
+        for (x, y), (visits, kills, custom_name) in self.touched.get(key, {}).items():
+            zone = chunk[(x, y)]
+            zone.visits, zone.kills, zone.custom_name = visits, kills, custom_name
+        return chunk
+    
+    def generate_zone(self, x: int, y: int) -> Zone:
+        """Zona determinista: misma semilla y coordenadas, misma zona"""
+        biome, name = zone_region(self.seed, x // self.REGION_SIZE, y // self.REGION_SIZE)
+        local = random.Random(f"{self.seed}:zona:{x}:{y}")
+        danger = 1 + max(abs(x), abs(y)) // self.DANGER_RING + (local.random() < self.DANGER_JITTER)
+        if (x, y) == (0, 0):
+            biome, name, danger = "llanura", self.ENTRANCE, 1
+        enemies, cum_weights = zone_enemy_table(biome, danger, CONTENT.version)
+        return Zone(x, y, biome, name, danger, enemies, cum_weights)
+    
+    def touch(self, zone: Zone):
+        """Anota los cambios de una zona para que sobrevivan al descarte y al guardado"""
+        self.touched.setdefault(self.chunk_of(zone.x, zone.y), {})[(zone.x, zone.y)] = [
+            zone.visits, zone.kills, zone.custom_name]
+    
+    def visit(self, x: int, y: int) -> Zone:
+        zone = self.zone(x, y)
+        zone.visits += 1
+        self.touch(zone)
+        return zone
+    
+    def record_kill(self, x: int, y: int):
+        zone = self.zone(x, y)
+        zone.kills += 1
+        self.touch(zone)
+    
+    def rename(self, x: int, y: int, name: str):
+        """Nombre propio de una zona (p. ej. el lugar que narra el GM)"""
+        zone = self.zone(x, y)
+        if zone.title != name:
+            zone.custom_name = name
+            self.touch(zone)
+    
+    def render(self, x: int, y: int, radius: int = 3) -> List[str]:
+        """Filas del mapa alrededor de (x, y), el norte arriba: @ jugador, · sin visitar"""
+        rows = []
+        for row_y in range(y + radius, y - radius - 1, -1):
+            cells = []
+            for cell_x in range(x - radius, x + radius + 1):
+                zone = self.zone(cell_x, row_y)
+                cells.append("@" if (cell_x, row_y) == (x, y) else
+                             ZONE_BIOMES[zone.biome]["symbol"] if zone.visits else "·")
+            rows.append(" ".join(cells))
+        return rows
+    
+    def to_dict(self) -> dict:
+        """Semilla y cambios de las zonas tocadas (lo generado no se guarda)"""
+        return {"seed": self.seed,
+                "chunks": {f"{cx},{cy}": {f"{x},{y}": delta for (x, y), delta in zones.items()}
+                           for (cx, cy), zones in self.touched.items()}}
+    
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "WorldMap":
+        if not data:
+            return cls()
+        world = cls(data["seed"])
+        for chunk_key, zones in data.get("chunks", {}).items():
+            key = tuple(int(part) for part in chunk_key.split(","))
+            world.touched[key] = {tuple(int(part) for part in zone_key.split(",")): list(delta)
+                                  for zone_key, delta in zones.items()}
+        return world
+
+# ============= SISTEMA DE IA NARRATIVA =============
+
+@dataclass
+class GMResponse:
+    """Resultado estructurado de un turno del Game Master"""
+    narration: str
+    encounter: Optional[str] = None
+    location: Optional[str] = None
+    quest_updates: List[Dict[str, str]] = field(default_factory=list)
+    npcs_met: List[str] = field(default_factory=list)
+
+QUEST_STATUSES = ("nueva", "actualizada", "completada", "fallida")
+
+def build_gm_response_schema() -> dict:
+    """Esquema JSON que debe cumplir la respuesta del GM"""
+    return {
+        "name": "turno_gm",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "additionalProperties": False,
+            "required": ["narration", "encounter", "location", "quest_updates", "npcs_met"],
+            "properties": {
+                "narration": {"type": "string"},
+                "encounter": {"type": ["string", "null"], "enum": list(Enemy.ENEMY_TYPES) + [None]},
+                "location": {"type": ["string", "null"]},
+                "quest_updates": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "additionalProperties": False,
+                        "required": ["title", "status"],
+                        "properties": {
+                            "title": {"type": "string"},
+                            "status": {"type": "string", "enum": list(QUEST_STATUSES)}
+                        }
+                    }
+                },
+                "npcs_met": {"type": "array", "items": {"type": "string"}}
+            }
+        }
+    }
+
+def parse_gm_response(content: str) -> GMResponse:
+    """
+    Valida la respuesta JSON del GM. Los campos inválidos se descartan en lugar
+    de fallar; si el contenido no es JSON se usa como narración en texto plano.
+    """
+    content = (content or "").strip()
+    if not content.startswith("{"):
+        return GMResponse(narration=content)
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return GMResponse(narration=content)
+    if not isinstance(data, dict) or not isinstance(data.get("narration"), str):
+        return GMResponse(narration=content)
+
+    encounter = data.get("encounter")
+    if not isinstance(encounter, str) or encounter not in Enemy.ENEMY_TYPES:
+        encounter = None
+
+    location = data.get("location")
+    location = location.strip() if isinstance(location, str) and location.strip() else None
+
+    quest_updates = []
+    updates = data.get("quest_updates")
+    for update in updates if isinstance(updates, list) else []:
+        if (isinstance(update, dict) and isinstance(update.get("title"), str)
+                and update.get("status") in QUEST_STATUSES and update["title"].strip()):
+            quest_updates.append({"title": update["title"].strip(), "status": update["status"]})
+
+    npcs = data.get("npcs_met")
+    npcs_met = [npc.strip() for npc in npcs if isinstance(npc, str) and npc.strip()] if isinstance(npcs, list) else []
+
+    return GMResponse(narration=data["narration"], encounter=encounter, location=location,
+                      quest_updates=quest_updates, npcs_met=npcs_met)
+
+class AIGameMaster:
+    """IA que actúa como Game Master"""
+    
+    # Mensajes de historial enviados: mínimo y tamaño del bloque con que avanza la ventana.
+    # Lo anterior a la ventana llega al prompt solo a través de la memoria semántica.
+    HISTORY_WINDOW = 4
+    HISTORY_BLOCK = 4
+    HISTORY_KEPT = 64           # mensajes conservados en memoria (múltiplo de HISTORY_BLOCK)
+    MEMORY_TOP_K = 5
+    MEMORY_TEXT_LIMIT = 300     # caracteres por recuerdo en el prompt
+    
+    def __init__(self, offline: bool = False, client=None):
+        # En modo offline (simulaciones, pruebas, bots) solo se usa el narrador local.
+        # `client` permite inyectar un cliente con la interfaz create(**kwargs)
+        self.offline = offline
+        self.client = client
+        if not offline and client is None:
+            if not OPENAI_API_KEY:
+                raise ValueError("Por favor configura OPENAI_API_KEY en tu archivo .env")
+            self.connection_pool = get_connection_pool()
+            openai_client = openai.OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL,
+                                          http_client=self.connection_pool.http_client)
+            self.client = ResilientNarrationClient(openai_client)
+            
+            # Precalentar la conexión mientras el jugador crea su personaje
+            self.connection_pool.prewarm(str(openai_client.base_url))
+        self.offline_narrator = OfflineNarrator()
+        self.world_map = WorldMap()
+        self.conversation_history = []
+        self.memory = MemoryIndex()
+        self.turn_count = 0
+        self.usage_stats = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+        self.world_context = {
+            "current_location": "",
+            "zone": [0, 0],
+            "explored_locations": [],
+            "active_quests": [],
+            "npcs_met": []
+        }
+        
+        # Prompt del sistema y esquema (se reconstruyen si el contenido se recarga)
+        self.refresh_content()
+    
+    def refresh_content(self):
+        """Reconstruye prompt y esquema con la lista actual de enemigos"""
+        self.system_prompt = """Eres el Narrador de la Habitación del Tiempo, una dimensión mística donde los guerreros entrenan.
+
+REGLAS IMPORTANTES:
+1. Siempre describe las escenas de forma inmersiva y atmosférica
+2. La Habitación del Tiempo es un espacio infinito con diferentes zonas de entrenamiento
+3. Cuando el jugador busque enemigos o explore, describe lo que encuentra
+4. NO realices tiradas de dados - solo describe las situaciones
+5. Cuando aparezca un enemigo, describe su apariencia y espera la acción del jugador
+6. Las descripciones deben ser concisas pero evocativas (máximo 3 párrafos)
+7. Siempre termina con una pregunta o situación que requiera decisión del jugador
+
+CONTEXTO DEL MUNDO:
+- La Habitación del Tiempo es una dimensión especial donde el tiempo fluye diferente
+- Contiene diversas zonas: desiertos infinitos, montañas flotantes, bosques oscuros, etc.
+- Los enemigos aparecen como manifestaciones de energía para entrenar
+- El objetivo es volverse más fuerte enfrentando desafíos cada vez mayores
+
+FORMATO DE RESPUESTA (JSON):
+- narration: la narración para el jugador, sin metadatos ni explicaciones
+- encounter: nombre exacto de un enemigo disponible si la acción provoca un combate, o null
+- location: nueva ubicación si el jugador se desplaza a otra zona, o null si no cambia
+- quest_updates: misiones nuevas, actualizadas, completadas o fallidas en este turno
+- npcs_met: nombres de personajes que el jugador conoce por primera vez en este turno
+
+Solo genera un encuentro cuando el jugador busque, explore, cace o provoque un combate.
+Enemigos disponibles (de más débil a más fuerte): """ + ", ".join(Enemy.ENEMY_TYPES)
+        self.response_format = {"type": "json_schema", "json_schema": build_gm_response_schema()}
+        self.content_version = CONTENT.version
+    
+    def generate_narration(self, player_input: str, character: Character) -> str:
+        """Genera narración basada en la entrada del jugador"""
+        return self.generate_turn(player_input, character).narration
+    
+    def generate_turn(self, player_input: str, character: Character) -> GMResponse:
+        """Genera narración, encuentro y cambios del mundo en una sola llamada"""
+        try:
+            request = self.build_turn_request(player_input, character)
+            
+            # Generar respuesta (con plazo, reintentos y narración local de respaldo)
+            try:
+                if self.offline:
+                    raise NarrationUnavailable("modo offline")
+                response = self.client.create(**request)
+            except NarrationUnavailable:
+                response = None
+            
+            return self.complete_turn(response, player_input, character)
+            
+        except Exception as e:
+            return GMResponse(narration=f"*Las energías dimensionales fluctúan... (Error: {str(e)})*")
+    
+    async def generate_turn_async(self, player_input: str, character: Character, create) -> GMResponse:
+        """
+        Variante asíncrona de generate_turn: `create` es una corrutina que recibe
+        los argumentos de chat.completions.create (p. ej. SharedLLMScheduler.submit)
+        """
+        try:
+            request = self.build_turn_request(player_input, character)
+            try:
+                response = None if self.offline else await create(**request)
+            except NarrationUnavailable:
+                response = None
+            return self.complete_turn(response, player_input, character)
+        except Exception as e:
+            return GMResponse(narration=f"*Las energías dimensionales fluctúan... (Error: {str(e)})*")
+    
+    def build_turn_request(self, player_input: str, character: Character) -> dict:
+        """Argumentos de la llamada al modelo para un turno"""
+        CONTENT.ensure_fresh()
+        if self.content_version != CONTENT.version:
+            self.refresh_content()
+        
+        # Sufijo volátil: estado que cambia en cada turno, siempre al final
+        turn_state = f"""Estado actual:
+- HP: {character.hp_actual}/{character.hp_max}
+- Maná: {character.mana_actual}/{character.mana_max}
+- Ataque: {character.get_attack_dice()} | Defensa: {character.get_defense_dice()} (con equipo y efectos)
+- Ubicación actual: {self.world_context.get('current_location') or 'Entrada de la Habitación del Tiempo'}"""
+        zone = self.current_zone()
+        turn_state += (f"\n- Zona: {ZONE_BIOMES[zone.biome]['name']}, peligro {zone.danger}; "
+                       f"enemigos habituales: {', '.join(zone.enemies)}")
+        
+        history = self.history_window()
+        # Solo recuerdos de turnos anteriores al primero de la ventana (turn_count - turnos en ella + 1)
+        memories = self.relevant_memories(player_input, before_turn=self.turn_count - len(history) // 2 + 1)
+        if memories:
+            turn_state = f"{memories}\n\n{turn_state}"
+        
+        messages = self.build_prompt_prefix(character)
+        messages.extend(history)
+        messages.append({"role": "user", "content": f"{turn_state}\n\nAcción del jugador: {player_input}"})
+        
+        return {
+            "model": "gpt-4o-mini",
+            "messages": messages,
+            "max_tokens": 700,
+            "temperature": 0.8,
+            "response_format": self.response_format,
+            "extra_body": {"prompt_cache_key": f"gm-{character.name}"}
+        }
+    
+    def complete_turn(self, response, player_input: str, character: Character) -> GMResponse:
+        """Interpreta la respuesta (None = sin servicio) y actualiza mundo e historial"""
+        if response is not None:
+            self.record_usage(getattr(response, "usage", None))
+            result = parse_gm_response(response.choices[0].message.content)
+        else:
+            result = GMResponse(
+                narration=self.offline_narrator.narrate(player_input, character),
+                encounter=self.determine_encounter(player_input)
+            )
+        
+        # Todos los recuerdos del turno (lugares, misiones, personajes y el propio turno) llevan su número
+        self.turn_count += 1
+        self.apply_world_updates(result)
+        
+        # Agregar turno al historial (sin el estado volátil, para no romper el prefijo)
+        self.conversation_history.append({"role": "user", "content": f"Acción del jugador: {player_input}"})
+        self.conversation_history.append({
+            "role": "assistant",
+            "content": result.narration
+        })
+        self.remember("turno", f"Acción: {player_input}. {result.narration}")
+        
+        # Recortar por bloques enteros no altera la ventana (ni el prefijo cacheado)
+        excess = len(self.conversation_history) - self.HISTORY_KEPT
+        if excess > 0:
+            blocks = -(-excess // self.HISTORY_BLOCK)
+            del self.conversation_history[:blocks * self.HISTORY_BLOCK]
+        
+        return result
+    
+    def character_sheet(self, character: Character) -> str:
+        """
+        Ficha del personaje: solo cambia al subir de nivel o mejorar stats. Los
+        dados son los de los stats base; los efectivos (equipo y efectos) van en
+        el sufijo volátil del turno.
+        """
+        stats = character.stats
+        attrs = ", ".join(f"{name} {value}" for name, value in asdict(character.attributes).items())
+        return f"""Ficha del personaje:
+- Nombre: {character.name}
+- Raza: {character.race}
+- Clase: {character.char_class}
+- Nivel: {character.level}
+- Atributos: {attrs}
+- Ataque base: {DiceSpec(1, max(1, stats.ataque), stats.fortaleza)} | Defensa base: {DiceSpec(1, max(1, stats.defensa), stats.resistencia)}"""
+    
+    def build_prompt_prefix(self, character: Character) -> List[dict]:
+        """Prefijo estable y cacheable: reglas del sistema y ficha del personaje"""
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "system", "content": self.character_sheet(character)}
+        ]
+    
+    def history_window(self) -> List[dict]:
+        """
+        Ventana del historial que avanza por bloques en lugar de deslizarse en cada
+        turno, para que el inicio del historial siga formando parte del prefijo
+        cacheado durante varios turnos (entre HISTORY_WINDOW y HISTORY_WINDOW + HISTORY_BLOCK mensajes)
+        """
+        overflow = len(self.conversation_history) - self.HISTORY_WINDOW
+        start = max(0, (overflow // self.HISTORY_BLOCK) * self.HISTORY_BLOCK)
+        return self.conversation_history[start:]
+    
+    def remember(self, kind: str, text: str):
+        """Indexa un recuerdo en la memoria semántica"""
+        self.memory.add(kind, text[:self.MEMORY_TEXT_LIMIT], self.turn_count)
+    
+    def relevant_memories(self, query: str, before_turn: Optional[int] = None) -> str:
+        """Recuerdos más relevantes para la acción, listos para el prompt"""
+        location = self.world_context.get("current_location") or ""
+        memories = self.memory.search(f"{query} {location}", self.MEMORY_TOP_K, before_turn)
+        if not memories:
+            return ""
+        lines = "\n".join(f"- [{memory.kind}] {memory.text}" for memory in memories)
+        return f"Recuerdos relevantes de la partida:\n{lines}"
+    
+    def record_usage(self, usage):
+        """Acumula el uso de tokens, incluidos los servidos desde la caché de prompts"""
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.usage_stats["calls"] += 1
+        self.usage_stats["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+        self.usage_stats["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+        self.usage_stats["cached_tokens"] += getattr(details, "cached_tokens", 0) or 0
+    
+    def cached_token_ratio(self) -> float:
+        """Fracción de tokens de entrada servidos desde la caché del proveedor"""
+        if not self.usage_stats["prompt_tokens"]:
+            return 0.0
+        return self.usage_stats["cached_tokens"] / self.usage_stats["prompt_tokens"]
+    
+    def request_summary(self, messages: List[dict], fallback: str, max_tokens: int) -> str:
+        """Resumen narrado con una sola llamada; `fallback` si no hay servicio"""
+        if self.offline:
+            return fallback
+        try:
+            response = self.client.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=0.8
+            )
+            self.record_usage(getattr(response, "usage", None))
+            return response.choices[0].message.content
+        except NarrationUnavailable:
+            return fallback
+    
+    def summarize_combat(self, batch: "CombatBatch") -> str:
+        """Narra un lote de eventos de combate con una sola llamada"""
+        summary = self.request_summary(build_combat_summary_messages(batch),
+                                       offline_combat_summary(batch), max_tokens=250)
+        self.remember("combate", summary)
+        return summary
+    
+    def summarize_training(self, report: "TrainingReport", character_name: str) -> str:
+        """Narra un entrenamiento acelerado completo con una sola llamada"""
+        summary = self.request_summary(build_training_summary_messages(report, character_name),
+                                       offline_training_summary(report, character_name), max_tokens=300)
+        self.remember("entrenamiento", summary)
+        return summary
+    
+    def position(self) -> Tuple[int, int]:
+        """Coordenadas de la zona actual en el mapa"""
+        x, y = self.world_context.get("zone") or (0, 0)
+        return x, y
+    
+    def current_zone(self) -> Zone:
+        return self.world_map.zone(*self.position())
+    
+    def apply_world_updates(self, result: GMResponse):
+        """Aplica al contexto del mundo los cambios devueltos por el GM"""
+        if result.location:
+            self.world_context["current_location"] = result.location
+            self.world_map.rename(*self.position(), result.location)
+            explored = self.world_context.setdefault("explored_locations", [])
+            if result.location not in explored:
+                explored.append(result.location)
+                self.remember("lugar", f"Lugar explorado: {result.location}")
+        
+        quests = self.world_context.setdefault("active_quests", [])
+        for update in result.quest_updates:
+            if update["status"] in ("nueva", "actualizada"):
+                if update["title"] not in quests:
+                    quests.append(update["title"])
+            elif update["title"] in quests:
+                quests.remove(update["title"])
+            self.remember("misión", f"Misión {update['status']}: {update['title']}")
+        
+        npcs = self.world_context.setdefault("npcs_met", [])
+        for npc in result.npcs_met:
+            if npc not in npcs:
+                npcs.append(npc)
+                self.remember("personaje", f"Personaje conocido: {npc}")
+    
+    def generate_initial_scene(self, character: Character) -> str:
+        """Genera la escena inicial para un nuevo personaje"""
+        return self.generate_narration(self.initial_scene_prompt(character), character)
+    
+    def initial_scene_prompt(self, character: Character) -> str:
+        """Instrucciones para narrar la entrada de un nuevo personaje"""
+        return f"""
+Un nuevo guerrero entra a la Habitación del Tiempo:
+- Nombre: {character.name}
+- Raza: {character.race}
+- Clase: {character.char_class}
+
+Describe su entrada a esta dimensión de entrenamiento, el ambiente que lo rodea y las primeras sensaciones que experimenta.
+La entrada es un vasto espacio blanco infinito con una extraña gravedad. Menciona las diferentes zonas visibles a lo lejos.
+Termina con opciones claras de qué puede hacer.
+"""
+    
+    def determine_encounter(self, action: str) -> Optional[str]:
+        """Determina si una acción resulta en un encuentro"""
+        encounter_keywords = ["buscar", "explorar", "cazar", "rastrear", "investigar", "entrenar", "pelear"]
+        
+        if any(keyword in action.lower() for keyword in encounter_keywords):
+            if random.random() < 0.7:  # 70% de probabilidad de encuentro
+                # Tabla de la zona actual: peligro por distancia a la entrada y afinidad del bioma
+                return self.current_zone().roll_enemy()
+        return None
+
+# ============= NARRACIÓN DE COMBATE POR LOTES =============
+
+@dataclass
+class FlushPolicy:
+    """Cuándo se narra un lote de eventos de combate"""
+    max_events: int = 6
+    max_seconds: float = 15.0
+    on_fight_end: bool = True
+
+@dataclass
+class CombatBatch:
+    """Lote de eventos de combate pendiente de narrar"""
+    character_name: str
+    enemy_type: str
+    events: List[dict]
+    outcome: Optional[str] = None
+
+def format_combat_event(event: dict) -> str:
+    """Línea compacta que describe un evento de combate para el prompt"""
+    if event["kind"] == "player_attack":
+        return (f"Jugador ataca: {event['attack_roll']} contra defensa {event['defense_roll']}, "
+                f"{event['damage']} de daño (enemigo queda con {event['hp_after']} HP)")
+    if event["kind"] == "enemy_attack":
+        stance = " estando en guardia" if event.get("defending") else ""
+        return (f"Enemigo ataca{stance}: {event['attack_roll']} contra defensa {event['defense_roll']}, "
+                f"{event['damage']} de daño (jugador queda con {event['hp_after']} HP)")
+    return event.get("text", event["kind"])
+
+COMBAT_OUTCOMES = {
+    "victory": "El jugador vence",
+    "fled": "El jugador huye",
+    "defeat": "El jugador cae derrotado",
+    "escaped": "El enemigo escapa"
+}
+
+def build_combat_summary_messages(batch: CombatBatch) -> List[dict]:
+    """Prompt para narrar un lote de eventos en un solo resumen"""
+    lines = "\n".join(f"- {format_combat_event(event)}" for event in batch.events)
+    outcome = f"\nDesenlace: {COMBAT_OUTCOMES.get(batch.outcome, batch.outcome)}" if batch.outcome else ""
+    return [
+        {"role": "system", "content": (
+            "Eres el Narrador de la Habitación del Tiempo. Convierte los resultados mecánicos "
+            "de combate en un único párrafo de narración épica y concisa. No inventes cifras "
+            "ni resultados distintos a los indicados.")},
+        {"role": "user", "content": (
+            f"Combate de {batch.character_name} contra {batch.enemy_type}:\n{lines}{outcome}")}
+    ]
+
+def offline_combat_summary(batch: CombatBatch) -> str:
+    """Resumen local de respaldo cuando no hay servicio de narración"""
+    dealt = sum(e["damage"] for e in batch.events if e["kind"] == "player_attack")
+    taken = sum(e["damage"] for e in batch.events if e["kind"] == "enemy_attack")
+    summary = (f"El choque entre {batch.character_name} y el {batch.enemy_type} se prolonga: "
+               f"{dealt} de daño infligido y {taken} recibido.")
+    if batch.outcome:
+        summary += f" {COMBAT_OUTCOMES.get(batch.outcome, batch.outcome)}."
+    return summary
+
+class CombatNarrationBatcher:
+    """
+    Acumula los resultados de CombatSystem de un combate y entrega lotes
+    según la política de vaciado (número de eventos, tiempo o fin del combate)
+    """
+    
+    def __init__(self, character_name: str, enemy_type: str, policy: Optional[FlushPolicy] = None):
+        self.character_name = character_name
+        self.enemy_type = enemy_type
+        self.policy = policy or FlushPolicy()
+        self.events = []
+        self.first_event_at = None
+    
+    def add_player_attack(self, result: dict) -> Optional[CombatBatch]:
+        """Registra un ataque del jugador (resultado de CombatSystem.player_attack)"""
+        return self.add({"kind": "player_attack", "attack_roll": result["attack_roll"],
+                         "defense_roll": result["defense_roll"], "damage": result["damage"],
+                         "hp_after": result["enemy_hp"]})
+    
+    def add_enemy_attack(self, result: dict, damage: int, hp_after: int,
+                         defending: bool = False) -> Optional[CombatBatch]:
+        """Registra un ataque enemigo con el daño finalmente aplicado"""
+        return self.add({"kind": "enemy_attack", "attack_roll": result["attack_roll"],
+                         "defense_roll": result["defense_roll"], "damage": damage,
+                         "hp_after": hp_after, "defending": defending})
+    
+    def add(self, event: dict) -> Optional[CombatBatch]:
+        """Añade un evento y devuelve un lote si la política indica vaciar"""
+        if not self.events:
+            self.first_event_at = time.monotonic()
+        self.events.append(event)
+        if len(self.events) >= self.policy.max_events:
+            return self.flush()
+        return self.poll()
+    
+    def poll(self) -> Optional[CombatBatch]:
+        """Vacía el lote si lleva más de max_seconds acumulando eventos"""
+        if self.events and time.monotonic() - self.first_event_at >= self.policy.max_seconds:
+            return self.flush()
+        return None
+    
+    def end_fight(self, outcome: str) -> Optional[CombatBatch]:
+        """Cierra el combate y devuelve el último lote con el desenlace"""
+        if not self.policy.on_fight_end:
+            return None
+        return self.flush(outcome)
+    
+    def flush(self, outcome: Optional[str] = None) -> Optional[CombatBatch]:
+        """Entrega los eventos pendientes como un lote"""
+        if not self.events and outcome is None:
+            return None
+        batch = CombatBatch(self.character_name, self.enemy_type, self.events, outcome)
+        self.events = []
+        self.first_event_at = None
+        return batch
+
+class AsyncCombatSummarizer:
+    """Narra lotes de combate de muchas sesiones en paralelo con el cliente asíncrono"""
+    
+    def __init__(self, max_concurrency: int = 8, timeout: float = NARRATION_TIMEOUT):
+        self.client = openai.AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            base_url=OPENAI_BASE_URL,
+            timeout=timeout,
+            max_retries=2,
+            http_client=httpx.AsyncClient(limits=httpx.Limits(max_connections=max_concurrency * 2,
+                                                              max_keepalive_connections=max_concurrency))
+        )
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+    
+    async def summarize(self, batch: CombatBatch) -> str:
+        """Narra un lote; usa el resumen local si el servicio falla"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            try:
+                response = await self.client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=build_combat_summary_messages(batch),
+                    max_tokens=250,
+                    temperature=0.8
+                )
+                return response.choices[0].message.content
+            except openai.OpenAIError:
+                return offline_combat_summary(batch)
+    
+    async def summarize_many(self, batches: Dict[str, CombatBatch]) -> Dict[str, str]:
+        """Narra en paralelo los lotes de varias sesiones (clave: id de sesión)"""
+        keys = list(batches)
+        summaries = await asyncio.gather(*(self.summarize(batches[key]) for key in keys))
+        return dict(zip(keys, summaries))
+    
+    async def aclose(self):
+        """Cierra las conexiones del cliente asíncrono"""
+        await self.client.close()
+
+# ============= ENTRENAMIENTO ACELERADO =============
+
+@dataclass
+class TrainingReport:
+    """Resultado agregado de una sesión de entrenamiento acelerado"""
+    hours: int
+    start_level: int
+    end_level: int = 0
+    encounters: int = 0
+    victories: int = 0
+    fled: int = 0
+    escaped: int = 0            # el enemigo huyó
+    deaths: int = 0
+    rests: int = 0
+    exp_gained: int = 0
+    gold_gained: int = 0
+    damage_dealt: int = 0
+    damage_taken: int = 0
+    kills_by_enemy: Dict[str, int] = field(default_factory=dict)
+    elapsed_ms: float = 0.0
+    
+    def summary_lines(self) -> List[str]:
+        lines = [
+            f"Horas de entrenamiento: {self.hours}  |  Encuentros: {self.encounters}",
+            f"Victorias: {self.victories}  |  Retiradas: {self.fled}  |  Enemigos huidos: {self.escaped}  |  "
+            f"Muertes: {self.deaths}  |  Descansos: {self.rests}",
+            f"Experiencia: +{self.exp_gained}  |  Oro: +{self.gold_gained}  |  Nivel: {self.start_level} → {self.end_level}",
+            f"Daño infligido: {self.damage_dealt}  |  Daño recibido: {self.damage_taken}"
+        ]
+        if self.kills_by_enemy:
+            kills = ", ".join(f"{name} x{count}" for name, count in self.kills_by_enemy.items())
+            lines.append(f"Enemigos derrotados: {kills}")
+        return lines
+
+class TrainingSimulator:
+    """
+    Simula horas de entrenamiento sin narración: los encuentros siguen la
+    tabla de la zona donde se entrena (la de determine_encounter) y cada
+    combate usa las reglas de CombatSystem, con las tiradas generadas por
+    tramos de varios asaltos. El enemigo elige como en combate real con
+    EnemyTactics (golpe especial, guardia, huida); sus decisiones se memorizan
+    por posición durante el entrenamiento, así que cada una se busca una vez,
+    y agotado TACTICS_BUDGET las posiciones nuevas usan lo que el motor elige
+    casi siempre: el golpe especial en cuanto se enfría.
+    """
+    
+    ATTEMPTS_PER_HOUR = 6       # búsquedas de enemigo por hora de juego
+    ENCOUNTER_CHANCE = 0.7      # igual que determine_encounter
+    MAX_ROUNDS = 30             # sin desenlace, el personaje se retira
+    ROUNDS_PER_BATCH = 6        # tiradas generadas de golpe por tramo de combate
+    REST_THRESHOLD = 0.8        # descansa antes de combatir si está por debajo
+    FLEE_THRESHOLD = 0.25       # huye si el combate lo deja por debajo
+    MAX_HOURS = 24 * 30
+    TACTICS_BUDGET = 0.03       # segundos de búsqueda táctica por entrenamiento
+    
+    def __init__(self):
+        self.tactics_deadline = 0.0
+    
+    @staticmethod
+    def roll_many(spec: DiceSpec, count: int) -> List[int]:
+        """count tiradas de una misma DiceSpec"""
+        rand = random.random
+        caras, base = spec.caras, 1 + spec.bonus
+        if spec.cantidad == 1:
+            return [int(rand() * caras) + base for _ in range(count)]
+        return [sum(int(rand() * caras) for _ in range(spec.cantidad)) + spec.cantidad + spec.bonus
+                for _ in range(count)]
+    
+    def simulate_fight(self, character: Character, enemy_type: str,
+                       policy: Dict[tuple, str]) -> Tuple[str, int, int]:
+        """
+        Combate completo: devuelve (desenlace, daño infligido, daño recibido).
+        policy guarda las decisiones del enemigo ya buscadas para este enfrentamiento.
+        """
+        enemy = Enemy.ENEMY_TYPES[enemy_type]
+        attack, defense = DiceSystem.parse(character.get_attack_dice()), DiceSystem.parse(character.get_defense_dice())
+        enemy_hp, hp = enemy["hp"], character.hp_actual
+        flee_at = character.hp_max * self.FLEE_THRESHOLD
+        total_dealt = total_taken = 0
+        tactics, matchup = ENEMY_TACTICS, None
+        cooldown, guarding = 0, False
+        
+        for _ in range(0, self.MAX_ROUNDS, self.ROUNDS_PER_BATCH):
+            rounds = self.ROUNDS_PER_BATCH
+            for hit_roll, block_roll, enemy_roll, guard_roll in zip(
+                    self.roll_many(attack, rounds), self.roll_many(enemy["defense_spec"], rounds),
+                    self.roll_many(enemy["attack_spec"], rounds), self.roll_many(defense, rounds)):
+                if hit_roll > block_roll:
+                    total_dealt += int((hit_roll - block_roll) * 0.5) if guarding else hit_roll - block_roll
+                    if total_dealt >= enemy_hp:
+                        return "victory", enemy_hp, total_taken
+                guarding = False
+                
+                state = (tactics.bucket(enemy_hp - total_dealt, enemy_hp),
+                         tactics.bucket(hp - total_taken, character.hp_max), cooldown)
+                action = policy.get(state)
+                if action is None:
+                    if time.perf_counter() < self.tactics_deadline:
+                        matchup = matchup or tactics.matchup_for(
+                            enemy["attack"], enemy["defense"], enemy["hp"], character.get_attack_dice(),
+                            character.get_defense_dice(), character.hp_max)
+                        action = policy[state] = tactics.decide(matchup, *state)
+                    else:
+                        action = "atacar" if cooldown else "especial"
+                if action == "especial":
+                    enemy_roll = int(enemy_roll * CombatSystem.SPECIAL_MULTIPLIER)
+                    cooldown = CombatSystem.SPECIAL_COOLDOWN
+                else:
+                    cooldown = max(0, cooldown - 1)
+                    if action == "defender":
+                        guarding = True
+                        continue
+                    if action == "huir":
+                        if random.random() < CombatSystem.ENEMY_FLEE_CHANCE:
+                            return "escaped", total_dealt, total_taken
+                        continue
+                if enemy_roll > guard_roll:
+                    total_taken += enemy_roll - guard_roll
+                    if total_taken >= hp:
+                        return "defeat", total_dealt, hp
+                    if hp - total_taken < flee_at:
+                        return "fled", total_dealt, total_taken
+        return "fled", total_dealt, total_taken
+    
+    def run(self, character: Character, hours: int,
+            encounter_table: Optional[tuple] = None) -> TrainingReport:
+        """
+        Aplica al personaje el resultado de `hours` horas de entrenamiento
+        contra una tabla de encuentros (por defecto la global del contenido)
+        """
+        started = time.perf_counter()
+        hours = max(1, min(int(hours), self.MAX_HOURS))
+        report = TrainingReport(hours=hours, start_level=character.level)
+        
+        attempts = hours * self.ATTEMPTS_PER_HOUR
+        encounters = sum(1 for _ in range(attempts) if random.random() < self.ENCOUNTER_CHANCE)
+        names, cum_weights = encounter_table or CONTENT.encounter_table()
+        # Decisiones del enemigo por enfrentamiento: las tiradas cambian al subir de nivel
+        policies: Dict[Tuple[str, int], Dict[tuple, str]] = {}
+        self.tactics_deadline = started + self.TACTICS_BUDGET
+        
+        for enemy_type in random.choices(names, cum_weights=cum_weights, k=encounters):
+            # Descansa antes de cada combate si va herido (mismas reglas que rest())
+            while character.hp_actual < character.hp_max * self.REST_THRESHOLD:
+                character.heal(int(character.hp_max * 0.3))
+                character.restore_mana(int(character.mana_max * 0.5))
+                report.rests += 1
+            
+            enemy = Enemy.ENEMY_TYPES[enemy_type]
+            policy = policies.setdefault((enemy_type, character.level), {})
+            outcome, dealt, taken = self.simulate_fight(character, enemy_type, policy)
+            report.encounters += 1
+            report.damage_dealt += dealt
+            report.damage_taken += taken
+            character.take_damage(taken)
+            
+            if outcome == "victory":
+                gold = random.randint(*enemy["gold_range"])
+                character.gold += gold
+                character.add_experience(enemy["exp"])
+                character.kills += 1
+                report.victories += 1
+                report.gold_gained += gold
+                report.exp_gained += enemy["exp"]
+                report.kills_by_enemy[enemy_type] = report.kills_by_enemy.get(enemy_type, 0) + 1
+            elif outcome == "defeat":
+                # La Habitación revive al personaje con la mitad de su vitalidad
+                character.deaths += 1
+                character.hp_actual = int(character.hp_max * 0.5)
+                report.deaths += 1
+            elif outcome == "escaped":
+                report.escaped += 1
+            else:
+                report.fled += 1
+        
+        report.end_level = character.level
+        report.elapsed_ms = (time.perf_counter() - started) * 1000
+        return report
+
+def build_training_summary_messages(report: TrainingReport, character_name: str) -> List[dict]:
+    """Prompt para narrar un entrenamiento completo en un solo resumen"""
+    return [
+        {"role": "system", "content": (
+            "Eres el Narrador de la Habitación del Tiempo, donde el tiempo fluye distinto. "
+            "Resume en un párrafo épico y conciso un largo periodo de entrenamiento. "
+            "No inventes cifras ni resultados distintos a los indicados.")},
+        {"role": "user", "content": (
+            f"Entrenamiento de {character_name}:\n" + "\n".join(f"- {line}" for line in report.summary_lines()))}
+    ]
+
+def offline_training_summary(report: TrainingReport, character_name: str) -> str:
+    """Resumen local de respaldo cuando no hay servicio de narración"""
+    summary = (f"Durante {report.hours} horas, {character_name} se enfrenta a {report.encounters} "
+               f"manifestaciones de la Habitación y vence a {report.victories}.")
+    if report.end_level > report.start_level:
+        summary += f" Su poder crece hasta el nivel {report.end_level}."
+    if report.deaths:
+        summary += f" Cae {report.deaths} veces, pero la Habitación siempre lo devuelve a la vida."
+    return summary
+
+# ============= REPARTO DE PUNTOS DE MEJORA =============
+
+def _power_sums(first: int, last: int) -> Tuple[int, int]:
+    """Suma de k y de k² para k = first..last (0 si el tramo está vacío)"""
+    if last < first:
+        return 0, 0
+    first -= 1
+    return ((last * (last + 1) - first * (first + 1)) // 2,
+            (last * (last + 1) * (2 * last + 1) - first * (first + 1) * (2 * first + 1)) // 6)
+
+@lru_cache(maxsize=8192)
+def hit_moments(attack: str, defense: str, multiplier: float = 1.0) -> Tuple[float, float]:
+    """
+    Media y varianza exactas del daño de un golpe, max(0, ataque - defensa),
+    con la tirada de ataque multiplicada como en el golpe especial
+    """
+    attack_spec, defense_spec = DiceSystem.parse(attack), DiceSystem.parse(defense)
+    attack_single = attack_spec is not None and attack_spec.cantidad == 1 and multiplier == 1.0
+    defense_single = defense_spec is not None and defense_spec.cantidad == 1
+    mean = second = 0.0
+    # Con un solo dado en un lado, el daño contra cada tirada del otro recorre
+    # un tramo de enteros con sumas cerradas: se recorre el lado con menos caras
+    if attack_single and not (defense_single and defense_spec.caras > attack_spec.caras):
+        low, high = 1 + attack_spec.bonus, attack_spec.caras + attack_spec.bonus
+        for defense_roll, defense_prob in roll_distribution(defense):
+            total, squares = _power_sums(max(1, low - defense_roll), high - defense_roll)
+            mean += defense_prob * total
+            second += defense_prob * squares
+        return mean / attack_spec.caras, max(0.0, (second - mean * mean / attack_spec.caras) / attack_spec.caras)
+    if defense_single:
+        low, high = 1 + defense_spec.bonus, defense_spec.caras + defense_spec.bonus
+        for attack_roll, attack_prob in roll_distribution(attack):
+            attack_roll = int(attack_roll * multiplier)
+            total, squares = _power_sums(max(1, attack_roll - high), attack_roll - low)
+            mean += attack_prob * total
+            second += attack_prob * squares
+        mean, second = mean / defense_spec.caras, second / defense_spec.caras
+        return mean, max(0.0, second - mean * mean)
+    
+    defense_rolls = roll_distribution(defense)
+    i, count = 0, len(defense_rolls)
+    below = below_sum = below_square = 0.0   # masa, suma y suma de cuadrados de las defensas < ataque
+    for attack_roll, attack_prob in roll_distribution(attack):
+        attack_roll = int(attack_roll * multiplier)
+        while i < count and defense_rolls[i][0] < attack_roll:
+            defense_roll, defense_prob = defense_rolls[i]
+            below += defense_prob
+            below_sum += defense_prob * defense_roll
+            below_square += defense_prob * defense_roll * defense_roll
+            i += 1
+        mean += attack_prob * (attack_roll * below - below_sum)
+        second += attack_prob * (attack_roll * attack_roll * below - 2 * attack_roll * below_sum + below_square)
+    return mean, max(0.0, second - mean * mean)
+
+@lru_cache(maxsize=4096)
+def standing_curve(attack: str, defense: str, target_hp: int, rounds: int,
+                   pattern: str = "") -> Tuple[float, ...]:
+    """
+    P(el objetivo sigue en pie tras t golpes) para t = 0..rounds. Cada golpe
+    usa los momentos exactos de hit_moments y la suma de t golpes se aproxima
+    por una normal (con corrección de continuidad). pattern da el tipo de cada
+    golpe: "n" normal (por defecto), "e" especial, "m" a la mitad por la
+    guardia del objetivo (media/2, varianza/4) y "-" turno sin golpe.
+    """
+    threshold = target_hp - 0.5
+    curve = [1.0]
+    for mean, spread in _cumulative_moments(attack, defense, rounds, pattern):
+        if spread <= 0:
+            curve.append(0.0 if mean >= target_hp else 1.0)
+        else:
+            curve.append(0.5 * math.erfc((mean - threshold) / spread))
+    return tuple(curve)
+
+@lru_cache(maxsize=1024)
+def _cumulative_moments(attack: str, defense: str, rounds: int, pattern: str) -> Tuple[Tuple[float, float], ...]:
+    """(media, sqrt(2·varianza)) del daño acumulado tras t = 1..rounds golpes; no depende de la vida"""
+    normal = hit_moments(attack, defense)
+    moments = {"n": normal, "m": (normal[0] / 2, normal[1] / 4), "-": (0.0, 0.0)}
+    if "e" in pattern:
+        moments["e"] = hit_moments(attack, defense, CombatSystem.SPECIAL_MULTIPLIER)
+    cumulative = []
+    mean = variance = 0.0
+    for t in range(rounds):
+        hit_mean, hit_variance = moments[pattern[t]] if t < len(pattern) else normal
+        mean += hit_mean
+        variance += hit_variance
+        cumulative.append((mean, math.sqrt(2 * variance)))
+    return tuple(cumulative)
+
+# Presupuesto por decisión al sacar el patrón: el mismo que en combate, porque con menos
+# la búsqueda se queda corta y no ve guardias ni huidas que el enemigo sí hace
+PATTERN_BUDGET = EnemyTactics.BUDGET
+
+@lru_cache(maxsize=1024)
+def tactics_pattern(enemy_type: str, attack: str, defense: str, hp_max: int,
+                    rounds: int) -> Tuple[str, str, float]:
+    """
+    Cómo juega EnemyTactics contra un personaje con estas tiradas, en la forma
+    que usa standing_curve: el tipo de cada golpe del enemigo, el de cada
+    golpe del jugador (a la mitad tras una guardia) y la fracción de las
+    cubetas bajo el umbral de huida en que intenta escapar. Cada golpe se
+    decide en la posición del combate medio: el HP de ambos baja ronda a
+    ronda con el daño esperado, porque la táctica cambia con la vida (el
+    Espectro se pone en guardia al quedar por debajo de la mitad).
+    """
+    enemy = CONTENT.enemies[enemy_type]
+    tactics, budget = ENEMY_TACTICS, PATTERN_BUDGET
+    matchup = tactics.matchup_for(enemy["attack"], enemy["defense"], enemy["hp"], attack, defense, hp_max)
+    full = tactics.HP_BUCKETS
+    player_mean = hit_moments(attack, enemy["defense"])[0]
+    enemy_means = {"atacar": hit_moments(enemy["attack"], defense)[0],
+                   "especial": hit_moments(enemy["attack"], defense, CombatSystem.SPECIAL_MULTIPLIER)[0]}
+    decisions = {}
+    enemy_hits, player_hits = [], ["n"]
+    enemy_hp, player_hp, cooldown = float(enemy["hp"]), float(hp_max), 0
+    for _ in range(rounds):
+        enemy_hp -= player_mean / 2 if player_hits[-1] == "m" else player_mean
+        # Pasado el desenlace esperado se sigue con la última cubeta viva
+        state = (tactics.bucket(max(1.0, enemy_hp), enemy["hp"]), tactics.bucket(max(1.0, player_hp), hp_max),
+                 cooldown)
+        if state not in decisions:
+            decisions[state] = tactics.decide(matchup, *state, budget=budget)
+        action = decisions[state]
+        player_hp -= enemy_means.get(action, 0.0)
+        enemy_hits.append({"atacar": "n", "especial": "e"}.get(action, "-"))
+        player_hits.append("m" if action == "defender" else "n")
+        cooldown = CombatSystem.SPECIAL_COOLDOWN if action == "especial" else max(0, cooldown - 1)
+    wounded = range(1, int(CombatSystem.ENEMY_FLEE_BELOW * full) + 1)
+    flees = sum(tactics.decide(matchup, bucket, full, CombatSystem.SPECIAL_COOLDOWN, budget=budget) == "huir"
+                for bucket in wounded) / len(wounded)
+    return "".join(enemy_hits), "".join(player_hits[:rounds]), flees
+
+@dataclass
+class AllocationPlan:
+    """Reparto de puntos de mejora recomendado y su rendimiento esperado"""
+    objective: str
+    allocation: Dict[str, int]             # stat -> mejoras compradas
+    points: int                            # puntos que cuesta
+    win_probability: float                 # media ponderada por la tabla de encuentros
+    kill_rate: float                       # victorias por ronda de combate
+    per_enemy: Dict[str, float] = field(default_factory=dict)
+    elapsed_ms: float = 0.0
+    
+    def describe(self) -> str:
+        spent = ", ".join(f"+{count} {stat}" for stat, count in self.allocation.items() if count) or "nada"
+        return (f"{spent} → victoria {self.win_probability:.0%}, "
+                f"{self.kill_rate:.3f} victorias por ronda")
+
+class StatAllocationSolver:
+    """
+    Recomienda el reparto de los puntos de mejora que maximiza la probabilidad
+    de victoria ("victoria") o las victorias por ronda ("rapidez") contra la
+    tabla de encuentros de la zona. Con las reglas de CombatSystem el jugador
+    golpea primero: gana en la ronda t si su t-ésimo golpe tumba al enemigo y
+    los t-1 del enemigo no lo han tumbado a él. El enemigo juega como suele
+    hacerlo EnemyTactics contra el personaje antes del reparto
+    (tactics_pattern): golpes normales o especiales, guardias que dejan a la
+    mitad el siguiente golpe del jugador e intentos de huida por debajo del
+    umbral, que no cuentan como victoria. Las curvas de rondas de cada bando
+    salen de standing_curve y solo dependen de su mitad del reparto: el ataque
+    (ataque, fortaleza) por un lado y la defensa (defensa, resistencia,
+    vitalidad) por otro. Cada mitad se tabula una vez por coste y los repartos
+    completos se combinan como una mochila: cada ataque con las defensas que
+    gastan el resto, con un producto escalar por pareja. Con muchos puntos se
+    reparte por bloques y el resto se añade en tandas al stat que más mejora.
+    Los stats mágicos y el maná no intervienen en el combate y no se
+    recomiendan.
+    """
+    
+    OBJECTIVES = ("victoria", "rapidez")
+    OFFENSE = ("ataque", "fortaleza")
+    DEFENSE = ("defensa", "resistencia", "vitalidad")
+    ROUNDS = TrainingSimulator.MAX_ROUNDS   # sin desenlace, el combate no cuenta como victoria
+    BLOCKS = 10                             # mejoras por stat como máximo en la búsqueda exhaustiva
+    WIN_TOLERANCE = 0.001                   # con "victoria", lo que no mejora esto se desempata por rapidez
+    
+    def roster(self, enemies: Optional[List[str]] = None,
+               encounter_table: Optional[tuple] = None) -> List[Tuple[str, float]]:
+        """
+        Enemigos con su peso normalizado en una tabla de encuentros (la de la
+        zona del jugador o, por defecto, la global del contenido)
+        """
+        names, cum_weights = encounter_table or CONTENT.encounter_table()
+        weights = dict(zip(names, (b - a for a, b in zip([0, *cum_weights], cum_weights))))
+        selected = [name for name in (enemies or names) if name in CONTENT.enemies]
+        total = sum(weights.get(name, 1) for name in selected) or 1
+        return [(name, weights.get(name, 1) / total) for name in selected]
+    
+    @staticmethod
+    def attack_dice(character: Character, ataque: int = 0, fortaleza: int = 0) -> str:
+        gains = ProgressionTable.IMPROVEMENT_GAINS
+        return str(DiceSpec(1, max(1, character.equipped_stat("ataque", gains["ataque"] * ataque)),
+                            character.equipped_stat("fortaleza", gains["fortaleza"] * fortaleza)))
+    
+    @staticmethod
+    def defense_dice(character: Character, defensa: int = 0, resistencia: int = 0) -> str:
+        gains = ProgressionTable.IMPROVEMENT_GAINS
+        return str(DiceSpec(1, max(1, character.equipped_stat("defensa", gains["defensa"] * defensa)),
+                            character.equipped_stat("resistencia", gains["resistencia"] * resistencia)))
+    
+    def matchups(self, character: Character, roster) -> List[Tuple[str, float, Tuple[str, str, float]]]:
+        """Roster con cómo juega cada enemigo contra el personaje antes del reparto (tactics_pattern)"""
+        attack, defense = self.attack_dice(character), self.defense_dice(character)
+        return [(name, weight, tactics_pattern(name, attack, defense, character.hp_max, self.ROUNDS))
+                for name, weight in roster]
+    
+    def offense_vectors(self, character: Character, matchups, ataque: int, fortaleza: int) -> Tuple[list, list]:
+        """
+        Vectores del ataque concatenados por enemigo y ya ponderados:
+        P(tumbarlo justo en la ronda t) y P(sigue en pie tras t rondas)
+        """
+        attack = self.attack_dice(character, ataque, fortaleza)
+        kills, standing = [], []
+        for name, weight, (_, hits, flees) in matchups:
+            enemy = CONTENT.enemies[name]
+            curve = standing_curve(attack, enemy["defense"], enemy["hp"], self.ROUNDS, hits)
+            if flees:
+                # En pie con más HP que el umbral de huida: todavía no intenta escapar
+                healthy = standing_curve(attack, enemy["defense"],
+                                         enemy["hp"] - int(enemy["hp"] * CombatSystem.ENEMY_FLEE_BELOW),
+                                         self.ROUNDS, hits)
+            stays = 1.0   # P(no ha escapado antes del siguiente golpe)
+            for t in range(self.ROUNDS):
+                kills.append(weight * stays * (curve[t] - curve[t + 1]))
+                standing.append(weight * stays * curve[t])
+                if flees and curve[t + 1] > 0:
+                    stays *= 1 - flees * CombatSystem.ENEMY_FLEE_CHANCE * (curve[t + 1] - healthy[t + 1]) / curve[t + 1]
+        return kills, standing
+    
+    def defense_vector(self, character: Character, matchups, defensa: int, resistencia: int,
+                       vitalidad: int) -> list:
+        """P(el jugador sigue en pie tras t turnos del enemigo), t = 0..ROUNDS-1, por enemigo"""
+        defense = self.defense_dice(character, defensa, resistencia)
+        hp = character.hp_max + ProgressionTable.IMPROVEMENT_GAINS["vitalidad"] * vitalidad
+        alive = []
+        for name, _, (hits, _, _) in matchups:
+            alive.extend(standing_curve(CONTENT.enemies[name]["attack"], defense, hp, self.ROUNDS, hits)[:-1])
+        return alive
+    
+    def options(self, stats: Tuple[str, ...], budget: int, step: int) -> Dict[int, List[Tuple[int, ...]]]:
+        """Mejoras por stat (múltiplos de step) agrupadas por coste, sin pasarse del presupuesto"""
+        costs = ProgressionTable.IMPROVEMENT_COSTS
+        by_cost = {}
+        for counts in itertools.product(*(range(0, budget // costs[stat] + 1, step) for stat in stats)):
+            cost = sum(costs[stat] * count for stat, count in zip(stats, counts))
+            if cost <= budget:
+                by_cost.setdefault(cost, []).append(counts)
+        return by_cost
+    
+    def score(self, objective: str, kills: list, standing: list, alive: list) -> Tuple[float, float, float]:
+        """
+        (criterio principal, desempate, probabilidad de victoria) de un reparto
+        completo; las victorias que difieren en menos de WIN_TOLERANCE empatan
+        """
+        win = sum(map(operator.mul, kills, alive))
+        rounds = sum(map(operator.mul, standing, alive))
+        rate = win / rounds if rounds else 0.0
+        if objective == "victoria":
+            return round(win / self.WIN_TOLERANCE), rate, win
+        return rate, win, win
+    
+    def recommend(self, character: Character, points: Optional[int] = None, objective: str = "victoria",
+                  enemies: Optional[List[str]] = None, encounter_table: Optional[tuple] = None) -> AllocationPlan:
+        """Mejor reparto de `points` puntos (por defecto los que tiene sin asignar)"""
+        started = time.perf_counter()
+        points = character.improvement_points if points is None else max(0, points)
+        objective = objective if objective in self.OBJECTIVES else "victoria"
+        roster = self.roster(enemies, encounter_table)
+        costs = ProgressionTable.IMPROVEMENT_COSTS
+        cheapest = min(costs[stat] for stat in self.OFFENSE + self.DEFENSE)
+        step = max(1, math.ceil(points / (cheapest * self.BLOCKS)))
+        
+        matchups = self.matchups(character, roster)
+        offense = {cost: [(counts, self.offense_vectors(character, matchups, *counts)) for counts in combos]
+                   for cost, combos in self.options(self.OFFENSE, points, step).items()}
+        defense = {cost: [(counts, self.defense_vector(character, matchups, *counts)) for counts in combos]
+                   for cost, combos in self.options(self.DEFENSE, points, step).items()}
+        
+        # Solo repartos a los que ya no cabe otro bloque: más mejoras nunca empeoran el combate
+        best, best_counts = None, None
+        for offense_cost, offense_options in offense.items():
+            for defense_cost, defense_options in defense.items():
+                spent = offense_cost + defense_cost
+                if spent > points or spent + step * cheapest <= points:
+                    continue
+                for offense_counts, (kills, standing) in offense_options:
+                    for defense_counts, alive in defense_options:
+                        score = self.score(objective, kills, standing, alive)
+                        if best is None or score > best:
+                            best, best_counts = score, offense_counts + defense_counts
+        
+        # Lo que no llega a un bloque se añade en tandas cada vez menores al stat que más mejora
+        stats = self.OFFENSE + self.DEFENSE
+        counts = list(best_counts)
+        left = points - sum(costs[stat] * count for stat, count in zip(stats, counts))
+        while left >= cheapest:
+            candidates = []
+            for i, stat in enumerate(stats):
+                if costs[stat] <= left:
+                    extra = max(1, left // (2 * costs[stat]))
+                    trial = counts[:i] + [counts[i] + extra] + counts[i + 1:]
+                    candidates.append((self.evaluate(character, roster, objective, trial), i, extra))
+            best, i, extra = max(candidates)
+            counts[i] += extra
+            left -= costs[stats[i]] * extra
+        
+        per_enemy = {name: self.evaluate(character, [(name, 1.0)], "victoria", counts)[2]
+                     for name, _ in roster}
+        return AllocationPlan(objective=objective, allocation=dict(zip(stats, counts)),
+                              points=points - left, win_probability=best[2],
+                              kill_rate=best[1] if objective == "victoria" else best[0], per_enemy=per_enemy,
+                              elapsed_ms=(time.perf_counter() - started) * 1000)
+    
+    def evaluate(self, character: Character, roster, objective: str, counts: List[int]) -> tuple:
+        """Puntuación de un reparto concreto (mejoras en el orden OFFENSE + DEFENSE)"""
+        matchups = self.matchups(character, roster)
+        kills, standing = self.offense_vectors(character, matchups, *counts[:len(self.OFFENSE)])
+        alive = self.defense_vector(character, matchups, *counts[len(self.OFFENSE):])
+        return self.score(objective, kills, standing, alive)
+    
+    def batch(self, levels: List[int], objective: str = "victoria", races: Optional[List[str]] = None,
+              classes: Optional[List[str]] = None) -> List[dict]:
+        """
+        Tabla para diseño: el mejor reparto de todos los puntos acumulados en
+        cada nivel para cada raza y clase (sin equipo)
+        """
+        rows = []
+        for race in races or list(CONTENT.races):
+            for char_class in classes or list(CONTENT.classes):
+                for level in levels:
+                    character = Character("Prueba", race, char_class)
+                    character.apply_level_gains(level)
+                    plan = self.recommend(character, objective=objective)
+                    row = {"raza": race, "clase": char_class, "nivel": level, "puntos": plan.points}
+                    row.update(plan.allocation)
+                    row.update({"victoria": round(plan.win_probability, 4),
+                                "victorias_por_ronda": round(plan.kill_rate, 4),
+                                "ms": round(plan.elapsed_ms, 1)})
+                    row.update({f"victoria {name}": round(p, 4) for name, p in plan.per_enemy.items()})
+                    rows.append(row)
+        return rows
+
+def parse_levels(text: str) -> List[int]:
+    """Niveles de una lista como "1-10,15,20-30" """
+    levels = []
+    for part in text.replace(" ", "").split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        levels.extend(range(int(first), int(last or first) + 1))
+    return sorted(set(level for level in levels if level >= 1))
+
+def allocation_table_csv(rows: List[dict]) -> str:
+    """Tabla de StatAllocationSolver.batch en CSV"""
+    output = io.StringIO()
+    if rows:
+        writer = csv.DictWriter(output, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    return output.getvalue()
+
+# Compartido por todas las sesiones: las curvas quedan en la caché de standing_curve
+ALLOCATION_SOLVER = StatAllocationSolver()
+
+# ============= INTÉRPRETE DE COMANDOS LOCALES =============
+
+# Tablas precalculadas para normalizar: minúsculas, sin tildes ni puntuación
+_ACCENT_TABLE = str.maketrans("áéíóúüñàèìòù", "aeiouunaeiou")
+_PUNCTUATION_TABLE = str.maketrans({c: " " for c in "¡!¿?.,;:\"'()[]{}-_/\\*"})
+
+def normalize_command_text(text: str) -> str:
+    """Normaliza una entrada para compararla con la gramática de comandos"""
+    return " ".join(text.lower().translate(_ACCENT_TABLE).translate(_PUNCTUATION_TABLE).split())
+
+class CommandParser:
+    """
+    Gramática local de comandos mecánicos. Los sinónimos se compilan en un
+    trie de palabras; una entrada es comando si empieza por una frase del
+    trie y el resto son solo palabras de relleno ("al enemigo", "otra vez"...).
+    Todo lo demás se considera una acción abierta para el GM.
+    """
+    
+    SYNONYMS = {
+        "atacar": ["atacar", "ataco", "ataca", "ataque", "atacar al enemigo", "golpear", "golpeo",
+                   "pegar", "pego", "luchar", "lucho", "pelear", "peleo", "embestir"],
+        "defender": ["defender", "defiendo", "defenderse", "defenderme", "me defiendo", "bloquear",
+                     "bloqueo", "cubrirse", "cubrirme", "me cubro", "protegerse", "protegerme",
+                     "ponerse en guardia", "en guardia", "guardia"],
+        "descansar": ["descansar", "descanso", "dormir", "duermo", "reposar", "reposo", "acampar",
+                      "recuperarse", "recuperarme", "tomar un descanso"],
+        "percepcion": ["percepcion", "percibir", "percibo", "observar", "observo", "otear",
+                       "mirar alrededor", "miro alrededor", "examinar el entorno", "vigilar"],
+        "guardar": ["guardar", "guardar partida", "guardar juego", "salvar", "salvar partida"],
+        "inventario": ["inventario", "inv", "i", "mochila", "ver mochila", "ver inventario",
+                       "mis objetos", "objetos"],
+        "estado": ["estado", "ver estado", "stats", "estadisticas", "ver estadisticas",
+                   "mi personaje", "ficha", "salud", "vida"],
+        "mapa": ["mapa", "ver mapa", "mirar mapa", "consultar mapa", "donde estoy"],
+        "huir": ["huir", "huyo", "escapar", "escapo", "retirarse", "retirarme", "me retiro",
+                 "fugarse", "salir corriendo", "retirada"]
+    }
+    
+    FILLER = {"al", "a", "el", "la", "los", "las", "un", "una", "de", "del", "enemigo", "monstruo",
+              "criatura", "bestia", "otra", "vez", "ya", "ahora", "rapido", "nuevo", "mi", "mis",
+              "me", "poco", "todo", "por", "favor", "con", "fuerza", "todas", "todos"}
+    
+    MAX_FILLER_WORDS = 4
+    
+    # Fuera de combate "pelear con una bestia" o "huir" son acciones abiertas para el GM
+    COMBAT_COMMANDS = ("atacar", "defender", "huir")
+    
+    # "entrenar 8 horas", "entrenar durante 12h", "dejarme entrenando 100 horas"...
+    TRAINING_PATTERN = re.compile(
+        r"^(?:entrenar|entreno|entrenarme|dejar entrenando|dejarme entrenando)"
+        r"(?: durante| por)? (\d+) ?(?:h|hora|horas)$")
+    
+    def __init__(self):
+        self.trie = {}
+        self.exact = {}
+        for command, phrases in self.SYNONYMS.items():
+            for phrase in phrases:
+                normalized = normalize_command_text(phrase)
+                self.exact[normalized] = command
+                node = self.trie
+                for word in normalized.split():
+                    node = node.setdefault(word, {})
+                node[None] = command
+    
+    # "deshacer", "rebobinar 3 turnos", "retroceder 5"
+    REWIND_PATTERN = re.compile(r"^(?:rebobinar|deshacer|retroceder)(?: (\d+))?(?: turnos?)?$")
+    
+    def parse_rewind(self, text: str) -> Optional[int]:
+        """Turnos a rebobinar, o None"""
+        match = self.REWIND_PATTERN.match(normalize_command_text(text))
+        if not match:
+            return None
+        return int(match.group(1)) if match.group(1) else 1
+    
+    # "equipar espada de hierro", "ponerme la cota de mallas", "quitarme el escudo"
+    EQUIP_PATTERN = re.compile(
+        r"^(?:(equipar|equiparme|equipo|empunar|empuno|ponerme|me pongo)"
+        r"|(desequipar|desequiparme|quitarme|me quito|soltar|suelto))(?: el| la| los| las)? (.+)$")
+    
+    # "inventario armas", "mochila raro por valor", "inventario por rareza"
+    INVENTORY_PATTERN = re.compile(r"^(?:inventario|inv|mochila|objetos)(?: (?!por )(.+?))?(?: por (\w+))?$")
+    SLOT_WORDS = {"armas": "arma", "arma": "arma", "armaduras": "armadura", "armadura": "armadura",
+                  "escudos": "escudo", "escudo": "escudo", "accesorios": "accesorio", "accesorio": "accesorio"}
+    
+    # "auto", "autocombate prudente", "auto defender 40 huir 10"
+    AUTO_BATTLE_PATTERN = re.compile(
+        r"^(?:auto|autocombate|combate automatico|luchar solo)"
+        r"(?: (agresiv[oa]|prudente|superviviente))?(?: defender (\d+))?(?: huir (\d+))?$")
+    
+    def parse_auto_battle(self, text: str) -> Optional["AutoBattlePolicy"]:
+        """Política pedida para un combate automático, o None"""
+        match = self.AUTO_BATTLE_PATTERN.match(normalize_command_text(text))
+        if not match:
+            return None
+        preset, defend, flee = match.groups()
+        policy = AUTO_BATTLE_POLICIES["agresiva" if preset and preset.startswith("agresiv") else preset or "prudente"]
+        if defend is None and flee is None:
+            return policy
+        return replace(policy, name="personalizada",
+                       defend_below=int(defend) / 100 if defend else policy.defend_below,
+                       flee_below=int(flee) / 100 if flee else policy.flee_below)
+    
+    def parse_equip(self, text: str, character: "Character") -> Optional[Tuple[str, str]]:
+        """
+        ("equipar", objeto del inventario) o ("desequipar", ranura) si la frase
+        nombra algo que el personaje puede equiparse o lleva puesto; si no,
+        None y la frase ("me pongo a meditar", "soltar una carcajada") es del GM
+        """
+        match = self.EQUIP_PATTERN.match(normalize_command_text(text))
+        if not match:
+            return None
+        target = match.group(3)
+        if match.group(1):
+            name = character.inventory.find(target)
+            item = CONTENT.items.get(name) if name else None
+            return ("equipar", name) if item and item["slot"] else None
+        slot = self.SLOT_WORDS.get(target) or next(
+            (slot for slot, name in character.equipment.items() if name and normalize_command_text(name) == target),
+            None)
+        return ("desequipar", slot) if slot and character.equipment.get(slot) else None
+    
+    def parse_inventory_query(self, text: str) -> Optional[dict]:
+        """Filtros y orden de una consulta de inventario, o None si no lo es"""
+        match = self.INVENTORY_PATTERN.match(normalize_command_text(text))
+        if not match or not (match.group(1) or match.group(2)):
+            return None
+        query = {}
+        terms = match.group(1) or ""
+        rarities = {normalize_command_text(rarity): rarity for rarity in ITEM_RARITIES}
+        if "poco comun" in terms:
+            query["rarity"] = rarities["poco comun"]
+            terms = terms.replace("poco comun", "")
+        for word in terms.split():
+            singular = word[:-1] if word.endswith("s") and len(word) > 3 else word  # "arcos", "raros"
+            if word in self.SLOT_WORDS:
+                query["slot"] = self.SLOT_WORDS[word]
+            elif singular in rarities:
+                query["rarity"] = rarities[singular]
+            elif word not in self.FILLER:
+                if "item_type" in query:
+                    return None  # frase libre: mejor que la interprete el GM
+                query["item_type"] = singular
+        if match.group(2):
+            if match.group(2) not in Inventory.SORT_KEYS:
+                return None
+            query["sort_by"] = match.group(2)
+        return query
+    
+    # "repartir puntos", "asignar mis puntos de mejora rapidez", "gastar puntos para victoria"
+    ALLOCATION_PATTERN = re.compile(
+        r"^(?:repartir|reparto|asignar|gastar)(?: los| mis)? puntos(?: de mejora)?"
+        r"(?: (?:para |por |a )?(victoria|rapidez))?$")
+    
+    def parse_allocation(self, text: str) -> Optional[str]:
+        """Objetivo pedido para repartir los puntos de mejora, o None"""
+        match = self.ALLOCATION_PATTERN.match(normalize_command_text(text))
+        if not match:
+            return None
+        return match.group(1) or "victoria"
+    
+    # "ir al norte", "viajar hacia el este", "oeste"
+    TRAVEL_PATTERN = re.compile(
+        r"^(?:(?:ir|voy|viajar|viajo|caminar|camino|avanzar|avanzo|dirigirme|me dirijo)"
+        r"(?: hacia| hasta| rumbo)?(?: el| al| a)? )?(norte|sur|este|oeste)$")
+    
+    def parse_travel(self, text: str) -> Optional[str]:
+        """Dirección de un viaje a la zona vecina, o None"""
+        match = self.TRAVEL_PATTERN.match(normalize_command_text(text))
+        return match.group(1) if match else None
+    
+    def parse_training(self, text: str) -> Optional[int]:
+        """Horas pedidas para un entrenamiento acelerado, o None"""
+        match = self.TRAINING_PATTERN.match(normalize_command_text(text))
+        return int(match.group(1)) if match else None
+    
+    def parse(self, text: str, extra_filler: Optional[set] = None, in_combat: bool = False) -> Optional[str]:
+        """Devuelve el comando canónico o None si es una acción abierta"""
+        normalized = normalize_command_text(text)
+        command = self.exact.get(normalized)
+        if command in self.COMBAT_COMMANDS and not in_combat:
+            return None
+        if command or not normalized:
+            return command
+        
+        words = normalized.split()
+        node = self.trie
+        match, match_end = None, 0
+        for i, word in enumerate(words):
+            node = node.get(word)
+            if node is None:
+                break
+            if None in node:
+                match, match_end = node[None], i + 1
+        if match is None or (match in self.COMBAT_COMMANDS and not in_combat):
+            return None
+        
+        rest = words[match_end:]
+        if len(rest) > self.MAX_FILLER_WORDS:
+            return None
+        filler = self.FILLER | extra_filler if extra_filler else self.FILLER
+        return match if all(word in filler for word in rest) else None
+
+COMMAND_PARSER = CommandParser()
+
+# ============= LÍNEA TEMPORAL (REBOBINADO) =============
+
+class FrozenMap(tuple):
+    """Diccionario congelado: tupla de pares (clave, valor congelado)"""
+
+class FrozenList(tuple):
+    """Lista congelada"""
+
+class FrozenObject(tuple):
+    """Objeto congelado: (clase, FrozenMap de sus atributos)"""
+
+def _same(previous, value) -> bool:
+    if previous is value:
+        return True
+    return (type(previous) is type(value) and not isinstance(value, (FrozenMap, FrozenList, FrozenObject))
+            and previous == value)
+
+def freeze(value, previous=None):
+    """
+    Copia inmutable de un valor del juego que reutiliza las partes de
+    `previous` (la copia anterior) que no han cambiado: compartición estructural
+    """
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return previous if _same(previous, value) else value
+    
+    if isinstance(value, dict):
+        old = dict(previous) if isinstance(previous, FrozenMap) else {}
+        items = tuple((key, freeze(item, old.get(key))) for key, item in value.items())
+        if (isinstance(previous, FrozenMap) and len(previous) == len(items)
+                and all(a[0] == b[0] and a[1] is b[1] for a, b in zip(previous, items))):
+            return previous
+        return FrozenMap(items)
+    
+    if isinstance(value, (list, tuple)):
+        kind = FrozenList if isinstance(value, list) else tuple
+        old = previous if type(previous) is kind else ()
+        items = [freeze(item, old[i] if i < len(old) else None) for i, item in enumerate(value)]
+        if len(old) == len(items) and all(a is b for a, b in zip(old, items)) and type(previous) is kind:
+            return previous
+        return kind(items)
+    
+    if hasattr(value, "__dict__"):
+        old = previous if isinstance(previous, FrozenObject) and previous[0] is type(value) else None
+        fields = freeze(vars(value), old[1] if old else None)
+        if old is not None and fields is old[1]:
+            return old
+        return FrozenObject((type(value), fields))
+    
+    raise TypeError(f"No se puede congelar {type(value).__name__}")
+
+def thaw(value):
+    """Reconstruye objetos mutables a partir de freeze()"""
+    if isinstance(value, FrozenObject):
+        cls, fields = value
+        obj = cls.__new__(cls)
+        obj.__dict__.update(thaw(fields))
+        return obj
+    if isinstance(value, FrozenMap):
+        return {key: thaw(item) for key, item in value}
+    if isinstance(value, FrozenList):
+        return [thaw(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(thaw(item) for item in value)
+    return value
+
+@dataclass(frozen=True)
+class Snapshot:
+    """Estado completo de la partida antes de una acción"""
+    turn: int
+    label: str
+    character: FrozenObject
+    enemy: Optional[FrozenObject]
+    world: FrozenMap
+    history: tuple          # los mensajes del historial nunca se modifican tras añadirse
+    memory_size: int
+    gm_turn: int
+
+class Timeline:
+    """
+    Instantáneas por turno con compartición estructural: cada una solo
+    aloja los campos que cambiaron desde la anterior. Las antiguas se aclaran
+    (se conservan cada 2, 4, 8... turnos según su edad) para acotar la memoria.
+    """
+    
+    def __init__(self, keep_recent: int = 50, max_snapshots: int = 200):
+        self.keep_recent = keep_recent
+        self.max_snapshots = max_snapshots
+        self.snapshots: List[Snapshot] = []
+        self.turn = 0
+    
+    def capture(self, session: "GameSession", label: str = "") -> Optional[Snapshot]:
+        """Guarda el estado actual; no hace nada si no cambió desde la última instantánea"""
+        last = self.snapshots[-1] if self.snapshots else None
+        gm = session.gm
+        character = freeze(session.character, last and last.character)
+        enemy = freeze(session.current_enemy, last and last.enemy)
+        world = freeze(gm.world_context, last and last.world)
+        history = tuple(gm.conversation_history)
+        if last and last.history == history:
+            history = last.history
+        
+        if (last and character is last.character and enemy is last.enemy and world is last.world
+                and history is last.history and len(gm.memory) == last.memory_size):
+            return None
+        
+        self.turn += 1
+        snapshot = Snapshot(self.turn, label, character, enemy, world, history, len(gm.memory), gm.turn_count)
+        self.snapshots.append(snapshot)
+        if len(self.snapshots) > self.keep_recent and self.turn % self.keep_recent == 0:
+            self.thin()
+        return snapshot
+    
+    def thin(self):
+        """Aclara las instantáneas antiguas: el espaciado se duplica con la edad"""
+        kept = []
+        for snapshot in self.snapshots:
+            age = self.turn - snapshot.turn
+            stride = 1
+            while age >= self.keep_recent * stride:
+                stride *= 2
+            if snapshot.turn % stride == 0 or age < self.keep_recent:
+                kept.append(snapshot)
+        self.snapshots = kept[-self.max_snapshots:]
+    
+    def pop(self, turns: int = 1) -> Optional[Snapshot]:
+        """Retira y devuelve la instantánea de hace `turns` turnos (o la más cercana conservada)"""
+        if not self.snapshots:
+            return None
+        target = self.snapshots[-1].turn - turns + 1
+        index = bisect.bisect_right([snapshot.turn for snapshot in self.snapshots], target) - 1
+        index = max(0, index)
+        snapshot = self.snapshots[index]
+        del self.snapshots[index:]
+        return snapshot
+
+# ============= DIARIO DE PARTIDA =============
+
+@dataclass
+class JournalHit:
+    """Resultado de una búsqueda en el diario"""
+    timestamp: float
+    character: str
+    kind: str
+    text: str
+
+class SessionJournal:
+    """
+    Registro permanente de todo lo narrado, indexado con SQLite FTS5.
+    Las inserciones se encolan sin bloquear y un hilo escritor las agrupa en
+    transacciones; las búsquedas usan su propia conexión (WAL permite leer
+    mientras se escribe) y recorren el índice de la entrada más reciente hacia
+    atrás, así que cortan en cuanto reúnen los resultados pedidos.
+    """
+    
+    BATCH_SIZE = 500
+    FLUSH_INTERVAL = 0.5
+    # Con --motor-separado la interfaz y el motor escriben en el mismo archivo
+    BUSY_TIMEOUT = 10.0
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            id INTEGER PRIMARY KEY,
+            ts REAL NOT NULL,
+            session TEXT NOT NULL,
+            character TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            text TEXT NOT NULL
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+            text, content='entries', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN
+            INSERT INTO entries_fts(rowid, text) VALUES (new.id, new.text);
+        END;
+    """
+    
+    def __init__(self, path: str = JOURNAL_PATH):
+        self.path = path
+        self.session = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.queue = queue.Queue()
+        self.local = threading.local()
+        self.ready = threading.Event()
+        self.error = None
+        self.error_reported = False
+        self.writer = threading.Thread(target=self._write_loop, name="diario", daemon=True)
+        self.writer.start()
+        self.ready.wait()
+    
+    def record(self, kind: str, text: str, character: str = ""):
+        """Encola una línea; nunca bloquea al que narra"""
+        text = text.strip()
+        if text and self.error is None:
+            self.queue.put((time.time(), self.session, character, kind, text))
+    
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+    
+    def _write_loop(self):
+        try:
+            connection = self._connect()
+            connection.executescript(self.SCHEMA)
+        except sqlite3.Error as e:
+            # Sin FTS5 (o sin disco) el juego sigue; el diario queda desactivado
+            self.error = e
+            return
+        finally:
+            self.ready.set()
+        
+        while True:
+            item = self.queue.get()
+            batch = [item]
+            while item is not None and len(batch) < self.BATCH_SIZE:
+                try:
+                    item = self.queue.get(timeout=self.FLUSH_INTERVAL if len(batch) == 1 else 0)
+                except queue.Empty:
+                    break
+                batch.append(item)
+            rows = [row for row in batch if row is not None]
+            try:
+                if rows and self.error is None:
+                    with connection:
+                        connection.executemany(
+                            "INSERT INTO entries (ts, session, character, kind, text) VALUES (?, ?, ?, ?, ?)", rows)
+            except sqlite3.Error as e:
+                # El hilo sigue vaciando la cola para que flush() no se quede esperando
+                self.error = e
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if batch[-1] is None:
+                connection.close()
+                return
+    
+    def flush(self):
+        """Espera a que todo lo encolado esté escrito"""
+        if self.error is None:
+            self.queue.join()
+    
+    def take_error(self) -> Optional[sqlite3.Error]:
+        """El error que desactivó el diario, solo la primera vez que se pide (para avisarlo una vez)"""
+        if self.error is None or self.error_reported:
+            return None
+        self.error_reported = True
+        return self.error
+    
+    def close(self):
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+    
+    @staticmethod
+    def fts_query(text: str) -> str:
+        """
+        Convierte lo que escribe el jugador en una consulta FTS5 segura: todas
+        las palabras (Y lógico), exactas salvo las que acaban en * ("lob*").
+        Las palabras exactas se resuelven en milisegundos con millones de
+        líneas; los prefijos recorren más índice y se dejan a elección.
+        """
+        terms = []
+        for word, star in re.findall(r"(\w+)(\*?)", text):
+            terms.append(f'"{word}"{star}')
+        return " ".join(terms)
+    
+    def search(self, text: str, limit: int = 50, character: Optional[str] = None) -> List[JournalHit]:
+        """Entradas más recientes que contienen todas las palabras buscadas"""
+        query = self.fts_query(text)
+        if not query or self.error is not None:
+            return []
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = self._connect()
+        sql = ("SELECT e.ts, e.character, e.kind, e.text FROM entries_fts "
+               "JOIN entries e ON e.id = entries_fts.rowid WHERE entries_fts MATCH ?")
+        params = [query]
+        if character:
+            sql += " AND e.character = ?"
+            params.append(character)
+        sql += " ORDER BY entries_fts.rowid DESC LIMIT ?"
+        params.append(limit)
+        return [JournalHit(*row) for row in connection.execute(sql, params)]
+
+# ============= TELEMETRÍA DE COMBATE =============
+
+class CombatTelemetry:
+    """
+    Cada ataque resuelto por CombatSystem se anota como una fila en búferes
+    por columna. Al llenarse, el lote pasa a un hilo escritor que lo añade
+    como grupo de filas a un Parquet (con pyarrow) o a un CSV comprimido, y
+    rota de archivo cada ROTATE_ROWS filas. El bucle de juego solo paga unos
+    append() en memoria.
+    """
+    
+    COLUMNS = ("ts", "run", "fight", "kind", "character", "race", "char_class", "level",
+               "enemy", "enemy_cr", "attack_dice", "attack_roll", "defense_dice", "defense_roll",
+               "damage", "target_hp", "defeated", "effect")
+    
+    BUFFER_ROWS = 8192
+    ROTATE_ROWS = 1_000_000
+    FLUSH_SECONDS = 30.0
+    
+    def __init__(self, directory: str = TELEMETRY_DIR, file_format: Optional[str] = None):
+        self.directory = directory
+        self.format = file_format or ("parquet" if PYARROW_AVAILABLE else "csv")
+        if self.format == "parquet" and not PYARROW_AVAILABLE:
+            raise ValueError("El formato parquet necesita pyarrow")
+        self.run = datetime.now().strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+        self.buffers = {column: [] for column in self.COLUMNS}
+        self.buffer_started = time.monotonic()
+        self.rows_written = 0
+        self.files = []
+        self.error = None          # último error de escritura
+        self.errors = 0            # lotes perdidos
+        self.errors_reported = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._file = None
+        self._writer = None
+        self._file_rows = 0
+        self._thread = threading.Thread(target=self._write_loop, name="telemetria", daemon=True)
+        self._thread.start()
+    
+    def record(self, kind: str, player: Character, enemy: Enemy, result: dict,
+               attack_dice: str, defense_dice: str, target_hp: int, defeated: bool):
+        """Anota un ataque resuelto (kind: "jugador" o "enemigo")"""
+        row = (time.time(), self.run, enemy.id, kind, player.name, player.race, player.char_class,
+               player.level, enemy.type, enemy.cr, attack_dice, result["attack_roll"], defense_dice,
+               result["defense_roll"], result["damage"], target_hp, defeated, result.get("effect") or "")
+        with self._lock:
+            for column, value in zip(self.buffers.values(), row):
+                column.append(value)
+            full = (len(self.buffers["ts"]) >= self.BUFFER_ROWS
+                    or time.monotonic() - self.buffer_started >= self.FLUSH_SECONDS)
+        if full:
+            self.flush()
+    
+    def flush(self):
+        """Entrega el búfer actual al hilo escritor"""
+        with self._lock:
+            if not self.buffers["ts"]:
+                return
+            batch = self.buffers
+            self.buffers = {column: [] for column in self.COLUMNS}
+            self.buffer_started = time.monotonic()
+        self._queue.put(batch)
+    
+    def take_error(self) -> Optional[str]:
+        """Último error de escritura si se han perdido lotes desde la última vez que se pidió"""
+        lost = self.errors - self.errors_reported
+        if not lost:
+            return None
+        self.errors_reported += lost
+        return f"{self.error} (lotes perdidos: {lost})"
+    
+    def close(self):
+        """Escribe lo pendiente y cierra el archivo actual"""
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+    
+    def _write_loop(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                self._close_file()
+                return
+            try:
+                self._write(batch)
+            except (OSError, ValueError) as e:
+                # La telemetría nunca debe tumbar la partida: se pierde el lote y lo avisa quien la usa
+                self.error = e
+                self.errors += 1
+    
+    def _open_file(self):
+        os.makedirs(self.directory, exist_ok=True)
+        extension = "parquet" if self.format == "parquet" else "csv.gz"
+        path = os.path.join(self.directory, f"combate-{self.run}-{len(self.files) + 1:04d}.{extension}")
+        if self.format == "parquet":
+            self._file = path
+            self._writer = pq.ParquetWriter(path, self.arrow_schema(), compression="zstd")
+        else:
+            self._file = gzip.open(path, "wt", encoding="utf-8", newline="")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(self.COLUMNS)
+        self.files.append(path)
+        self._file_rows = 0
+    
+    def _close_file(self):
+        if self._writer is None:
+            return
+        if self.format == "parquet":
+            self._writer.close()
+        else:
+            self._file.close()
+        self._file = self._writer = None
+    
+    def _write(self, batch: Dict[str, list]):
+        rows = len(batch["ts"])
+        if self._writer is None or self._file_rows >= self.ROTATE_ROWS:
+            self._close_file()
+            self._open_file()
+        if self.format == "parquet":
+            self._writer.write_table(pa.table(batch, schema=self.arrow_schema()))
+        else:
+            batch["defeated"] = [int(value) for value in batch["defeated"]]
+            self._writer.writerows(zip(*batch.values()))
+            self._file.flush()  # punto de sincronía: lo escrito se puede leer aunque el proceso muera
+        self._file_rows += rows
+        self.rows_written += rows
+    
+    @staticmethod
+    def arrow_schema():
+        return pa.schema([
+            ("ts", pa.float64()), ("run", pa.string()), ("fight", pa.int64()), ("kind", pa.string()),
+            ("character", pa.string()), ("race", pa.string()), ("char_class", pa.string()),
+            ("level", pa.int32()), ("enemy", pa.string()), ("enemy_cr", pa.int32()),
+            ("attack_dice", pa.string()), ("attack_roll", pa.int32()), ("defense_dice", pa.string()),
+            ("defense_roll", pa.int32()), ("damage", pa.int32()), ("target_hp", pa.int32()),
+            ("defeated", pa.bool_()), ("effect", pa.string())
+        ])
+
+# ============= DIAGNÓSTICO DE MEMORIA =============
+
+@dataclass
+class MemorySample:
+    """Medida de memoria en un instante de la partida"""
+    label: str
+    traced: int                   # bytes vivos según tracemalloc
+    peak: int
+    objects: Dict[str, int]       # objetos Python vivos por tipo
+    gauges: Dict[str, int]        # contadores propios (widgets, líneas, recuerdos...)
+    snapshot: object = None
+
+class MemoryDiagnostics:
+    """
+    Toma instantáneas de tracemalloc, cuenta objetos vivos por tipo y los
+    contadores registrados (widgets de Tk, historial, recuerdos...) y añade a
+    un informe de texto las diferencias con la medida anterior.
+    """
+    
+    FRAMES = 1
+    TOP = 15
+    
+    def __init__(self, report_path: Optional[str] = MEMORY_REPORT_PATH, top: int = TOP):
+        self.report_path = report_path
+        self.top = top
+        self.gauges = {}
+        self.baseline = None
+        self.previous = None
+        self._filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ]
+    
+    def add_gauge(self, name: str, function):
+        """Registra un contador: función sin argumentos que devuelve un entero"""
+        self.gauges[name] = function
+    
+    def watch_session(self, session: "GameSession"):
+        """Contadores de las estructuras de la sesión que crecen con la partida"""
+        gm = session.gm
+        self.add_gauge("historial GM", lambda: len(gm.conversation_history))
+        self.add_gauge("recuerdos GM", lambda: len(gm.memory.memories))
+        self.add_gauge("instantáneas", lambda: len(session.timeline.snapshots))
+        self.add_gauge("fragmentos de mapa", lambda: len(gm.world_map.chunks))
+        self.add_gauge("posiciones tácticas", lambda: sum(len(matchup.table)
+                                                          for matchup in session.enemy_tactics.matchups.values()))
+    
+    def watch_tk(self, root: tk.Misc):
+        """Contadores de widgets vivos (lado Python) y comandos registrados en Tcl"""
+        def count_widgets(widget) -> int:
+            return 1 + sum(count_widgets(child) for child in widget.children.values())
+        self.add_gauge("widgets", lambda: count_widgets(root))
+        self.add_gauge("comandos Tcl", lambda: len(root.tk.splitlist(root.tk.call("info", "commands"))))
+    
+    def start(self) -> MemorySample:
+        """Activa tracemalloc (si no lo estaba) y toma la medida de referencia"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.FRAMES)
+        self.baseline = self.previous = self.sample("inicio")
+        return self.baseline
+    
+    def stop(self):
+        tracemalloc.stop()
+        self.baseline = self.previous = None
+    
+    def sample(self, label: str) -> MemorySample:
+        """Mide sin escribir el informe"""
+        gc.collect()
+        snapshot = tracemalloc.take_snapshot().filter_traces(self._filters)
+        traced, peak = tracemalloc.get_traced_memory()
+        objects = {}
+        for obj in gc.get_objects():
+            name = type(obj).__name__
+            objects[name] = objects.get(name, 0) + 1
+        gauges = {name: function() for name, function in self.gauges.items()}
+        return MemorySample(label, traced, peak, objects, gauges, snapshot)
+    
+    def report(self, label: str = "") -> MemorySample:
+        """Mide, escribe las diferencias con la medida anterior y la devuelve"""
+        if self.previous is None:
+            self.start()
+        current = self.sample(label or datetime.now().strftime("%H:%M:%S"))
+        lines = self.diff_lines(self.previous, current)
+        if self.report_path:
+            with open(self.report_path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n\n")
+        self.previous = current
+        return current
+    
+    def diff_lines(self, before: MemorySample, after: MemorySample) -> List[str]:
+        """Informe legible de lo que creció entre dos medidas"""
+        lines = [f"=== {after.label} (desde {before.label}) ===",
+                 f"Memoria trazada: {after.traced / 1024:.0f} KiB ({(after.traced - before.traced) / 1024:+.0f} KiB), "
+                 f"pico {after.peak / 1024:.0f} KiB"]
+        if after.gauges:
+            lines.append("Contadores: " + ", ".join(
+                f"{name} {value} ({value - before.gauges.get(name, 0):+d})" for name, value in after.gauges.items()))
+        
+        growth = sorted(((count - before.objects.get(name, 0), name, count)
+                         for name, count in after.objects.items()), reverse=True)
+        lines.append("Objetos que más crecieron:")
+        lines += [f"  {name}: {count} ({delta:+d})" for delta, name, count in growth[:self.top] if delta > 0]
+        
+        lines.append("Líneas que más memoria reservaron:")
+        for stat in after.snapshot.compare_to(before.snapshot, "lineno")[:self.top]:
+            if stat.size_diff <= 0:
+                break
+            frame = stat.traceback[0]
+            lines.append(f"  {os.path.basename(frame.filename)}:{frame.lineno}: "
+                         f"{stat.size_diff / 1024:+.1f} KiB ({stat.count_diff:+d} bloques)")
+        return lines
+
+# ============= MOTOR DE JUEGO SIN INTERFAZ =============
+
+class EventType:
+    """Tipos de evento que emite GameSession"""
+    NARRATION = "narration"                  # texto para el registro (text + tag de formato)
+    CHARACTER_CHANGED = "character_changed"  # stats, HP, oro o nivel cambiaron
+    COMBAT_STARTED = "combat_started"
+    COMBAT_ENDED = "combat_ended"
+    COMBAT_ROUND = "combat_round"            # un golpe resuelto (data: atacante, objetivo, tirada, daño, HP)
+    GAME_OVER = "game_over"
+    LOCATION_CHANGED = "location_changed"    # el GM movió al jugador a otra zona
+    SAVE_REQUESTED = "save_requested"        # el jugador pidió guardar (la persistencia es del anfitrión)
+    WARNING = "warning"                      # acción no permitida en el estado actual
+
+@dataclass
+class GameEvent:
+    """Evento emitido por el motor para la interfaz, un servidor o un bot"""
+    type: str
+    text: str = ""
+    tag: str = "normal"
+    data: Optional[dict] = None
+
+@dataclass
+class AutoBattlePolicy:
+    """Reglas del combate automático (umbrales como fracción del HP máximo)"""
+    name: str = "agresiva"
+    defend_below: float = 0.0
+    flee_below: float = 0.0
+    max_turns: int = 500
+    
+    def choose(self, character: Character) -> str:
+        fraction = character.hp_actual / character.hp_max if character.hp_max else 0.0
+        if fraction < self.flee_below:
+            return "huir"
+        if fraction < self.defend_below:
+            return "defender"
+        return "atacar"
+
+AUTO_BATTLE_POLICIES = {
+    "agresiva": AutoBattlePolicy("agresiva"),
+    "prudente": AutoBattlePolicy("prudente", defend_below=0.35, flee_below=0.15),
+    "superviviente": AutoBattlePolicy("superviviente", defend_below=0.5, flee_below=0.25)
+}
+
+@dataclass
+class AutoBattleReport:
+    """Resultado condensado de un combate automático"""
+    policy: str
+    turns: int = 0
+    attacks: int = 0
+    defends: int = 0
+    hits: int = 0
+    damage_dealt: int = 0
+    damage_taken: int = 0
+    outcome: str = "unfinished"  # victory, fled, escaped, defeat o unfinished
+    elapsed_ms: float = 0.0
+    
+    OUTCOMES = {"victory": "victoria", "fled": "huida", "escaped": "el enemigo escapó",
+                "defeat": "derrota", "unfinished": "el combate continúa"}
+    
+    def summary_lines(self) -> List[str]:
+        return [
+            f"{self.turns} turnos: {self.attacks} ataques ({self.hits} impactos), {self.defends} defensas",
+            f"Daño infligido: {self.damage_dealt}   Daño recibido: {self.damage_taken}",
+            f"Resultado: {self.OUTCOMES[self.outcome]}"
+        ]
+
+class HeldEvents:
+    """
+    Eventos retenidos mientras el motor resuelve un combate automático: la
+    narración golpe a golpe se descarta (queda resumida en el informe), de los
+    golpes y cambios de personaje solo importa el último estado, y el resto
+    (recompensas, fin de combate, muerte...) se entrega tal cual al terminar.
+    """
+    
+    KEPT_TAGS = {"reward"}
+    
+    def __init__(self, report: AutoBattleReport, player_key: str):
+        self.report = report
+        self.player_key = player_key
+        self.kept: List[GameEvent] = []
+        self.rounds: Dict[str, GameEvent] = {}
+        self.character_changed = False
+    
+    def add(self, event: GameEvent):
+        if event.type == EventType.NARRATION:
+            if event.tag in self.KEPT_TAGS:
+                self.kept.append(event)
+        elif event.type == EventType.COMBAT_ROUND:
+            data = event.data
+            if data["attacker"] == self.player_key:
+                self.report.damage_dealt += data["damage"]
+                self.report.hits += data["damage"] > 0
+            elif data["target"] == self.player_key:
+                self.report.damage_taken += data["damage"]
+            self.rounds[data["target"]] = event
+        elif event.type == EventType.CHARACTER_CHANGED:
+            self.character_changed = True
+        else:
+            self.kept.append(event)
+    
+    def take_state(self) -> List[GameEvent]:
+        """Último golpe por objetivo y un único CHARACTER_CHANGED"""
+        events = list(self.rounds.values())
+        if self.character_changed:
+            events.append(GameEvent(EventType.CHARACTER_CHANGED))
+        self.rounds.clear()
+        self.character_changed = False
+        return events
+
+class GameSession:
+    """
+    Motor de juego sin Tk: contiene las reglas y el flujo de una partida y
+    comunica todo lo que ocurre mediante eventos a sus suscriptores
+    """
+    
+    LOOT_CHANCE = 0.3
+    INVENTORY_LINES = 30
+    PLAYER_KEY = "jugador"  # clave del personaje en los eventos COMBAT_ROUND
+    
+    def __init__(self, gm: Optional[AIGameMaster] = None,
+                 combat_system: Optional[CombatSystem] = None,
+                 narrate_combat: bool = True,
+                 journal: Optional[SessionJournal] = None):
+        self.gm = gm or AIGameMaster()
+        self.combat_system = combat_system or CombatSystem()
+        self.dice_system = DiceSystem()
+        self.narrate_combat = narrate_combat
+        self.command_parser = COMMAND_PARSER
+        self.training_simulator = TrainingSimulator()
+        self.timeline = Timeline()
+        self.character = None
+        self.current_enemy = None
+        self.combat_narrator = None
+        self.journal = journal
+        self.auto_policy = AUTO_BATTLE_POLICIES["prudente"]
+        self.enemy_tactics = ENEMY_TACTICS
+        self.allocation_solver = ALLOCATION_SOLVER
+        self.content_version = CONTENT.version
+        self.content_error = None
+        self._held = None
+        self._subscribers = []
+    
+    # --- Eventos ---
+    
+    def subscribe(self, callback):
+        """Registra una función que recibirá cada GameEvent"""
+        self._subscribers.append(callback)
+    
+    def unsubscribe(self, callback):
+        """Deja de enviar eventos a una función"""
+        self._subscribers.remove(callback)
+    
+    def emit(self, event_type: str, text: str = "", tag: str = "normal", data: Optional[dict] = None):
+        """Envía un evento a todos los suscriptores"""
+        if self._held is not None:
+            # El informe del combate automático se calcula aquí, haya o no
+            # suscriptores (bots, pruebas de carga y de memoria)
+            self._held.add(GameEvent(event_type, text, tag, data))
+            return
+        if not self._subscribers:
+            return
+        event = GameEvent(event_type, text, tag, data)
+        for callback in self._subscribers:
+            callback(event)
+    
+    def deliver(self, events: List[GameEvent]):
+        """Entrega eventos ya construidos (los retenidos por un combate automático)"""
+        for event in events:
+            for callback in self._subscribers:
+                callback(event)
+    
+    def narrate(self, text: str, tag: str = "normal"):
+        """Emite una línea de narración"""
+        self.emit(EventType.NARRATION, text, tag)
+    
+    def encounter_table(self) -> Tuple[Tuple[str, ...], Tuple[float, ...]]:
+        """Tabla de encuentros de la zona actual (la de determine_encounter)"""
+        return self.gm.current_zone().encounter_table()
+    
+    @property
+    def in_combat(self) -> bool:
+        """Indica si hay un enemigo vivo en combate"""
+        return self.current_enemy is not None and self.current_enemy.is_alive
+    
+    # --- Partida ---
+    
+    def welcome(self):
+        """Mensajes de bienvenida a la Habitación del Tiempo"""
+        self.narrate("=== PROTOTIPO HABITACIÓN DEL TIEMPO 0.1 ===\n", "title")
+        self.narrate("Bienvenido a la dimensión de entrenamiento definitiva.\n", "system")
+        self.narrate("Aquí el tiempo fluye diferente. Un día aquí es un año afuera.", "system")
+        self.narrate("Tu objetivo: volverte más fuerte que nunca.\n", "system")
+    
+    def create_character(self, name: str, race: str, char_class: str,
+                         attributes: Optional[Dict[str, int]] = None,
+                         initial_scene: bool = True) -> Character:
+        """Crea el personaje de la sesión y genera su escena inicial"""
+        self.character = Character(name, race, char_class)
+        self.timeline = Timeline()
+        
+        # Aplicar atributos personalizados
+        for attr, value in (attributes or {}).items():
+            setattr(self.character.attributes, attr, value)
+        
+        self.emit(EventType.CHARACTER_CHANGED)
+        
+        if initial_scene:
+            self.narrate("\n" + "="*50 + "\n", "system")
+            self.narrate(self.gm.generate_initial_scene(self.character), "narration")
+        return self.character
+    
+    def check_content(self):
+        """Avisa de una recarga en caliente del contenido o de un error al recargarlo"""
+        CONTENT.ensure_fresh()
+        if CONTENT.error != self.content_error:
+            self.content_error = CONTENT.error
+            if CONTENT.error:
+                self.emit(EventType.WARNING, f"Error recargando contenido: {CONTENT.error}")
+        if CONTENT.version != self.content_version:
+            if self.content_version:   # la primera carga no es una recarga
+                self.narrate(f"📚 Contenido recargado (versión {CONTENT.version})", "system")
+            self.content_version = CONTENT.version
+    
+    def check_sinks(self):
+        """Avisa una vez de cada fallo del diario o de la telemetría, que escriben en segundo plano"""
+        error = self.journal.take_error() if self.journal else None
+        if error:
+            self.emit(EventType.WARNING, f"Diario desactivado: {error}")
+        telemetry = self.combat_system.telemetry
+        error = telemetry.take_error() if telemetry else None
+        if error:
+            self.emit(EventType.WARNING, f"Error escribiendo telemetría: {error}")
+    
+    def process_input(self, user_input: str):
+        """Procesa una acción de texto del jugador"""
+        action = self.begin_input(user_input)
+        if action:
+            # Una sola llamada al GM devuelve la narración y, si procede, el encuentro
+            self.apply_turn(self.gm.generate_turn(action, self.character))
+    
+    def is_cpu_bound(self, user_input: str) -> bool:
+        """Si la entrada es un comando local que ocupa la CPU un buen rato (entrenar, combate automático, reparto)"""
+        parser, text = self.command_parser, user_input.strip()
+        if parser.parse_rewind(text) is not None:
+            return False
+        return (parser.parse_training(text) is not None or parser.parse_auto_battle(text) is not None
+                or parser.parse_allocation(text) is not None)
+    
+    def begin_input(self, user_input: str) -> Optional[str]:
+        """
+        Valida y muestra la entrada del jugador; devuelve la acción si debe
+        resolverla el GM o None si ya se resolvió localmente
+        """
+        if not self.character:
+            self.emit(EventType.WARNING, "Primero debes crear un personaje")
+            return None
+        
+        user_input = user_input.strip()
+        if not user_input:
+            return None
+        
+        # Mostrar entrada del jugador
+        self.narrate(f"> {user_input}", "system")
+        self.check_content()
+        self.check_sinks()
+        
+        turns = self.command_parser.parse_rewind(user_input)
+        if turns is not None:
+            self.rewind(turns)
+            return None
+        self.checkpoint("acción")
+        
+        # Acciones mecánicas: se resuelven localmente sin llamar al GM
+        hours = self.command_parser.parse_training(user_input)
+        if hours is not None:
+            self.train(hours)
+            return None
+        
+        policy = self.command_parser.parse_auto_battle(user_input)
+        if policy:
+            self.auto_battle(policy)
+            return None
+        
+        direction = self.command_parser.parse_travel(user_input)
+        if direction:
+            self.travel(direction)
+            return None
+        
+        objective = self.command_parser.parse_allocation(user_input)
+        if objective:
+            self.auto_allocate(objective)
+            return None
+        
+        equip = self.command_parser.parse_equip(user_input, self.character)
+        if equip:
+            self.change_equipment(*equip)
+            return None
+        
+        query = self.command_parser.parse_inventory_query(user_input)
+        if query is not None:
+            self.describe_inventory(**query)
+            return None
+        
+        enemy_words = set(normalize_command_text(self.current_enemy.type).split()) if self.current_enemy else None
+        command = self.command_parser.parse(user_input, enemy_words, self.in_combat)
+        if command:
+            self.run_command(command)
+            return None
+        
+        # Si estamos en combate, manejar comandos de combate
+        if self.in_combat:
+            self.narrate("¡Estás en combate! Usa los botones de acción o escribe 'huir'", "combat")
+            if "huir" in user_input.lower():
+                self.end_combat(fled=True)
+            return None
+        
+        # Cada acción narrada por el GM cuenta como un turno para los efectos
+        if not self.advance_effects():
+            return None
+        return user_input
+    
+    def run_command(self, command: str):
+        """Ejecuta un comando local reconocido por CommandParser"""
+        if command == "atacar":
+            self.attack()
+        elif command == "defender":
+            self.defend()
+        elif command == "huir":
+            self.end_combat(fled=True)
+        elif command == "descansar":
+            self.rest()
+        elif command == "percepcion":
+            self.roll_perception()
+        elif command == "guardar":
+            self.emit(EventType.SAVE_REQUESTED)
+        elif command == "inventario":
+            self.describe_inventory()
+        elif command == "estado":
+            self.describe_status()
+        elif command == "mapa":
+            self.describe_map()
+    
+    def describe_inventory(self, slot: Optional[str] = None, item_type: Optional[str] = None,
+                           rarity: Optional[str] = None, sort_by: str = "nombre"):
+        """Muestra inventario (opcionalmente filtrado y ordenado) y equipo"""
+        inventory = self.character.inventory
+        names = inventory.filter(slot, item_type, rarity, sort_by)
+        filtered = slot or item_type or rarity
+        header = f"{len(names)} de {len(inventory)} objetos" if filtered else f"{inventory.total()} objetos"
+        self.narrate(f"\n🎒 Inventario ({header}):" if names else "\n🎒 Inventario: vacío", "system")
+        for name in names[:self.INVENTORY_LINES]:
+            item = CONTENT.items.get(name)
+            count = inventory.count(name)
+            details = f" — {item['rarity']}, {item['slot'] or item['type']}" if item else ""
+            self.narrate(f"   {name}{f' x{count}' if count > 1 else ''}{details}", "system")
+        if len(names) > self.INVENTORY_LINES:
+            self.narrate(f"   ... y {len(names) - self.INVENTORY_LINES} más", "system")
+        for slot_name, item in self.character.equipment.items():
+            self.narrate(f"   {slot_name.capitalize()}: {item or 'Nada'}", "system")
+        self.narrate(f"   💰 Oro: {self.character.gold}", "reward")
+    
+    def change_equipment(self, action: str, target: str):
+        """Equipa un objeto del inventario o vacía una ranura (ya resueltos por parse_equip)"""
+        if self.in_combat:
+            self.narrate("¡No puedes cambiar de equipo en combate!", "system")
+            return
+        character = self.character
+        if action == "equipar":
+            slot = character.equip(target)
+            if slot is None:
+                self.narrate(f"No tienes nada equipable llamado '{target}'.", "system")
+                return
+            self.narrate(f"Te equipas {target} ({slot}).", "system")
+        else:
+            name = character.unequip(target)
+            if name is None:
+                self.narrate(f"No llevas nada equipado en la ranura {target}.", "system")
+                return
+            self.narrate(f"Guardas {name} en la mochila.", "system")
+        self.narrate(f"   ⚔️ Ataque: {character.get_attack_dice()}   🛡️ Defensa: {character.get_defense_dice()}",
+                     "system")
+        self.emit(EventType.CHARACTER_CHANGED)
+    
+    def roll_loot(self, enemy: Enemy) -> Optional[str]:
+        """Botín al vencer: objetos de rareza acorde al CR del enemigo"""
+        if random.random() >= self.LOOT_CHANCE:
+            return None
+        names = []
+        for rarity in ITEM_RARITIES[:enemy.cr + 1]:
+            names.extend(sorted(CONTENT.items_where(rarity=rarity)))
+        return random.choice(names) if names else None
+    
+    def describe_status(self):
+        """Muestra el estado del personaje"""
+        c = self.character
+        self.narrate(f"\n📊 {c.name} - {c.race} {c.char_class} de nivel {c.level}", "system")
+        self.narrate(f"   ❤️ HP: {c.hp_actual}/{c.hp_max}   💙 Maná: {c.mana_actual}/{c.mana_max}", "system")
+        self.narrate(f"   ⭐ EXP: {c.experience}/{c.exp_to_next}   💰 Oro: {c.gold}", "system")
+        if c.improvement_points:
+            self.narrate(f"   ✨ Puntos de mejora sin asignar: {c.improvement_points} "
+                         f"('repartir puntos' los asigna)", "reward")
+        self.narrate(f"   ⚔️ Ataque: {c.get_attack_dice()}   🛡️ Defensa: {c.get_defense_dice()}", "system")
+        if c.status_effects:
+            self.narrate(f"   🌀 Efectos: {', '.join(c.status_effects.names())}", "system")
+        if self.in_combat:
+            enemy = self.current_enemy
+            self.narrate(f"   Enemigo: {enemy.type} ({enemy.hp_current}/{enemy.hp_max} HP)", "combat")
+    
+    def apply_turn(self, turn: GMResponse):
+        """Aplica la respuesta del GM: narración y posible encuentro"""
+        self.narrate(turn.narration, "narration")
+        if turn.location:
+            self.emit(EventType.LOCATION_CHANGED, data={"location": turn.location})
+        if turn.encounter:
+            self.start_combat(turn.encounter)
+    
+    # --- Combate ---
+    
+    def start_combat(self, enemy_type: str):
+        """Inicia un combate"""
+        self.current_enemy = Enemy(enemy_type)
+        self.character.in_combat = True
+        self.combat_narrator = CombatNarrationBatcher(self.character.name, enemy_type)
+        
+        self.emit(EventType.COMBAT_STARTED, data={"enemy": enemy_type})
+        
+        # Narración de combate
+        self.narrate(f"\n⚔️ ¡COMBATE! ⚔️", "combat")
+        self.narrate(f"¡Un {enemy_type} aparece!", "combat")
+        self.narrate(self.current_enemy.description, "narration")
+        self.narrate(f"HP del enemigo: {self.current_enemy.hp_current}/{self.current_enemy.hp_max}", "combat")
+    
+    def attack(self):
+        """Ataque del jugador seguido del contraataque enemigo"""
+        if not self.in_combat:
+            return
+        self.checkpoint("atacar")
+        if not self.advance_effects():
+            return
+        
+        if self.character.status_effects.is_stunned:
+            self.narrate(f"\n{self.character.name} está aturdido y pierde el turno.", "combat")
+            self.enemy_turn()
+            return
+        
+        # Ataque del jugador
+        self.narrate(f"\n{self.character.name} ataca al {self.current_enemy.type}!", "combat")
+        
+        attack_dice = self.character.get_attack_dice()
+        result = self.combat_system.player_attack(self.character, self.current_enemy)
+        self.emit_round(self.PLAYER_KEY, self.enemy_key(), result['damage'], result['attack_roll'], attack_dice)
+        
+        self.narrate(f"Tirada de ataque: {result['attack_desc']}", "dice")
+        self.narrate(f"Defensa enemiga: {result['defense_desc']}", "dice")
+        
+        if result['enemy_defending']:
+            self.narrate(f"La guardia del {self.current_enemy.type} absorbe la mitad del golpe.", "system")
+        if result['damage'] > 0:
+            self.narrate(f"¡Infliges {result['damage']} puntos de daño!", "combat")
+        else:
+            self.narrate("¡El enemigo esquiva tu ataque!", "combat")
+        
+        self.narrate_combat_batch(self.combat_narrator.add_player_attack(result))
+        
+        if result['enemy_defeated']:
+            self.end_combat(victory=True)
+            return
+        
+        # Contraataque del enemigo
+        self.enemy_turn()
+    
+    def defend(self):
+        """Defensa: reduce a la mitad el daño del siguiente ataque enemigo"""
+        if not self.in_combat:
+            return
+        self.checkpoint("defender")
+        if not self.advance_effects():
+            return
+        
+        self.narrate(f"\n{self.character.name} se prepara para defender...", "combat")
+        self.narrate("Tu defensa aumenta temporalmente.", "system")
+        
+        # Por simplicidad, el enemigo ataca pero con menos daño
+        self.enemy_turn(defending=True)
+    
+    def enemy_turn(self, defending: bool = False):
+        """Turno del enemigo"""
+        if not self.in_combat:
+            return
+        
+        enemy = self.current_enemy
+        if enemy.status_effects.is_stunned:
+            self.narrate(f"\nEl {enemy.type} está aturdido y no puede atacar.", "combat")
+            return
+        
+        action = self.enemy_tactics.choose(enemy, self.character, defending)
+        if action != "especial":
+            enemy.special_cooldown = max(0, enemy.special_cooldown - 1)
+        if action == "defender":
+            enemy.defending = True
+            self.narrate(f"\nEl {enemy.type} se pone en guardia.", "combat")
+            self.narrate_combat_batch(self.combat_narrator.add(
+                {"kind": "enemy_action", "text": "El enemigo se pone en guardia"}))
+            return
+        if action == "huir":
+            if random.random() < CombatSystem.ENEMY_FLEE_CHANCE:
+                self.narrate(f"\n¡El {enemy.type} huye!", "combat")
+                self.end_combat(escaped=True)
+            else:
+                self.narrate(f"\nEl {enemy.type} intenta huir, pero no encuentra salida.", "combat")
+                self.narrate_combat_batch(self.combat_narrator.add(
+                    {"kind": "enemy_action", "text": "El enemigo intenta huir sin éxito"}))
+            return
+        
+        special = action == "especial"
+        if special:
+            self.narrate(f"\n¡El {enemy.type} descarga un golpe brutal!", "combat")
+        else:
+            self.narrate(f"\n¡El {enemy.type} ataca!", "combat")
+        
+        attack_dice = enemy.get_attack_dice()
+        result = self.combat_system.enemy_attack(enemy, self.character, special, defending)
+        
+        self.narrate(f"Ataque enemigo: {result['attack_desc']}", "dice")
+        self.narrate(f"Tu defensa: {result['defense_desc']}", "dice")
+        
+        damage = result['damage']
+        if defending:
+            self.narrate("¡Tu postura defensiva reduce el daño a la mitad!", "system")
+        
+        if damage > 0:
+            self.narrate(f"¡Recibes {damage} puntos de daño!", "combat")
+        else:
+            self.narrate("¡Esquivas el ataque!", "combat")
+        self.emit_round(self.enemy_key(), self.PLAYER_KEY, damage, result['attack_roll'], attack_dice)
+        if result['effect']:
+            self.narrate(f"¡El ataque te deja {result['effect']}!", "combat")
+        
+        self.narrate_combat_batch(self.combat_narrator.add_enemy_attack(
+            result, damage, self.character.hp_actual, defending))
+        if result['player_defeated']:
+            self.narrate_combat_batch(self.combat_narrator.end_fight("defeat"))
+        
+        self.emit(EventType.CHARACTER_CHANGED)
+        
+        if result['player_defeated']:
+            self.game_over()
+    
+    def end_combat(self, victory: bool = False, fled: bool = False, escaped: bool = False):
+        """Termina el combate y reparte recompensas (escaped: el enemigo huyó)"""
+        self.character.in_combat = False
+        # Se suelta al enemigo antes de avisar: los suscriptores ya ven in_combat falso
+        enemy, self.current_enemy = self.current_enemy, None
+        
+        self.emit(EventType.COMBAT_ENDED, data={"victory": victory, "fled": fled, "escaped": escaped})
+        
+        if self.combat_narrator:
+            outcome = "victory" if victory else "fled" if fled else "escaped" if escaped else None
+            if outcome:
+                self.narrate_combat_batch(self.combat_narrator.end_fight(outcome))
+            self.combat_narrator = None
+        
+        if victory and enemy:
+            self.narrate(f"\n¡VICTORIA! Has derrotado al {enemy.type}.", "combat")
+            
+            # Calcular recompensas
+            gold = random.randint(*enemy.gold_range)
+            exp = enemy.exp_reward
+            
+            self.narrate(f"\n🎉 Recompensas:", "reward")
+            self.narrate(f"   +{exp} puntos de experiencia", "reward")
+            self.narrate(f"   +{gold} monedas de oro", "reward")
+            loot = self.roll_loot(enemy)
+            if loot:
+                self.narrate(f"   🎁 {loot}", "reward")
+                self.character.inventory.add(loot)
+            
+            # Aplicar recompensas
+            self.character.gold += gold
+            old_level = self.character.level
+            self.character.add_experience(exp)
+            self.character.kills += 1
+            self.gm.world_map.record_kill(*self.gm.position())
+            self.log("combate", f"Victoria contra {enemy.type}: +{gold} oro, +{exp} EXP"
+                                + (f", botín: {loot}" if loot else ""))
+            
+            if self.character.level > old_level:
+                self.narrate(f"\n¡SUBISTE DE NIVEL! Ahora eres nivel {self.character.level}", "reward")
+                self.narrate("Tus estadísticas han mejorado.", "system")
+            
+            self.emit(EventType.CHARACTER_CHANGED)
+            
+        elif fled:
+            if enemy:
+                self.log("combate", f"Huida del combate contra {enemy.type}")
+            self.narrate(f"\n¡Huyes del combate!", "combat")
+            self.narrate("A veces la retirada es la mejor estrategia...", "system")
+        
+        elif escaped and enemy:
+            self.log("combate", f"El {enemy.type} escapó del combate")
+            self.narrate(f"El {enemy.type} se desvanece en la Habitación. No hay recompensa esta vez.",
+                         "system")
+    
+    def enemy_key(self) -> str:
+        """Clave del enemigo actual en las vistas de combate"""
+        return f"enemigo-{self.current_enemy.id}"
+    
+    def emit_round(self, attacker: str, target: str, damage: int, attack_roll: Optional[int] = None,
+                   attack_dice: str = ""):
+        """Evento COMBAT_ROUND con el HP del objetivo ya actualizado (para vistas animadas)"""
+        if target == self.PLAYER_KEY:
+            hp, hp_max = self.character.hp_actual, self.character.hp_max
+        else:
+            hp, hp_max = self.current_enemy.hp_current, self.current_enemy.hp_max
+        spec = DiceSystem.parse(attack_dice) if attack_dice else None
+        self.emit(EventType.COMBAT_ROUND, data={
+            "attacker": attacker, "target": target, "damage": damage, "hp": hp, "hp_max": hp_max,
+            "attack_roll": attack_roll, "faces": spec.caras if spec else 20
+        })
+    
+    def log(self, kind: str, text: str):
+        """Anota un resultado en el diario de partida, si la sesión tiene uno"""
+        if self.journal:
+            self.journal.record(kind, text, self.character.name if self.character else "")
+    
+    def advance_effects(self) -> bool:
+        """
+        Avanza un turno los efectos del personaje y del enemigo (daño periódico
+        y expiraciones); devuelve False si alguien cae y la acción no sigue
+        """
+        character = self.character
+        tick = character.status_effects.tick()
+        if tick.damage > 0:
+            character.take_damage(tick.damage)
+            if self.in_combat:
+                self.emit_round("", self.PLAYER_KEY, tick.damage)
+            self.narrate(f"Los efectos te causan {tick.damage} puntos de daño.", "combat")
+        elif tick.damage < 0:
+            character.heal(-tick.damage)
+            self.narrate(f"Recuperas {-tick.damage} puntos de vida.", "system")
+        for name in tick.expired:
+            self.narrate(f"El efecto {name} se disipa.", "system")
+        if tick.damage or tick.expired:
+            self.emit(EventType.CHARACTER_CHANGED)
+        if character.hp_actual <= 0:
+            if self.combat_narrator:
+                self.narrate_combat_batch(self.combat_narrator.end_fight("defeat"))
+            self.game_over()
+            return False
+        
+        enemy = self.current_enemy if self.in_combat else None
+        if enemy and enemy.status_effects:
+            tick = enemy.status_effects.tick()
+            if tick.damage > 0:
+                enemy.take_damage(tick.damage)
+                self.emit_round("", self.enemy_key(), tick.damage)
+                self.narrate(f"El {enemy.type} sufre {tick.damage} puntos de daño por sus heridas.", "combat")
+            for name in tick.expired:
+                self.narrate(f"El {enemy.type} se libra de {name}.", "system")
+            if not enemy.is_alive:
+                self.end_combat(victory=True)
+                return False
+        return True
+    
+    def auto_battle(self, policy: Optional[AutoBattlePolicy] = None,
+                    refresh_interval: Optional[float] = None) -> Optional[AutoBattleReport]:
+        """
+        Resuelve el combate en curso a velocidad de motor según una política.
+        Solo se muestran un resumen, las recompensas y el estado final; con
+        refresh_interval se entrega además el último estado cada tantos segundos.
+        """
+        if not self.in_combat:
+            self.narrate("No hay ningún enemigo frente a ti. La Habitación aguarda en silencio.", "system")
+            return None
+        policy = policy or self.auto_policy
+        self.checkpoint("combate automático")
+        
+        report = AutoBattleReport(policy.name)
+        started = last_flush = time.perf_counter()
+        deaths, kills = self.character.deaths, self.character.kills
+        narrate_combat = self.narrate_combat
+        self.narrate_combat = False
+        held = self._held = HeldEvents(report, self.PLAYER_KEY)
+        try:
+            while self.in_combat and report.turns < policy.max_turns:
+                action = policy.choose(self.character)
+                report.turns += 1
+                if action == "huir":
+                    self.end_combat(fled=True)
+                    report.outcome = "fled"
+                    break
+                if action == "defender":
+                    report.defends += 1
+                    self.defend()
+                else:
+                    report.attacks += 1
+                    self.attack()
+                if self.character.deaths != deaths:
+                    report.outcome = "defeat"
+                    break
+                if refresh_interval is not None and time.perf_counter() - last_flush >= refresh_interval:
+                    last_flush = time.perf_counter()
+                    self._held = None
+                    self.deliver(held.take_state())
+                    self._held = held
+            else:
+                if not self.in_combat:
+                    report.outcome = "victory" if self.character.kills != kills else "escaped"
+        finally:
+            self._held = None
+            self.narrate_combat = narrate_combat
+        report.elapsed_ms = (time.perf_counter() - started) * 1000
+        
+        self.narrate(f"\n⚡ Combate automático ({policy.name})", "combat")
+        for line in report.summary_lines():
+            self.narrate(f"   {line}", "system")
+        self.deliver(held.kept + held.take_state())
+        return report
+    
+    def narrate_combat_batch(self, batch: Optional[CombatBatch]):
+        """Narra un lote de eventos de combate cuando el agrupador lo entrega"""
+        if self.narrate_combat and batch and batch.events:
+            self.narrate(self.gm.summarize_combat(batch), "narration")
+    
+    # --- Acciones generales ---
+    
+    def roll_perception(self):
+        """Realiza una tirada de percepción"""
+        if not self.character:
+            return
+        
+        if self.character.in_combat:
+            self.narrate("¡No puedes hacer eso en combate!", "system")
+            return
+        
+        bonus = self.character.get_attribute_bonus('sabiduria')
+        roll, desc = self.dice_system.roll_d100_with_bonus(bonus)
+        
+        self.narrate(f"\nTirada de Percepción: {desc}", "dice")
+        
+        # Determinar resultado
+        if roll >= 90:
+            self.narrate("¡Éxito crítico! Percibes cada detalle del entorno.", "system")
+            self.narrate("Notas una anomalía en el espacio... parece un portal a otra zona.", "narration")
+        elif roll >= 70:
+            self.narrate("Éxito. Detectas movimiento en la distancia.", "system")
+            self.narrate("Parece que hay criaturas merodeando por aquí.", "narration")
+        elif roll >= 50:
+            self.narrate("Éxito parcial. Percibes lo básico del entorno.", "system")
+        else:
+            self.narrate("Fallo. No notas nada fuera de lo común.", "system")
+    
+    def rest(self):
+        """Permite al personaje descansar y recuperarse"""
+        if not self.character:
+            return
+        
+        if self.character.in_combat:
+            self.narrate("¡No puedes descansar en combate!", "system")
+            return
+        self.checkpoint("descansar")
+        if not self.advance_effects():
+            return
+        
+        self.narrate("\n🏕️ Te tomas un momento para descansar...", "system")
+        
+        # Recuperar HP y Maná
+        hp_recovered = int(self.character.hp_max * 0.3)
+        mana_recovered = int(self.character.mana_max * 0.5)
+        
+        self.character.heal(hp_recovered)
+        self.character.restore_mana(mana_recovered)
+        
+        self.narrate(f"Recuperas {hp_recovered} puntos de vida.", "system")
+        self.narrate(f"Recuperas {mana_recovered} puntos de maná.", "system")
+        
+        # Pequeña penalización de tiempo
+        if random.random() < 0.2:
+            self.narrate("\nMientras descansas, sientes que algo se acerca...", "narration")
+        
+        self.emit(EventType.CHARACTER_CHANGED)
+    
+    def train(self, hours: int) -> Optional[TrainingReport]:
+        """Entrenamiento acelerado: simula las horas y narra un único resumen"""
+        if not self.character:
+            return None
+        if self.in_combat:
+            self.narrate("¡No puedes entrenar en combate!", "system")
+            return None
+        self.checkpoint("entrenar")
+        
+        report = self.training_simulator.run(self.character, hours, self.encounter_table())
+        # Las horas pasan también para los efectos temporales
+        self.character.status_effects.fast_forward(report.hours * TrainingSimulator.ATTEMPTS_PER_HOUR)
+        
+        self.narrate(f"\n⏳ El tiempo se acelera... {report.hours} horas de entrenamiento", "system")
+        for line in report.summary_lines():
+            self.narrate(f"   {line}", "reward")
+        if self.narrate_combat:
+            summary = self.gm.summarize_training(report, self.character.name)
+        else:
+            summary = offline_training_summary(report, self.character.name)
+        self.narrate(summary, "narration")
+        
+        self.emit(EventType.CHARACTER_CHANGED)
+        return report
+    
+    # --- Mapa de zonas ---
+    
+    def travel(self, direction: str) -> Optional[Zone]:
+        """Viaja a la zona vecina en una dirección (norte, sur, este u oeste)"""
+        if self.in_combat:
+            self.narrate("¡No puedes alejarte en pleno combate! Escribe 'huir' para escapar.", "combat")
+            return None
+        if not self.advance_effects():
+            return None
+        self.checkpoint("viajar")
+        gm = self.gm
+        dx, dy = DIRECTIONS[direction]
+        x, y = gm.position()
+        zone = gm.world_map.visit(x + dx, y + dy)
+        gm.world_context["zone"] = [zone.x, zone.y]
+        gm.world_context["current_location"] = zone.title
+        explored = gm.world_context.setdefault("explored_locations", [])
+        if zone.title not in explored:
+            explored.append(zone.title)
+            gm.remember("lugar", f"Lugar explorado: {zone.title}")
+        
+        self.narrate(f"\n🧭 Viajas al {direction}: {zone.title} (peligro {zone.danger})", "system")
+        self.narrate(ZONE_BIOMES[zone.biome]["description"], "narration")
+        self.narrate(f"   Aquí acechan: {', '.join(zone.enemies)}"
+                     + (f"   (ya has vencido aquí {zone.kills} veces)" if zone.kills else ""), "system")
+        self.emit(EventType.LOCATION_CHANGED, data={"location": zone.title})
+        return zone
+    
+    def describe_map(self):
+        """Muestra las zonas visitadas alrededor del jugador"""
+        gm = self.gm
+        x, y = gm.position()
+        zone = gm.current_zone()
+        self.narrate(f"\n🗺️ {zone.title} ({x}, {y}) — peligro {zone.danger}", "system")
+        for row in gm.world_map.render(x, y):
+            self.narrate(f"   {row}", "system")
+        legend = "  ".join(f"{biome['symbol']} {biome['name']}" for biome in ZONE_BIOMES.values())
+        self.narrate(f"   @ tú  · sin explorar  {legend}", "system")
+    
+    # --- Puntos de mejora ---
+    
+    def allocate_points(self, allocation: Dict[str, int]) -> bool:
+        """Gasta puntos de mejora según un reparto {stat: mejoras}"""
+        if not self.character:
+            return False
+        if self.in_combat:
+            self.narrate("¡No puedes repartir puntos de mejora en combate!", "system")
+            return False
+        allocation = {stat: count for stat, count in allocation.items() if count}
+        if not allocation:
+            return False
+        self.checkpoint("mejorar")
+        character = self.character
+        if not character.spend_improvement_points(allocation):
+            self.narrate(f"Ese reparto no es válido o no tienes puntos suficientes "
+                         f"({character.improvement_points} disponibles).", "system")
+            return False
+        
+        gains = ProgressionTable.IMPROVEMENT_GAINS
+        spent = ", ".join(f"{stat} +{gains[stat] * count}" for stat, count in allocation.items())
+        self.narrate(f"✨ Mejoras: {spent}", "reward")
+        self.narrate(f"   ⚔️ Ataque: {character.get_attack_dice()}   🛡️ Defensa: {character.get_defense_dice()}   "
+                     f"❤️ HP: {character.hp_actual}/{character.hp_max}", "system")
+        if character.improvement_points:
+            self.narrate(f"   Te quedan {character.improvement_points} puntos de mejora", "system")
+        self.emit(EventType.CHARACTER_CHANGED)
+        return True
+    
+    def auto_allocate(self, objective: str = "victoria") -> Optional[AllocationPlan]:
+        """Reparte todos los puntos de mejora con la recomendación del solucionador"""
+        if not self.character or not self.character.improvement_points:
+            self.narrate("No tienes puntos de mejora sin asignar.", "system")
+            return None
+        if self.in_combat:
+            self.narrate("¡No puedes repartir puntos de mejora en combate!", "system")
+            return None
+        plan = self.allocation_solver.recommend(self.character, objective=objective,
+                                                encounter_table=self.encounter_table())
+        self.narrate(f"🧮 Reparto recomendado ({plan.objective}): {plan.describe()}", "system")
+        self.allocate_points(plan.allocation)
+        return plan
+    
+    # --- Línea temporal ---
+    
+    def checkpoint(self, label: str = ""):
+        """Instantánea del estado antes de una acción (para rebobinar)"""
+        # Un combate automático se rebobina entero: solo cuenta su instantánea inicial
+        if self.character and self._held is None:
+            self.timeline.capture(self, label)
+    
+    def rewind(self, turns: int = 1) -> bool:
+        """Devuelve la partida al estado de hace `turns` acciones"""
+        snapshot = self.timeline.pop(max(1, turns))
+        if snapshot is None:
+            self.narrate("No hay nada que rebobinar.", "system")
+            return False
+        
+        was_in_combat = self.in_combat
+        self.character = thaw(snapshot.character)
+        self.current_enemy = thaw(snapshot.enemy)
+        self.gm.world_context = thaw(snapshot.world)
+        self.gm.conversation_history = list(snapshot.history)
+        self.gm.memory.truncate(snapshot.memory_size)
+        self.gm.turn_count = snapshot.gm_turn
+        self.combat_narrator = None
+        
+        if was_in_combat and not self.in_combat:
+            self.emit(EventType.COMBAT_ENDED, data={"victory": False, "fled": False})
+        elif self.in_combat:
+            self.combat_narrator = CombatNarrationBatcher(self.character.name, self.current_enemy.type)
+            if not was_in_combat:
+                self.emit(EventType.COMBAT_STARTED, data={"enemy": self.current_enemy.type})
+        
+        self.emit(EventType.CHARACTER_CHANGED)
+        self.narrate("\n⏪ El tiempo retrocede en la Habitación...", "system")
+        if self.in_combat:
+            self.narrate(f"Vuelves a estar frente al {self.current_enemy.type} "
+                         f"({self.current_enemy.hp_current}/{self.current_enemy.hp_max} HP).", "combat")
+        return True
+    
+    def game_over(self):
+        """Maneja la muerte del personaje"""
+        self.narrate("\n💀 HAS MUERTO 💀", "combat")
+        self.narrate("Tu entrenamiento termina aquí... por ahora.", "system")
+        
+        self.character.deaths += 1
+        self.character.hp_actual = int(self.character.hp_max * 0.5)
+        self.character.status_effects = StatusEffectEngine()
+        if self.current_enemy:
+            self.log("combate", f"Derrota contra {self.current_enemy.type} (muerte {self.character.deaths})")
+        
+        self.narrate("\nLa Habitación del Tiempo te revive con la mitad de tu vitalidad.", "system")
+        self.narrate("Aprende de tus errores y hazte más fuerte.", "system")
+        
+        self.emit(EventType.GAME_OVER)
+        self.emit(EventType.CHARACTER_CHANGED)
+    
+    # --- Persistencia ---
+    
+    def to_save_data(self) -> dict:
+        """Estado serializable de la partida"""
+        return {
+            "character": self.character.to_dict(),
+            "gm_history": self.gm.conversation_history[-10:],
+            "gm_memories": self.gm.memory.to_list(),
+            "world_context": self.gm.world_context,
+            "world_map": self.gm.world_map.to_dict(),
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    def load_save_data(self, save_data: dict):
+        """Restaura una partida guardada con to_save_data()"""
+        was_in_combat = self.current_enemy is not None
+        self.current_enemy = None
+        if was_in_combat:
+            self.emit(EventType.COMBAT_ENDED, data={"victory": False, "fled": False})
+        self.character = Character.from_dict(save_data["character"])
+        self.timeline = Timeline()
+        self.combat_narrator = None
+        
+        # Restaurar contexto del GM
+        self.gm.conversation_history = save_data.get("gm_history", [])
+        self.gm.world_context = save_data.get("world_context", {})
+        self.gm.world_map = WorldMap.from_dict(save_data.get("world_map"))
+        self.gm.memory = MemoryIndex.from_list(save_data.get("gm_memories", []))
+        self.gm.turn_count = max((memory.turn for memory in self.gm.memory.memories), default=0)
+        
+        self.emit(EventType.CHARACTER_CHANGED)
+        self.narrate(f"\n💾 Partida cargada: {self.character.name} - Nivel {self.character.level}", "system")
+    
+    def save_game(self, filename: Optional[str] = None) -> str:
+        """Escribe la partida en un archivo JSON y devuelve su nombre"""
+        filename = filename or f"save_{self.character.name.lower().replace(' ', '_')}.json"
+        with open(filename, "w", encoding='utf-8') as f:
+            json.dump(self.to_save_data(), f, indent=2, ensure_ascii=False)
+        self.narrate(f"\n💾 Juego guardado como: {filename}", "system")
+        return filename
+    
+    def load_game(self, filename: str):
+        """Carga una partida escrita con save_game()"""
+        with open(filename, "r", encoding='utf-8') as f:
+            self.load_save_data(json.load(f))
+
+# ============= SERVIDOR MULTIJUGADOR =============
+
+class SharedLLMScheduler:
+    """
+    Cliente LLM asíncrono compartido por todas las sesiones del servidor.
+    Limita peticiones por segundo (cubeta de tokens) y concurrencia, reparte
+    el turno entre sesiones en round-robin y aplica contrapresión por sesión:
+    cada sesión tiene un máximo de peticiones pendientes y las demás esperan.
+    """
+    
+    def __init__(self, requests_per_second: float = 10.0, burst: int = 10,
+                 max_concurrency: int = 16, max_pending_per_session: int = 1,
+                 timeout: float = NARRATION_TIMEOUT, client=None):
+        self.client = client or openai.AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            base_url=OPENAI_BASE_URL,
+            timeout=timeout,
+            max_retries=2,
+            http_client=httpx.AsyncClient(limits=httpx.Limits(max_connections=max_concurrency,
+                                                              max_keepalive_connections=max_concurrency))
+        )
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_pending_per_session = max_pending_per_session
+        self.timeout = timeout
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "expired": 0}
+        self._queues = {}
+        self._pending_slots = {}
+        self._ready = deque()
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._wakeup = None
+        self._concurrency = None
+        self._task = None
+    
+    def start(self):
+        """Arranca el despachador (debe llamarse dentro del bucle de eventos)"""
+        self._wakeup = asyncio.Event()
+        self._concurrency = asyncio.Semaphore(self.max_concurrency)
+        self._task = asyncio.create_task(self._dispatch())
+    
+    async def stop(self):
+        """Detiene el despachador y cierra el cliente"""
+        if self._task:
+            self._task.cancel()
+        await self.client.close()
+    
+    def register(self, session_id: str):
+        """Da de alta una sesión"""
+        self._queues[session_id] = deque()
+        self._pending_slots[session_id] = asyncio.Semaphore(self.max_pending_per_session)
+    
+    def unregister(self, session_id: str):
+        """Da de baja una sesión y cancela sus peticiones pendientes"""
+        for future, _ in self._queues.pop(session_id, ()):
+            if not future.done():
+                future.cancel()
+        self._pending_slots.pop(session_id, None)
+    
+    async def submit(self, session_id: str, **kwargs):
+        """Encola una petición de la sesión y espera su respuesta"""
+        async with self._pending_slots[session_id]:
+            future = asyncio.get_running_loop().create_future()
+            queue = self._queues[session_id]
+            if not queue:
+                self._ready.append(session_id)
+            queue.append((future, kwargs))
+            self.stats["submitted"] += 1
+            self._wakeup.set()
+            try:
+                return await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                self.stats["expired"] += 1
+                raise NarrationUnavailable("plazo agotado en la cola compartida")
+    
+    def for_session(self, session_id: str):
+        """Corrutina create(**kwargs) ligada a una sesión, para generate_turn_async"""
+        async def create(**kwargs):
+            return await self.submit(session_id, **kwargs)
+        return create
+    
+    async def _take_rate_token(self):
+        """Espera a que la cubeta de tokens permita otra petición"""
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.requests_per_second)
+            self._last_refill = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.requests_per_second)
+    
+    def _next_request(self):
+        """Siguiente petición viva en orden round-robin entre sesiones"""
+        while self._ready:
+            session_id = self._ready.popleft()
+            queue = self._queues.get(session_id)
+            if not queue:
+                continue
+            future, kwargs = queue.popleft()
+            if queue:
+                self._ready.append(session_id)
+            if not future.done():
+                return future, kwargs
+        return None
+    
+    async def _dispatch(self):
+        """Bucle que reparte las peticiones respetando límites y turnos"""
+        while True:
+            if not self._ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self._concurrency.acquire()
+            await self._take_rate_token()
+            item = self._next_request()
+            if item is None:
+                self._concurrency.release()
+                continue
+            asyncio.create_task(self._execute(*item))
+    
+    async def _execute(self, future, kwargs):
+        """Ejecuta una petición y resuelve su futuro"""
+        try:
+            response = await self.client.chat.completions.create(**kwargs)
+            self.stats["completed"] += 1
+            if not future.done():
+                future.set_result(response)
+        except Exception as e:
+            self.stats["failed"] += 1
+            if not future.done():
+                future.set_exception(NarrationUnavailable(str(e)))
+        finally:
+            self._concurrency.release()
+
+class GameServer:
+    """
+    Servidor TCP de texto por líneas: cada conexión juega su propia GameSession
+    y todas comparten el mismo SharedLLMScheduler
+    """
+    
+    PROMPT = ">>> "
+    CPU_WORKERS = 4
+    
+    def __init__(self, host: str = "127.0.0.1", port: int = 7777,
+                 scheduler: Optional[SharedLLMScheduler] = None, offline: bool = False,
+                 backlog: int = 4096, telemetry: Optional[CombatTelemetry] = None):
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.offline = offline
+        self.telemetry = telemetry
+        self.scheduler = scheduler if scheduler or offline else SharedLLMScheduler()
+        self.sessions = {}
+        self.server = None
+        self._next_id = 0
+        # Entrenar o repartir puntos ocupa la CPU cientos de ms: fuera del bucle, que atiende a los demás
+        self.executor = ThreadPoolExecutor(max_workers=self.CPU_WORKERS, thread_name_prefix="servidor")
+    
+    async def start(self):
+        """Abre el puerto y arranca el planificador compartido"""
+        if self.scheduler:
+            self.scheduler.start()
+        # Cola de conexiones amplia: las ráfagas de miles de clientes desbordan la de 100 por defecto
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port,
+                                                 backlog=self.backlog)
+        self.port = self.server.sockets[0].getsockname()[1]
+    
+    async def serve_forever(self):
+        """Atiende conexiones hasta que se cancele"""
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+    
+    async def stop(self):
+        """Cierra el puerto y el planificador"""
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.scheduler:
+            await self.scheduler.stop()
+        self.executor.shutdown(wait=False)
+    
+    async def ask(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                  question: str) -> Optional[str]:
+        """Escribe una pregunta con el prompt y lee la respuesta (None si se desconecta)"""
+        writer.write((f"{question}\n" if question else "").encode("utf-8") + self.PROMPT.encode("utf-8"))
+        await writer.drain()
+        line = await reader.readline()
+        if not line:
+            return None
+        return line.decode("utf-8", errors="replace").strip()
+    
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Partida completa de un jugador conectado"""
+        self._next_id += 1
+        session_id = f"sesion-{self._next_id}"
+        gm = AIGameMaster(offline=self.offline, client=self.scheduler)
+        session = GameSession(gm, CombatSystem(self.telemetry), narrate_combat=False)
+        self.sessions[session_id] = session
+        if self.scheduler:
+            self.scheduler.register(session_id)
+        create = self.scheduler.for_session(session_id) if self.scheduler else None
+        loop = asyncio.get_running_loop()
+        loop_thread = threading.get_ident()
+        
+        def send(text: str):
+            # Desde el ejecutor la escritura pasa por el bucle: el transporte no admite otros hilos
+            if threading.get_ident() == loop_thread:
+                writer.write(text.encode("utf-8"))
+            else:
+                loop.call_soon_threadsafe(writer.write, text.encode("utf-8"))
+        
+        def on_event(event: GameEvent):
+            if event.type in (EventType.NARRATION, EventType.WARNING):
+                send(event.text + "\n")
+            elif event.type == EventType.SAVE_REQUESTED:
+                send("(El guardado no está disponible en el servidor)\n")
+        
+        session.subscribe(on_event)
+        
+        try:
+            session.welcome()
+            name = await self.ask(reader, writer, "Nombre de tu personaje:")
+            if name is None:
+                return
+            race = await self.ask(reader, writer, f"Raza ({', '.join(Character.RACES)}):")
+            if race is None:
+                return
+            char_class = await self.ask(reader, writer, f"Clase ({', '.join(Character.CLASSES)}):")
+            if char_class is None:
+                return
+            
+            character = session.create_character(
+                name or "Aventurero",
+                race if race in Character.RACES else "Humano",
+                char_class if char_class in Character.CLASSES else "Guerrero",
+                initial_scene=False
+            )
+            turn = await gm.generate_turn_async(gm.initial_scene_prompt(character), character, create)
+            session.narrate(turn.narration, "narration")
+            
+            while True:
+                line = await self.ask(reader, writer, "")
+                if line is None or line.lower() in ("salir", "quit", "exit"):
+                    break
+                
+                if session.is_cpu_bound(line):
+                    action = await loop.run_in_executor(self.executor, session.begin_input, line)
+                else:
+                    action = session.begin_input(line)
+                if action:
+                    session.apply_turn(await gm.generate_turn_async(action, session.character, create))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.sessions.pop(session_id, None)
+            if self.scheduler:
+                self.scheduler.unregister(session_id)
+            writer.close()
+
+# ============= MOTOR EN PROCESO SEPARADO =============
+
+class EngineMessage:
+    """Mensajes del motor a la interfaz (tuplas cortas por la tubería)"""
+    READY = "r"   # (READY,) el motor arrancó
+    FATAL = "f"   # (FATAL, texto) el motor no pudo arrancar
+    EVENT = "e"   # (EVENT, tipo, texto, tag, data) un GameEvent
+    SYNC = "s"    # (SYNC, personaje.to_dict() | None, (id, tipo) | None, ubicación) estado frío
+    DONE = "d"    # (DONE,) terminó un comando
+
+class SharedGameState:
+    """
+    Estado numérico caliente (HP, maná, stats...) en memoria compartida.
+    Lo escribe solo el motor; la interfaz lo lee sin bloquear con un
+    contador de secuencia (impar mientras se escribe) y reintenta si cambió.
+    """
+    
+    CHARACTER_FIELDS = ("hp_actual", "hp_max", "mana_actual", "mana_max", "level", "experience",
+                        "exp_to_next", "gold", "kills", "deaths", "improvement_points")
+    STAT_FIELDS = tuple(CharacterStats.__dataclass_fields__)
+    # Claves de Character.to_dict() que viajan por aquí y no fuerzan una sincronización completa
+    HOT_KEYS = frozenset(CHARACTER_FIELDS) | {"stats"}
+    HEADER = struct.Struct("<Q")
+    # Hay personaje, en combate, HP del enemigo, HP máximo del enemigo y los campos anteriores
+    LAYOUT = struct.Struct(f"<{4 + len(CHARACTER_FIELDS) + len(STAT_FIELDS)}q")
+    
+    def __init__(self, name: Optional[str] = None):
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.HEADER.size + self.LAYOUT.size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.seq = 0
+        self.last_values = None
+    
+    def write(self, character: Optional[Character], enemy: Optional[Enemy]):
+        """Publica el estado actual (no hace nada si no cambió)"""
+        in_combat = enemy is not None and enemy.is_alive
+        values = [character is not None, in_combat,
+                  enemy.hp_current if enemy else 0, enemy.hp_max if enemy else 0]
+        if character:
+            values += [int(getattr(character, name)) for name in self.CHARACTER_FIELDS]
+            values += [int(getattr(character.stats, name)) for name in self.STAT_FIELDS]
+        else:
+            values += [0] * (len(self.CHARACTER_FIELDS) + len(self.STAT_FIELDS))
+        if values == self.last_values:
+            return
+        self.last_values = values
+        buf = self.shm.buf
+        self.HEADER.pack_into(buf, 0, self.seq + 1)
+        self.LAYOUT.pack_into(buf, self.HEADER.size, *values)
+        self.seq += 2
+        self.HEADER.pack_into(buf, 0, self.seq)
+    
+    def read(self) -> Tuple[int, tuple]:
+        """Devuelve (secuencia, valores) de una copia coherente"""
+        buf = self.shm.buf
+        while True:
+            seq = self.HEADER.unpack_from(buf, 0)[0]
+            if seq & 1:
+                continue
+            values = self.LAYOUT.unpack_from(buf, self.HEADER.size)
+            if self.HEADER.unpack_from(buf, 0)[0] == seq:
+                return seq, values
+    
+    def apply(self, values: tuple, character: Optional[Character], enemy: Optional[Enemy]):
+        """Vuelca los valores leídos sobre las copias locales de personaje y enemigo"""
+        offset = 4
+        if character:
+            for name, value in zip(self.CHARACTER_FIELDS, values[offset:]):
+                setattr(character, name, value)
+            offset += len(self.CHARACTER_FIELDS)
+            for name, value in zip(self.STAT_FIELDS, values[offset:]):
+                setattr(character.stats, name, value)
+        if enemy:
+            enemy.is_alive = bool(values[1])
+            enemy.hp_current, enemy.hp_max = values[2], values[3]
+    
+    def close(self):
+        """Suelta el bloque (y lo borra si este proceso lo creó)"""
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+class EngineHost:
+    """Lado del motor: ejecuta los comandos de la interfaz sobre una GameSession propia"""
+    
+    # Eventos tras los que puede haber cambiado el estado frío (equipo, mochila, efectos, enemigo)
+    SYNC_EVENTS = (EventType.CHARACTER_CHANGED, EventType.COMBAT_STARTED, EventType.COMBAT_ENDED,
+                   EventType.LOCATION_CHANGED, EventType.GAME_OVER)
+    
+    def __init__(self, conn, state: SharedGameState, session: GameSession):
+        self.conn = conn
+        self.state = state
+        self.session = session
+        self.last_sync = None
+        self.commands = {
+            "welcome": session.welcome,
+            "create": session.create_character,
+            "input": session.process_input,
+            "attack": session.attack,
+            "defend": session.defend,
+            "rest": session.rest,
+            "perception": session.roll_perception,
+            "auto": session.auto_battle,
+            "train": session.train,
+            "save": session.save_game,
+            "load": session.load_game,
+            "allocate": session.allocate_points,
+        }
+        session.subscribe(self.forward)
+    
+    def sync(self):
+        """Envía el estado frío si cambió desde el último envío"""
+        session = self.session
+        character = session.character.to_dict() if session.character else None
+        cold = {key: value for key, value in character.items()
+                if key not in SharedGameState.HOT_KEYS} if character else None
+        enemy = (session.current_enemy.id, session.current_enemy.type) if session.current_enemy else None
+        location = session.gm.world_context.get("current_location")
+        encounters = session.encounter_table()
+        key = (cold, enemy, location, encounters)
+        if key != self.last_sync:
+            self.last_sync = key
+            self.conn.send((EngineMessage.SYNC, character, enemy, location, encounters))
+    
+    def forward(self, event: GameEvent):
+        """Reenvía un evento con el estado ya publicado"""
+        if event.type in self.SYNC_EVENTS:
+            self.sync()
+        self.state.write(self.session.character, self.session.current_enemy)
+        self.conn.send((EngineMessage.EVENT, event.type, event.text, event.tag, event.data))
+    
+    def serve(self):
+        """Atiende comandos (nombre, argumentos) hasta recibir "stop" o perder la tubería"""
+        while True:
+            try:
+                command, args = self.conn.recv()
+            except EOFError:
+                return
+            if command == "stop":
+                return
+            try:
+                self.commands[command](*args)
+            except Exception as e:
+                self.session.emit(EventType.WARNING, f"Error en el motor ({command}): {e}")
+            self.sync()
+            self.state.write(self.session.character, self.session.current_enemy)
+            self.conn.send((EngineMessage.DONE,))
+
+def run_engine(conn, shm_name: str, offline: bool = False):
+    """Punto de entrada del proceso del motor"""
+    try:
+        state = SharedGameState(shm_name)
+        journal = SessionJournal()
+        telemetry = CombatTelemetry() if TELEMETRY_DIR else None
+        session = GameSession(AIGameMaster(offline=offline), CombatSystem(telemetry), journal=journal)
+    except Exception as e:
+        conn.send((EngineMessage.FATAL, str(e)))
+        return
+    
+    conn.send((EngineMessage.READY,))
+    try:
+        EngineHost(conn, state, session).serve()
+    finally:
+        journal.close()
+        if telemetry:
+            telemetry.close()
+        state.close()
+        conn.close()
+
+@dataclass
+class RemoteGameMaster:
+    """Lo que la interfaz consulta del GM cuando este vive en el proceso del motor"""
+    world_context: dict = field(default_factory=dict)
+
+class EngineProxy:
+    """
+    Sustituto de GameSession para la interfaz con el motor en otro proceso.
+    Los comandos salen por una tubería sin esperar respuesta; los eventos
+    vuelven por la misma y se reparten en poll(), llamado desde el bucle de Tk.
+    HP, maná y stats se leen de la memoria compartida en cada acceso.
+    """
+    
+    START_TIMEOUT = 60.0
+    POLL_BUDGET = 0.008  # segundos por llamada a poll(): el resto queda para el siguiente
+    
+    def __init__(self, offline: bool = False):
+        self.state = SharedGameState()
+        context = multiprocessing.get_context("spawn")  # fork con Tk ya abierto no es seguro
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=run_engine, args=(child_conn, self.state.name, offline),
+                                       name="motor-habitacion", daemon=True)
+        self.process.start()
+        child_conn.close()
+        
+        self.gm = RemoteGameMaster()
+        self.pending = 0
+        self._character = None
+        self._enemy = None
+        self._encounter_table = None
+        self._seq = None
+        self._values = None
+        self._subscribers = []
+        
+        message = self.conn.recv() if self.conn.poll(self.START_TIMEOUT) else (EngineMessage.FATAL,
+                                                                              "el motor no respondió")
+        if message[0] != EngineMessage.READY:
+            self.close()
+            raise RuntimeError(f"No se pudo iniciar el motor: {message[1]}")
+    
+    # --- Eventos ---
+    
+    def subscribe(self, callback):
+        """Registra una función que recibirá cada GameEvent"""
+        self._subscribers.append(callback)
+    
+    def unsubscribe(self, callback):
+        """Deja de enviar eventos a una función"""
+        self._subscribers.remove(callback)
+    
+    def poll(self, budget: float = POLL_BUDGET) -> int:
+        """Procesa los mensajes del motor disponibles durante `budget` segundos"""
+        deadline = time.perf_counter() + budget
+        handled = 0
+        try:
+            while self.conn.poll():
+                self.handle(self.conn.recv())
+                handled += 1
+                if time.perf_counter() > deadline:
+                    break
+        except (EOFError, OSError):
+            if self.process.is_alive() or self.pending:
+                self.pending = 0
+                self.dispatch(GameEvent(EventType.WARNING, "El motor de juego se detuvo"))
+        return handled
+    
+    def handle(self, message: tuple):
+        """Aplica un mensaje del motor"""
+        kind = message[0]
+        if kind == EngineMessage.EVENT:
+            self.dispatch(GameEvent(*message[1:]))
+        elif kind == EngineMessage.SYNC:
+            character, enemy, location, self._encounter_table = message[1:]
+            self._character = Character.from_dict(character) if character else None
+            if enemy is None:
+                self._enemy = None
+            elif self._enemy is None or self._enemy.id != enemy[0]:
+                self._enemy = Enemy(enemy[1])
+                self._enemy.id = enemy[0]
+            self.gm.world_context["current_location"] = location
+            self._seq = None
+        elif kind == EngineMessage.DONE:
+            self.pending -= 1
+    
+    def dispatch(self, event: GameEvent):
+        for callback in self._subscribers:
+            callback(event)
+    
+    def send(self, command: str, *args):
+        """Encola un comando en el motor"""
+        self.pending += 1
+        self.conn.send((command, args))
+    
+    # --- Estado espejado ---
+    
+    def refresh(self) -> tuple:
+        """Lee la memoria compartida y la vuelca sobre las copias locales si cambió"""
+        seq, values = self.state.read()
+        if seq != self._seq:
+            self._seq, self._values = seq, values
+            self.state.apply(values, self._character, self._enemy)
+        return self._values
+    
+    @property
+    def character(self) -> Optional[Character]:
+        self.refresh()
+        return self._character
+    
+    @property
+    def current_enemy(self) -> Optional[Enemy]:
+        self.refresh()
+        return self._enemy
+    
+    @property
+    def in_combat(self) -> bool:
+        return self._enemy is not None and bool(self.refresh()[1])
+    
+    def encounter_table(self) -> Optional[tuple]:
+        """Tabla de la zona actual según el último estado frío recibido"""
+        return self._encounter_table
+    
+    def enemy_key(self) -> str:
+        return f"enemigo-{self._enemy.id}"
+    
+    # --- Comandos (misma firma que GameSession) ---
+    
+    def welcome(self):
+        self.send("welcome")
+    
+    def create_character(self, name: str, race: str, char_class: str,
+                         attributes: Optional[Dict[str, int]] = None, initial_scene: bool = True):
+        self.send("create", name, race, char_class, attributes, initial_scene)
+    
+    def process_input(self, user_input: str):
+        self.send("input", user_input)
+    
+    def attack(self):
+        self.send("attack")
+    
+    def defend(self):
+        self.send("defend")
+    
+    def rest(self):
+        self.send("rest")
+    
+    def roll_perception(self):
+        self.send("perception")
+    
+    def auto_battle(self, policy: Optional[AutoBattlePolicy] = None):
+        self.send("auto", policy)
+    
+    def train(self, hours: int):
+        self.send("train", hours)
+    
+    def allocate_points(self, allocation: Dict[str, int]):
+        self.send("allocate", allocation)
+    
+    def save_game(self, filename: Optional[str] = None):
+        self.send("save", filename)
+    
+    def load_game(self, filename: str):
+        self.send("load", filename)
+    
+    def close(self, timeout: float = 5.0):
+        """Detiene el motor y libera la memoria compartida"""
+        try:
+            self.conn.send(("stop", ()))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout)
+        self.conn.close()
+        self.state.close()
+
+# ============= ILUSTRACIONES =============
+
+class PlaceholderImageBackend:
+    """Renderizador local determinista: degradado y silueta derivados del prompt"""
+    
+    name = "placeholder"
+    extension = "ppm"
+    
+    def __init__(self, size: int = 256):
+        self.size = size
+    
+    def generate(self, prompt: str) -> bytes:
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        top, bottom, figure = digest[0:3], digest[3:6], digest[6:9]
+        n = self.size
+        cx, cy = n // 2, n // 2 + n // 10
+        radius = n // 4 + digest[9] % (n // 8)
+        
+        rows = []
+        for y in range(n):
+            t = y / (n - 1)
+            row = bytearray(bytes(int(a + (b - a) * t) for a, b in zip(top, bottom)) * n)
+            dy = y - cy
+            if abs(dy) < radius:
+                half = int((radius * radius - dy * dy) ** 0.5)
+                x0, x1 = max(0, cx - half), min(n, cx + half)
+                row[x0 * 3:x1 * 3] = figure * (x1 - x0)
+            rows.append(bytes(row))
+        return f"P6 {n} {n} 255\n".encode("ascii") + b"".join(rows)
+
+class OpenAIImageBackend:
+    """Generación de imágenes con la API de OpenAI (respuesta en base64)"""
+    
+    name = "openai"
+    extension = "png"
+    
+    def __init__(self, model: str = "dall-e-3", size: str = "1024x1024", client=None):
+        if client is None:
+            if not OPENAI_API_KEY:
+                raise ValueError("Por favor configura OPENAI_API_KEY en tu archivo .env")
+            client = openai.OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL,
+                                   http_client=get_connection_pool().http_client)
+        self.client = client
+        self.model = model
+        self.size = size
+    
+    def generate(self, prompt: str) -> bytes:
+        response = self.client.images.generate(model=self.model, prompt=prompt, size=self.size,
+                                               n=1, response_format="b64_json")
+        return base64.b64decode(response.data[0].b64_json)
+
+def create_image_backend():
+    """Backend según IMAGE_BACKEND; sin clave de API se usa el renderizador local"""
+    if IMAGE_BACKEND == "openai" and OPENAI_API_KEY:
+        return OpenAIImageBackend()
+    return PlaceholderImageBackend()
+
+class ImageDiskCache:
+    """Caché en disco direccionada por contenido: la clave es el hash del prompt"""
+    
+    def __init__(self, directory: str = IMAGE_CACHE_DIR):
+        self.directory = directory
+    
+    @staticmethod
+    def key_for(backend_name: str, prompt: str) -> str:
+        return hashlib.sha256(f"{backend_name}\n{prompt}".encode("utf-8")).hexdigest()
+    
+    def path_for(self, key: str, extension: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.{extension}")
+    
+    def get(self, key: str, extension: str) -> Optional[bytes]:
+        try:
+            with open(self.path_for(key, extension), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+    
+    def put(self, key: str, extension: str, data: bytes):
+        """Escritura atómica: nunca se lee una imagen a medio escribir"""
+        path = self.path_for(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+# Cabecera P6: ancho, alto y maxval separados por blancos o comentarios y un
+# único blanco antes de los píxeles, que pueden empezar por bytes "blancos"
+PPM_HEADER = re.compile(rb"P6(?:\s|#[^\n]*\n)+(\d+)(?:\s|#[^\n]*\n)+(\d+)(?:\s|#[^\n]*\n)+(\d+)\s")
+
+def resize_ppm(data: bytes, size: Tuple[int, int]) -> bytes:
+    """Reescalado por vecino más cercano de un PPM binario (P6), conservando proporción"""
+    header = PPM_HEADER.match(data)
+    if header is None:
+        raise ValueError("cabecera PPM no válida")
+    width, height = int(header.group(1)), int(header.group(2))
+    pixels = data[header.end():]
+    scale = min(size[0] / width, size[1] / height)
+    new_width, new_height = max(1, int(width * scale)), max(1, int(height * scale))
+    
+    columns = [int(x / scale) * 3 for x in range(new_width)]
+    rows = []
+    for y in range(new_height):
+        start = int(y / scale) * width * 3
+        source = pixels[start:start + width * 3]
+        rows.append(b"".join(source[x:x + 3] for x in columns))
+    return f"P6 {new_width} {new_height} 255\n".encode("ascii") + b"".join(rows)
+
+def decode_and_resize(data: bytes, size: Tuple[int, int]) -> bytes:
+    """Decodifica y reescala en un hilo de trabajo; devuelve datos listos para PhotoImage"""
+    if PIL_AVAILABLE:
+        with Image.open(io.BytesIO(data)) as image:
+            image = image.convert("RGB")
+            image.thumbnail(size)
+            buffer = io.BytesIO()
+            image.save(buffer, "PPM")
+            return buffer.getvalue()
+    if data.startswith(b"P6"):
+        return resize_ppm(data, size)
+    # PNG sin Pillow: Tk lo decodifica en el hilo principal y se submuestrea allí
+    return data
+
+class PhotoImageLRU:
+    """Caché en memoria acotada de PhotoImage ya decodificadas"""
+    
+    def __init__(self, capacity: int = 32):
+        self.capacity = capacity
+        self.images = OrderedDict()
+    
+    def get(self, key: str):
+        image = self.images.get(key)
+        if image is not None:
+            self.images.move_to_end(key)
+        return image
+    
+    def put(self, key: str, image):
+        self.images[key] = image
+        self.images.move_to_end(key)
+        while len(self.images) > self.capacity:
+            self.images.popitem(last=False)
+
+def enemy_portrait_prompt(enemy_type: str) -> str:
+    description = Enemy.ENEMY_TYPES[enemy_type]["description"]
+    return (f"Retrato de fantasía oscura de un {enemy_type}: {description}. "
+            "Ilustración digital, iluminación dramática, fondo neutro, sin texto.")
+
+def character_portrait_prompt(character: Character) -> str:
+    # Sin el nombre: personajes de la misma raza y clase comparten retrato en caché
+    return (f"Retrato de fantasía de un aventurero {character.race} de clase {character.char_class}, "
+            "entrenando en una dimensión mística atemporal. Ilustración digital, sin texto.")
+
+def scene_prompt(location: str) -> str:
+    return (f"Paisaje de fantasía dentro de la Habitación del Tiempo: {location}. "
+            "Atmósfera mística, ilustración digital panorámica, sin texto ni personajes.")
+
+class IllustrationPipeline:
+    """
+    Genera ilustraciones sin bloquear la interfaz: caché en memoria → caché en
+    disco → backend. Generación, decodificación y reescalado ocurren en hilos de
+    trabajo; el hilo de Tk solo crea la PhotoImage con datos ya preparados.
+    """
+    
+    POLL_MS = 50
+    
+    def __init__(self, root, backend=None, cache: ImageDiskCache = None,
+                 max_workers: int = 2, memory_items: int = 32):
+        self.root = root
+        self.backend = backend or create_image_backend()
+        self.cache = cache or ImageDiskCache()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ilustraciones")
+        self.memory = PhotoImageLRU(memory_items)
+        self.pending = {}            # clave -> callbacks en espera (solo hilo de Tk)
+        self.ready = queue.Queue()   # resultados de los hilos de trabajo
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "generated": 0, "errors": 0}
+        self.root.after(self.POLL_MS, self._poll)
+    
+    def request(self, prompt: str, size: Tuple[int, int], callback=None):
+        """Pide una ilustración; callback(photo) se llama en el hilo de Tk"""
+        key = f"{ImageDiskCache.key_for(self.backend.name, prompt)}@{size[0]}x{size[1]}"
+        image = self.memory.get(key)
+        if image is not None:
+            self.stats["memory_hits"] += 1
+            if callback:
+                callback(image)
+            return
+        
+        # Peticiones repetidas de la misma imagen comparten una sola generación
+        if key in self.pending:
+            self.pending[key].append(callback)
+            return
+        self.pending[key] = [callback]
+        self.executor.submit(self._load, key, prompt, size)
+    
+    def _load(self, key: str, prompt: str, size: Tuple[int, int]):
+        try:
+            content_key = ImageDiskCache.key_for(self.backend.name, prompt)
+            data = self.cache.get(content_key, self.backend.extension)
+            source = "disk_hits"
+            if data is None:
+                data = self.backend.generate(prompt)
+                self.cache.put(content_key, self.backend.extension, data)
+                source = "generated"
+            self.ready.put((key, decode_and_resize(data, size), size, source))
+        except Exception:
+            self.ready.put((key, None, size, "errors"))
+    
+    def _poll(self):
+        try:
+            while True:
+                try:
+                    key, data, size, source = self.ready.get_nowait()
+                except queue.Empty:
+                    break
+                callbacks = self.pending.pop(key, [])
+                image = self._photo(data, size) if data is not None else None
+                if image is None:
+                    # Un archivo de caché corrupto o una respuesta rota no detiene la entrega
+                    self.stats["errors"] += 1
+                    continue
+                self.stats[source] += 1
+                self.memory.put(key, image)
+                for callback in callbacks:
+                    if callback:
+                        callback(image)
+        finally:
+            self.root.after(self.POLL_MS, self._poll)
+    
+    @staticmethod
+    def _photo(data: bytes, size: Tuple[int, int]) -> Optional["tk.PhotoImage"]:
+        """PhotoImage ya reducida a `size`, o None si Tk no puede decodificar los datos"""
+        try:
+            image = tk.PhotoImage(data=data)
+            factor = max(1, -(-image.width() // size[0]), -(-image.height() // size[1]))
+            return image.subsample(factor) if factor > 1 else image
+        except tk.TclError:
+            return None
+    
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# ============= VISTA DE COMBATE ANIMADA =============
+
+class HealthBar:
+    """Barra de vida en un Canvas: sus items se crean una vez y luego solo se mueven"""
+    
+    HEIGHT = 14
+    
+    def __init__(self, canvas, label: str, color: str):
+        self.canvas = canvas
+        self.label = label
+        self.back = canvas.create_rectangle(0, 0, 0, 0, fill='#3a3a3a', outline='#4a4a4a')
+        self.fill = canvas.create_rectangle(0, 0, 0, 0, fill=color, outline='')
+        self.text = canvas.create_text(0, 0, anchor=tk.SW, fill='white', font=('Arial', 9, 'bold'))
+        self.x = self.y = self.width = 0
+        self.shown = None      # fracción dibujada
+        self.shown_text = None
+        self.fraction = 1.0    # fracción objetivo
+        self.hp = self.hp_max = 0
+    
+    def place(self, x: int, y: int, width: int):
+        self.x, self.y, self.width = x, y, width
+        self.canvas.coords(self.back, x, y, x + width, y + self.HEIGHT)
+        self.canvas.coords(self.text, x, y - 2)
+        self.shown = None
+    
+    def set(self, hp: int, hp_max: int):
+        self.hp, self.hp_max = hp, hp_max
+        self.fraction = max(0.0, min(1.0, hp / hp_max)) if hp_max else 0.0
+    
+    def draw(self, fraction: float):
+        """Mueve el relleno y reescribe el texto solo si cambian (región sucia mínima)"""
+        if fraction != self.shown:
+            self.shown = fraction
+            self.canvas.coords(self.fill, self.x, self.y, self.x + self.width * fraction, self.y + self.HEIGHT)
+        text = f"{self.label}  {self.hp}/{self.hp_max}"
+        if text != self.shown_text:
+            self.shown_text = text
+            self.canvas.itemconfig(self.text, text=text)
+    
+    def delete(self):
+        self.canvas.delete(self.back, self.fill, self.text)
+
+class TextPool:
+    """Textos flotantes reutilizables: se ocultan en lugar de borrarse"""
+    
+    def __init__(self, canvas, font):
+        self.canvas = canvas
+        self.font = font
+        self.free = []
+    
+    def acquire(self, x: float, y: float, text: str, color: str) -> int:
+        if self.free:
+            item = self.free.pop()
+            self.canvas.coords(item, x, y)
+            self.canvas.itemconfig(item, text=text, fill=color, state=tk.NORMAL)
+        else:
+            item = self.canvas.create_text(x, y, text=text, fill=color, font=self.font)
+        return item
+    
+    def release(self, item: int):
+        self.canvas.itemconfig(item, state=tk.HIDDEN)
+        self.free.append(item)
+
+class CanvasAnimation:
+    """Animación con duración fija; finish() la lleva a su estado final"""
+    
+    def __init__(self, duration: float, start: float):
+        self.duration = duration
+        self.start = start
+    
+    def step(self, now: float) -> bool:
+        """Dibuja el fotograma de `now`; devuelve False al terminar"""
+        t = (now - self.start) / self.duration
+        if t < 0:
+            return True
+        if t >= 1:
+            self.finish()
+            return False
+        self.draw(t)
+        return True
+    
+    def draw(self, t: float):
+        pass
+    
+    def finish(self):
+        pass
 
-CONTEXTO DEL MUNDO:
-- La Habitación del Tiempo es una dimensión especial donde el tiempo fluye diferente
-- Contiene diversas zonas: desiertos infinitos, montañas flotantes, bosques oscuros, etc.
-- Los enemigos aparecen como manifestaciones de energía para entrenar
-- El objetivo es volverse más fuerte enfrentando desafíos cada vez mayores
+class FloatingNumber(CanvasAnimation):
+    """Número de daño que sube y se desvanece"""
+    
+    FADED = '#777777'
+    RISE = 30
+    
+    def __init__(self, pool: TextPool, x: float, y: float, text: str, color: str,
+                 duration: float, start: float):
+        super().__init__(duration, start)
+        self.pool = pool
+        self.x, self.y = x, y
+        self.color = color
+        self.item = None
+        self.text = text
+        self.faded = False
+    
+    def draw(self, t: float):
+        if self.item is None:
+            self.item = self.pool.acquire(self.x, self.y, self.text, self.color)
+        self.pool.canvas.coords(self.item, self.x, self.y - self.RISE * t)
+        if t > 0.6 and not self.faded:
+            self.faded = True
+            self.pool.canvas.itemconfig(self.item, fill=self.FADED)
+    
+    def finish(self):
+        if self.item is not None:
+            self.pool.release(self.item)
+            self.item = None
 
-Responde SOLO con la narración, sin metadatos ni explicaciones."""
+class DiceSpin(CanvasAnimation):
+    """Dado que muestra valores al azar y se detiene en la tirada real"""
     
-    def generate_narration(self, player_input: str, character: Character) -> str:
-        """Genera narración basada en la entrada del jugador"""
-        try:
-            # Preparar contexto del personaje
-            char_context = f"""
-Personaje actual:
-- Nombre: {character.name}
-- Raza: {character.race}
-- Clase: {character.char_class}
-- Nivel: {character.level}
-- HP: {character.hp_actual}/{character.hp_max}
-- Maná: {character.mana_actual}/{character.mana_max}
-- Ubicación actual: {self.world_context.get('current_location', 'Entrada de la Habitación del Tiempo')}
-"""
-            
-            # Agregar entrada del usuario al historial
-            self.conversation_history.append({
-                "role": "user",
-                "content": f"{char_context}\n\nAcción del jugador: {player_input}"
-            })
-            
-            # Mantener historial manejable (últimos 10 mensajes)
-            messages = [{"role": "system", "content": self.system_prompt}]
-            messages.extend(self.conversation_history[-10:])
-            
-            # Generar respuesta
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                max_tokens=500,
-                temperature=0.8
-            )
-            
-            narration = response.choices[0].message.content
-            
-            # Agregar respuesta al historial
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": narration
-            })
-            
-            return narration
-            
-        except Exception as e:
-            return f"*Las energías dimensionales fluctúan... (Error: {str(e)})*"
+    CHANGES_PER_SECOND = 20
     
-    def generate_initial_scene(self, character: Character) -> str:
-        """Genera la escena inicial para un nuevo personaje"""
-        prompt = f"""
-Un nuevo guerrero entra a la Habitación del Tiempo:
-- Nombre: {character.name}
-- Raza: {character.race}
-- Clase: {character.char_class}
+    def __init__(self, canvas, item: int, result: int, faces: int, duration: float, start: float):
+        super().__init__(duration, start)
+        self.canvas = canvas
+        self.item = item
+        self.result = result
+        self.faces = max(2, faces)
+        self.last_change = -1
+    
+    def draw(self, t: float):
+        change = int(t * self.duration * self.CHANGES_PER_SECOND)
+        if change != self.last_change:
+            self.last_change = change
+            self.canvas.itemconfig(self.item, text=f"🎲 {random.randint(1, self.faces)}")
+    
+    def finish(self):
+        self.canvas.itemconfig(self.item, text=f"🎲 {self.result}")
 
-Describe su entrada a esta dimensión de entrenamiento, el ambiente que lo rodea y las primeras sensaciones que experimenta.
-La entrada es un vasto espacio blanco infinito con una extraña gravedad. Menciona las diferentes zonas visibles a lo lejos.
-Termina con opciones claras de qué puede hacer.
-"""
-        return self.generate_narration(prompt, character)
+class CombatView:
+    """
+    Vista de combate en un Canvas con bucle de paso fijo sobre after(): barras
+    de vida que se deslizan hacia su valor, dados que giran y números de daño.
+    Los items del Canvas se reutilizan (coords/itemconfig) y solo se tocan si
+    cambian. Cada fotograma tiene un presupuesto de tiempo: si se agota, o si
+    se acumulan demasiadas animaciones (combate automático), las pendientes
+    saltan a su estado final en vez de retrasar la entrada del jugador. El
+    bucle se detiene solo cuando no queda nada que animar.
+    """
     
-    def determine_encounter(self, action: str) -> Optional[str]:
-        """Determina si una acción resulta en un encuentro"""
-        encounter_keywords = ["buscar", "explorar", "cazar", "rastrear", "investigar", "entrenar", "pelear"]
-        
-        if any(keyword in action.lower() for keyword in encounter_keywords):
-            if random.random() < 0.7:  # 70% de probabilidad de encuentro
-                enemies = list(Enemy.ENEMY_TYPES.keys())
-                # Peso por nivel del personaje
-                weights = [4, 3, 2, 1]  # Favorece enemigos más débiles
-                return random.choices(enemies, weights=weights)[0]
-        return None
+    FRAME_MS = 16            # ~60 fps
+    FRAME_BUDGET = 0.006     # segundos de trabajo por fotograma
+    MAX_ANIMATIONS = 32
+    BAR_SPEED = 1.5          # fracción de barra por segundo
+    DICE_DURATION = 0.4
+    NUMBER_DURATION = 0.8
+    PLAYER = GameSession.PLAYER_KEY
+    
+    def __init__(self, canvas, width: int = 600, height: int = 110, clock=time.perf_counter):
+        self.canvas = canvas
+        self.width, self.height = width, height
+        self.clock = clock
+        self.bars: Dict[str, HealthBar] = {}
+        self.dice: Dict[str, int] = {}
+        self.animations: List[CanvasAnimation] = []
+        self.numbers = TextPool(canvas, ('Arial', 14, 'bold'))
+        self.idle_text = canvas.create_text(width // 2, height // 2, text="Sin combate",
+                                            fill='gray', font=('Arial', 11))
+        self.scheduled = None
+        self.next_frame = 0.0
+        self.last_frame = 0.0
+        self.stats = {"frames": 0, "dropped": 0, "late": 0}
+    
+    # --- Estado del combate ---
+    
+    def start(self, player: Tuple[str, int, int], enemies: List[Tuple[str, str, int, int]]):
+        """Muestra al jugador (nombre, hp, hp_max) y a los enemigos (clave, nombre, hp, hp_max)"""
+        self.clear()
+        self.canvas.itemconfig(self.idle_text, state=tk.HIDDEN)
+        name, hp, hp_max = player
+        self.add_combatant(self.PLAYER, name, hp, hp_max, '#8B0000')
+        for key, enemy_name, enemy_hp, enemy_hp_max in enemies:
+            self.add_combatant(key, enemy_name, enemy_hp, enemy_hp_max, '#B8860B')
+        self.layout()
+    
+    def add_combatant(self, key: str, name: str, hp: int, hp_max: int, color: str):
+        bar = HealthBar(self.canvas, name, color)
+        bar.set(hp, hp_max)
+        self.bars[key] = bar
+        self.dice[key] = self.canvas.create_text(0, 0, text="", fill='#32CD32', font=('Arial', 12, 'bold'))
+    
+    def clear(self):
+        """Quita combatientes y animaciones en curso"""
+        for animation in self.animations:
+            animation.finish()
+        self.animations.clear()
+        for bar in self.bars.values():
+            bar.delete()
+        for item in self.dice.values():
+            self.canvas.delete(item)
+        self.bars.clear()
+        self.dice.clear()
+        self.canvas.itemconfig(self.idle_text, state=tk.NORMAL)
+    
+    def resize(self, width: int, height: int):
+        self.width, self.height = width, height
+        self.canvas.coords(self.idle_text, width // 2, height // 2)
+        self.layout()
+    
+    def layout(self):
+        """Jugador a la izquierda y enemigos en columna a la derecha"""
+        if not self.bars:
+            return
+        column = max(80, self.width // 2 - 60)
+        enemies = [key for key in self.bars if key != self.PLAYER]
+        row = max(HealthBar.HEIGHT + 14, (self.height - 10) // max(1, len(enemies)))
+        for key, bar in self.bars.items():
+            if key == self.PLAYER:
+                x, y = 20, self.height // 2
+            else:
+                x, y = self.width - column - 20, 22 + row * enemies.index(key)
+            bar.place(x, y, column - 50)
+            self.canvas.coords(self.dice[key], x + column - 20, y + HealthBar.HEIGHT // 2)
+        self.request_frame()
+    
+    def update_hp(self, key: str, hp: int, hp_max: int):
+        bar = self.bars.get(key)
+        if bar:
+            bar.set(hp, hp_max)
+            self.request_frame()
+    
+    def show_attack(self, attacker: str, target: str, damage: int, hp: int, hp_max: int,
+                    attack_roll: Optional[int] = None, faces: int = 20):
+        """Dado del atacante, número de daño sobre el objetivo y su barra deslizándose"""
+        now = self.clock()
+        if attacker in self.dice and attack_roll is not None:
+            self.add_animation(DiceSpin(self.canvas, self.dice[attacker], attack_roll, faces,
+                                        self.DICE_DURATION, now))
+            now += self.DICE_DURATION
+        bar = self.bars.get(target)
+        if bar:
+            text, color = (f"-{damage}", '#FF6347') if damage > 0 else ("¡Fallo!", '#AAAAAA')
+            self.add_animation(FloatingNumber(self.numbers, bar.x + bar.width // 2, bar.y - 4, text, color,
+                                              self.NUMBER_DURATION, now))
+        self.update_hp(target, hp, hp_max)
+    
+    def add_animation(self, animation: CanvasAnimation):
+        # Con demasiadas animaciones en cola se descartan las más antiguas
+        while len(self.animations) >= self.MAX_ANIMATIONS:
+            self.animations.pop(0).finish()
+            self.stats["dropped"] += 1
+        self.animations.append(animation)
+        self.request_frame()
+    
+    # --- Bucle de fotogramas ---
+    
+    def request_frame(self):
+        if self.scheduled is None:
+            now = self.clock()
+            self.next_frame = self.last_frame = now
+            self.scheduled = self.canvas.after(1, self.frame)
+    
+    def frame(self):
+        """Un fotograma de paso fijo; se reprograma mientras quede algo en movimiento"""
+        self.scheduled = None
+        now = self.clock()
+        deadline = now + self.FRAME_BUDGET
+        dt = min(now - self.last_frame, 0.1)
+        self.last_frame = now
+        self.stats["frames"] += 1
+        
+        moving = False
+        for bar in self.bars.values():
+            shown = bar.fraction if bar.shown is None else bar.shown
+            if shown != bar.fraction:
+                step = self.BAR_SPEED * dt
+                shown = bar.fraction if abs(bar.fraction - shown) <= step else (
+                    shown + step if bar.fraction > shown else shown - step)
+                moving = moving or shown != bar.fraction
+            bar.draw(shown)
+        
+        alive = []
+        for index, animation in enumerate(self.animations):
+            if self.clock() > deadline:
+                # Presupuesto agotado: el resto salta a su estado final
+                for dropped in self.animations[index:]:
+                    dropped.finish()
+                self.stats["dropped"] += len(self.animations) - index
+                break
+            if animation.step(now):
+                alive.append(animation)
+        self.animations = alive
+        
+        if moving or self.animations:
+            self.next_frame += self.FRAME_MS / 1000
+            if self.next_frame < now:
+                # Fotograma perdido: se retoma el ritmo sin intentar recuperar los atrasados
+                self.stats["late"] += 1
+                self.next_frame = now + self.FRAME_MS / 1000
+            delay = max(1, int((self.next_frame - self.clock()) * 1000))
+            self.scheduled = self.canvas.after(delay, self.frame)
+    
+    def close(self):
+        if self.scheduled is not None:
+            self.canvas.after_cancel(self.scheduled)
+            self.scheduled = None
 
 # ============= INTERFAZ GRÁFICA =============
 
@@ -704,22 +6262,223 @@ class CharacterCreationDialog(tk.Toplevel):
         
         self.destroy()
 
+class JournalSearchDialog(tk.Toplevel):
+    """Buscador del diario: resultados al instante, de lo más reciente a lo más antiguo"""
+    
+    RESULT_LIMIT = 200
+    TAG_COLORS = {"combat": "#FF6347", "combate": "#FF6347", "dice": "#32CD32",
+                  "reward": "#FFD700", "system": "#00CED1", "title": "#FFD700"}
+    
+    def __init__(self, parent, journal: SessionJournal, character: Optional[str] = None):
+        super().__init__(parent)
+        self.title("Diario de la Habitación")
+        self.geometry("700x500")
+        self.configure(bg='#2a2a2a')
+        self.journal = journal
+        
+        search_frame = tk.Frame(self, bg='#2a2a2a')
+        search_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        self.query_entry = tk.Entry(search_frame, font=('Arial', 11), bg='#3a3a3a', fg='white',
+                                    insertbackground='white')
+        self.query_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.query_entry.bind('<Return>', lambda e: self.search())
+        self.query_entry.focus_set()
+        
+        self.only_character = tk.BooleanVar(value=bool(character))
+        self.character = character
+        if character:
+            tk.Checkbutton(search_frame, text=f"Solo {character}", variable=self.only_character,
+                           bg='#2a2a2a', fg='white', selectcolor='#3a3a3a',
+                           command=self.search).pack(side=tk.LEFT, padx=5)
+        
+        tk.Button(search_frame, text="Buscar", command=self.search, bg='#4a4a4a', fg='white',
+                  font=('Arial', 10, 'bold')).pack(side=tk.LEFT, padx=(5, 0))
+        
+        self.status_label = tk.Label(self, text="Escribe palabras a buscar (p. ej. 'lobo 150 oro' o 'esp*')",
+                                     bg='#2a2a2a', fg='gray', font=('Arial', 9))
+        self.status_label.pack(anchor=tk.W, padx=10)
+        
+        self.results_text = scrolledtext.ScrolledText(self, wrap=tk.WORD, font=('Consolas', 10),
+                                                      bg='#1a1a1a', fg='white')
+        self.results_text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        for tag, color in self.TAG_COLORS.items():
+            self.results_text.tag_config(tag, foreground=color)
+        self.results_text.tag_config("date", foreground="gray")
+    
+    def search(self):
+        """Busca en el diario (lo ya narrado se vuelca antes para que aparezca)"""
+        self.journal.flush()
+        started = time.perf_counter()
+        character = self.character if self.only_character.get() else None
+        hits = self.journal.search(self.query_entry.get(), self.RESULT_LIMIT, character)
+        elapsed = (time.perf_counter() - started) * 1000
+        
+        self.results_text.delete("1.0", tk.END)
+        for hit in hits:
+            date = datetime.fromtimestamp(hit.timestamp).strftime("%Y-%m-%d %H:%M")
+            self.results_text.insert(tk.END, f"{date} {hit.character}  ", "date")
+            self.results_text.insert(tk.END, hit.text + "\n", hit.kind)
+        more = "+" if len(hits) == self.RESULT_LIMIT else ""
+        self.status_label.config(text=f"{len(hits)}{more} resultados en {elapsed:.1f} ms")
+
+class ImprovementDialog(tk.Toplevel):
+    """
+    Reparto de puntos de mejora: recomendación y reparto a mano. Con la caché
+    fría la recomendación tarda más de lo que puede esperar la ventana, así que
+    se calcula en otro hilo y se muestra cuando está lista.
+    """
+    
+    POLL_MS = 30
+    EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reparto")
+    
+    STAT_LABELS = {"vitalidad": "Vitalidad (HP)", "ataque": "Ataque (caras)", "defensa": "Defensa (caras)",
+                   "ataque_magico": "Ataque mágico", "defensa_magica": "Defensa mágica",
+                   "fortaleza": "Fortaleza (bono)", "resistencia": "Resistencia (bono)", "mana": "Maná"}
+    
+    def __init__(self, parent, character: Character, solver: StatAllocationSolver, on_apply,
+                 encounter_table: Optional[tuple] = None):
+        super().__init__(parent)
+        self.title("Puntos de mejora")
+        self.resizable(False, False)
+        self.configure(bg='#2a2a2a')
+        self.transient(parent)
+        self.character = character
+        self.solver = solver
+        self.roster = solver.roster(encounter_table=encounter_table)
+        self.encounter_table = encounter_table
+        self.on_apply = on_apply
+        self.points = character.improvement_points
+        
+        tk.Label(self, text=f"{character.name} — nivel {character.level}: {self.points} puntos de mejora",
+                 bg='#2a2a2a', fg='#FFD700', font=('Arial', 12, 'bold')).pack(padx=15, pady=(15, 10))
+        
+        grid = tk.Frame(self, bg='#2a2a2a')
+        grid.pack(padx=15)
+        self.counts = {}
+        costs = ProgressionTable.IMPROVEMENT_COSTS
+        for row, (stat, gain) in enumerate(ProgressionTable.IMPROVEMENT_GAINS.items()):
+            tk.Label(grid, text=self.STAT_LABELS.get(stat, stat), bg='#2a2a2a', fg='white',
+                     font=('Arial', 10)).grid(row=row, column=0, sticky=tk.W, pady=2)
+            self.counts[stat] = tk.IntVar(value=0)
+            tk.Spinbox(grid, from_=0, to=self.points // costs[stat], width=5, textvariable=self.counts[stat],
+                       bg='#3a3a3a', fg='white', buttonbackground='#4a4a4a',
+                       insertbackground='white').grid(row=row, column=1, padx=10)
+            tk.Label(grid, text=f"+{gain} por mejora" + (f" ({costs[stat]} puntos)" if costs[stat] > 1 else ""),
+                     bg='#2a2a2a', fg='gray', font=('Arial', 9)).grid(row=row, column=2, sticky=tk.W)
+        
+        objective_frame = tk.Frame(self, bg='#2a2a2a')
+        objective_frame.pack(fill=tk.X, padx=15, pady=(10, 0))
+        tk.Label(objective_frame, text="Objetivo:", bg='#2a2a2a', fg='white',
+                 font=('Arial', 10)).pack(side=tk.LEFT)
+        self.objective = tk.StringVar(value="victoria")
+        for objective, label in (("victoria", "Ganar más"), ("rapidez", "Ganar más rápido")):
+            tk.Radiobutton(objective_frame, text=label, variable=self.objective, value=objective,
+                           command=self.recommend, bg='#2a2a2a', fg='white', selectcolor='#3a3a3a',
+                           activebackground='#3a3a3a').pack(side=tk.LEFT, padx=5)
+        
+        self.status_label = tk.Label(self, text="", bg='#2a2a2a', fg='white', justify=tk.LEFT,
+                                     font=('Arial', 9))
+        self.status_label.pack(anchor=tk.W, padx=15, pady=10)
+        
+        buttons = tk.Frame(self, bg='#2a2a2a')
+        buttons.pack(pady=(0, 15))
+        tk.Button(buttons, text="Recomendar", command=self.recommend, bg='#4a4a4a', fg='white',
+                  font=('Arial', 10, 'bold')).pack(side=tk.LEFT, padx=5)
+        self.apply_button = tk.Button(buttons, text="Aplicar", command=self.apply, bg='#2E7D32', fg='white',
+                                      font=('Arial', 10, 'bold'))
+        self.apply_button.pack(side=tk.LEFT, padx=5)
+        tk.Button(buttons, text="Más tarde", command=self.destroy, bg='#4a4a4a', fg='white',
+                  font=('Arial', 10)).pack(side=tk.LEFT, padx=5)
+        
+        self.recommendation = ""
+        self.pending = None
+        self.recommend()
+        # Cualquier cambio a mano (flechas o teclado) recalcula lo esperado
+        for var in self.counts.values():
+            var.trace_add("write", lambda *_: self.refresh())
+    
+    def allocation(self) -> Dict[str, int]:
+        allocation = {}
+        for stat, var in self.counts.items():
+            try:
+                allocation[stat] = max(0, var.get())
+            except tk.TclError:
+                allocation[stat] = 0
+        return allocation
+    
+    def recommend(self):
+        """Pide la recomendación para el objetivo elegido; show_plan la vuelca al terminar"""
+        self.pending = self.EXECUTOR.submit(self.solver.recommend, self.character, self.points,
+                                            self.objective.get(), encounter_table=self.encounter_table)
+        self.recommendation = "Calculando la recomendación..."
+        self.status_label.config(text=self.recommendation, fg='gray')
+        self.apply_button.config(state=tk.DISABLED)
+        self.after(self.POLL_MS, self.poll_plan, self.pending)
+    
+    def poll_plan(self, future):
+        if future is not self.pending or not self.winfo_exists():
+            return   # la ventana se cerró o se pidió otra recomendación
+        if not future.done():
+            self.after(self.POLL_MS, self.poll_plan, future)
+            return
+        self.pending = None
+        self.show_plan(future.result())
+    
+    def show_plan(self, plan: AllocationPlan):
+        """Rellena el reparto con la recomendación"""
+        for stat, var in self.counts.items():
+            var.set(plan.allocation.get(stat, 0))
+        per_enemy = ", ".join(f"{name} {p:.0%}" for name, p in plan.per_enemy.items())
+        self.recommendation = f"Recomendado en {plan.elapsed_ms:.0f} ms. Victoria por enemigo: {per_enemy}"
+        self.refresh()
+    
+    def refresh(self):
+        """Puntos restantes y rendimiento esperado del reparto actual"""
+        allocation = self.allocation()
+        cost = self.character.improvement_cost(allocation) or 0
+        left = self.points - cost
+        stats = self.solver.OFFENSE + self.solver.DEFENSE
+        _, rate, win = self.solver.evaluate(self.character, self.roster, "victoria",
+                                            [allocation.get(stat, 0) for stat in stats])
+        self.status_label.config(
+            text=f"Puntos restantes: {left}\nTu reparto: victoria {win:.0%}, {rate:.3f} victorias por ronda\n"
+                 f"{self.recommendation}",
+            fg='#FF6347' if left < 0 else 'white')
+        self.apply_button.config(state=tk.NORMAL if 0 <= left < self.points else tk.DISABLED)
+    
+    def apply(self):
+        self.on_apply({stat: count for stat, count in self.allocation().items() if count})
+        self.destroy()
+
 class GameUI(tk.Tk):
     """Interfaz principal del juego mejorada"""
     
-    def __init__(self):
+    AVATAR_SIZE = (180, 180)
+    SCENE_SIZE = (280, 200)
+    ENGINE_POLL_MS = 15
+    NARRATION_MAX_LINES = 5000  # el diario conserva todo; la ventana solo las últimas
+    
+    def __init__(self, separate_engine: bool = False, offline: bool = False,
+                 memory_diagnostics: float = MEMORY_DIAGNOSTICS):
         super().__init__()
         
         self.title("Prototipo Habitación del Tiempo 0.1")
         self.geometry("1400x900")
         self.minsize(1200, 800)
         
-        # Variables del juego
-        self.character = None
-        self.gm = AIGameMaster()
-        self.combat_system = CombatSystem()
-        self.dice_system = DiceSystem()
-        self.current_enemy = None
+        # Motor de juego: la interfaz solo se suscribe a sus eventos. Con separate_engine
+        # el motor (y la telemetría) corre en otro proceso y la ventana nunca espera al GM
+        self.journal = SessionJournal()
+        if separate_engine:
+            self.telemetry = None
+            self.session = EngineProxy(offline)
+        else:
+            self.telemetry = CombatTelemetry() if TELEMETRY_DIR else None
+            self.session = GameSession(AIGameMaster(offline=offline), CombatSystem(self.telemetry),
+                                       journal=self.journal)
+        self.gm = self.session.gm
+        self.session.subscribe(self.on_game_event)
         
         # Configurar estilo
         self.configure(bg='#1a1a1a')
@@ -730,9 +6489,50 @@ class GameUI(tk.Tk):
         self.create_widgets()
         self.create_menu()
         
+        # Informes periódicos de memoria para sesiones largas
+        self.memory_diagnostics = None
+        if memory_diagnostics:
+            self.memory_diagnostics = MemoryDiagnostics()
+            self.memory_diagnostics.watch_tk(self)
+            self.memory_diagnostics.add_gauge("líneas de narración", self.narration_lines)
+            if isinstance(self.session, GameSession):
+                self.memory_diagnostics.watch_session(self.session)
+            self.memory_diagnostics.start()
+            self.report_memory(int(memory_diagnostics * 1000))
+        
+        # Ilustraciones en segundo plano; los retratos de enemigos se generan una sola vez
+        self.illustrations = IllustrationPipeline(self)
+        self.portrait_prompt = None
+        self.scene_location = None
+        self.improvement_dialog = None
+        self.last_level = None        # (nombre, nivel) visto por última vez, para detectar subidas
+        for enemy_type in Enemy.ENEMY_TYPES:
+            self.illustrations.request(enemy_portrait_prompt(enemy_type), self.SCENE_SIZE)
+        
         # Iniciar juego
+        if separate_engine:
+            self.poll_engine()
         self.start_game()
     
+    def report_memory(self, interval_ms: int):
+        """Añade una medida al informe de memoria y programa la siguiente"""
+        self.after(interval_ms, lambda: (self.memory_diagnostics.report(), self.report_memory(interval_ms)))
+    
+    def poll_engine(self):
+        """Reparte los eventos llegados del proceso del motor"""
+        self.session.poll()
+        self.after(self.ENGINE_POLL_MS, self.poll_engine)
+    
+    @property
+    def character(self) -> Optional[Character]:
+        """Personaje de la sesión actual"""
+        return self.session.character
+    
+    @property
+    def current_enemy(self) -> Optional[Enemy]:
+        """Enemigo del combate en curso"""
+        return self.session.current_enemy
+    
     def create_widgets(self):
         """Crea todos los widgets de la interfaz mejorada"""
         # Frame principal con dos columnas
@@ -761,6 +6561,12 @@ class GameUI(tk.Tk):
                                                         height=25)
         self.narration_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         
+        # Vista de combate animada
+        self.combat_canvas = tk.Canvas(left_frame, height=110, bg='#111111', highlightthickness=0)
+        self.combat_canvas.pack(fill=tk.X, pady=(10, 0))
+        self.combat_view = CombatView(self.combat_canvas)
+        self.combat_canvas.bind('<Configure>', lambda e: self.combat_view.resize(e.width, e.height))
+        
         # Frame de acciones
         action_frame = tk.Frame(left_frame, bg='#1a1a1a')
         action_frame.pack(fill=tk.X, pady=(10, 0))
@@ -798,6 +6604,13 @@ class GameUI(tk.Tk):
                                       state=tk.DISABLED, padx=15, pady=5)
         self.defend_button.pack(side=tk.LEFT, padx=2)
         
+        self.auto_button = tk.Button(quick_actions_frame, text="⚡ Auto",
+                                     command=self.auto_battle,
+                                     bg='#6a4a00', fg='white', font=('Arial', 10, 'bold'),
+                                     activebackground='#7a5a10', relief=tk.FLAT,
+                                     state=tk.DISABLED, padx=15, pady=5)
+        self.auto_button.pack(side=tk.LEFT, padx=2)
+        
         self.perception_button = tk.Button(quick_actions_frame, text="👁️ Percepción",
                                          command=self.roll_perception,
                                          bg='#4a4a4a', fg='white', font=('Arial', 10, 'bold'),
@@ -875,6 +6688,12 @@ class GameUI(tk.Tk):
         self.char_image_canvas.create_oval(40, 30, 140, 130, fill='#5a5a5a', outline='#6a6a6a', width=2)
         self.char_image_canvas.create_text(90, 80, text="Avatar", fill='gray', font=('Arial', 14))
         
+        # Ilustración de la escena o del enemigo en combate
+        self.scene_canvas = tk.Canvas(char_frame, width=self.SCENE_SIZE[0], height=self.SCENE_SIZE[1],
+                                      bg='#3a3a3a', highlightthickness=2,
+                                      highlightbackground='#4a4a4a')
+        self.scene_canvas.pack(pady=(0, 10))
+        
         # Información básica
         self.char_info_frame = tk.Frame(char_frame, bg='#2a2a2a')
         self.char_info_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
@@ -962,6 +6781,9 @@ class GameUI(tk.Tk):
         game_menu.add_command(label="Nuevo Personaje", command=self.new_character)
         game_menu.add_command(label="Guardar", command=self.save_game)
         game_menu.add_command(label="Cargar", command=self.load_game)
+        game_menu.add_command(label="Entrenamiento acelerado...", command=self.train)
+        game_menu.add_command(label="Puntos de mejora...", command=self.open_improvements)
+        game_menu.add_command(label="Buscar en el diario...", command=self.open_journal)
         game_menu.add_separator()
         game_menu.add_command(label="Salir", command=self.quit)
         
@@ -973,10 +6795,7 @@ class GameUI(tk.Tk):
     
     def start_game(self):
         """Inicia el juego"""
-        self.add_narration("=== PROTOTIPO HABITACIÓN DEL TIEMPO 0.1 ===\n", "title")
-        self.add_narration("Bienvenido a la dimensión de entrenamiento definitiva.\n", "system")
-        self.add_narration("Aquí el tiempo fluye diferente. Un día aquí es un año afuera.", "system")
-        self.add_narration("Tu objetivo: volverte más fuerte que nunca.\n", "system")
+        self.session.welcome()
         
         # Crear personaje si no existe
         if not self.character:
@@ -988,24 +6807,12 @@ class GameUI(tk.Tk):
         self.wait_window(dialog)
         
         if dialog.result:
-            # Crear personaje
-            self.character = Character(
+            self.session.create_character(
                 dialog.result["name"],
                 dialog.result["race"],
-                dialog.result["class"]
+                dialog.result["class"],
+                dialog.result["attributes"]
             )
-            
-            # Aplicar atributos personalizados
-            for attr, value in dialog.result["attributes"].items():
-                setattr(self.character.attributes, attr, value)
-            
-            # Actualizar UI
-            self.update_character_panel()
-            
-            # Generar escena inicial
-            self.add_narration("\n" + "="*50 + "\n", "system")
-            initial_scene = self.gm.generate_initial_scene(self.character)
-            self.add_narration(initial_scene, "narration")
     
     def update_character_panel(self):
         """Actualiza el panel del personaje con toda la información"""
@@ -1091,8 +6898,8 @@ class GameUI(tk.Tk):
             ("Defensa:", self.character.get_defense_dice()),
             ("Atk Mágico:", f"1d{self.character.stats.ataque_magico}"),
             ("Def Mágica:", f"1d{self.character.stats.defensa_magica}"),
-            ("Fortaleza:", f"+{self.character.stats.fortaleza}"),
-            ("Resistencia:", f"+{self.character.stats.resistencia}")
+            ("Fortaleza:", f"{self.character.effective_stat('fortaleza'):+d}"),
+            ("Resistencia:", f"{self.character.effective_stat('resistencia'):+d}")
         ]
         
         for i, (label, value) in enumerate(combat_stats):
@@ -1107,15 +6914,17 @@ class GameUI(tk.Tk):
         # Estadísticas generales
         stats_text = f"Enemigos derrotados: {self.character.kills}\n"
         stats_text += f"Muertes: {self.character.deaths}\n"
+        stats_text += f"Puntos de mejora: {self.character.improvement_points}\n"
+        stats_text += f"Efectos: {', '.join(self.character.status_effects.names()) or 'Ninguno'}\n"
         stats_text += f"Tiempo en la Habitación: {self.get_play_time()}"
         
         tk.Label(self.general_stats_frame, text=stats_text, bg='#2a2a2a', fg='white',
                 justify=tk.LEFT, font=('Arial', 9)).pack(anchor=tk.W, padx=10, pady=5)
         
         # Equipamiento
-        equip_text = "Arma: " + (self.character.equipment['arma'] or "Ninguna") + "\n"
-        equip_text += "Armadura: " + (self.character.equipment['armadura'] or "Ninguna") + "\n"
-        equip_text += "Accesorio: " + (self.character.equipment['accesorio'] or "Ninguno")
+        equip_text = "\n".join(f"{slot.capitalize()}: {name or 'Nada'}"
+                               for slot, name in self.character.equipment.items())
+        equip_text += f"\nMochila: {self.character.inventory.total()} objetos"
         
         tk.Label(self.equipment_frame, text=equip_text, bg='#2a2a2a', fg='white',
                 justify=tk.LEFT, font=('Arial', 9)).pack(anchor=tk.W, padx=10, pady=5)
@@ -1126,7 +6935,11 @@ class GameUI(tk.Tk):
         return "0h 15m"
     
     def add_narration(self, text: str, tag: str = "normal"):
-        """Agrega texto al área de narración"""
+        """Agrega texto al área de narración (y al diario de partida)"""
+        self.journal.record(tag, text, self.character.name if self.character else "")
+        error = self.journal.take_error()
+        if error:
+            self.after_idle(messagebox.showwarning, "Diario", f"Diario desactivado: {error}")
         self.narration_text.insert(tk.END, text + "\n")
         
         # Aplicar formato según el tag
@@ -1157,223 +6970,168 @@ class GameUI(tk.Tk):
             self.narration_text.tag_add("reward", start, end)
             self.narration_text.tag_config("reward", foreground="#FFD700")
         
+        # Recortar las líneas más antiguas para que el widget no crezca sin límite
+        excess = self.narration_lines() - self.NARRATION_MAX_LINES
+        if excess > 0:
+            self.narration_text.delete("1.0", f"{excess + 1}.0")
+        
         # Auto-scroll
         self.narration_text.see(tk.END)
     
-    def process_input(self):
-        """Procesa la entrada del jugador"""
-        if not self.character:
-            messagebox.showwarning("Advertencia", "Primero debes crear un personaje")
-            return
-        
-        user_input = self.input_var.get().strip()
-        if not user_input:
-            return
-        
-        # Mostrar entrada del jugador
-        self.add_narration(f"> {user_input}", "system")
-        self.input_var.set("")
-        
-        # Si estamos en combate, manejar comandos de combate
-        if self.current_enemy and self.current_enemy.is_alive:
-            self.add_narration("¡Estás en combate! Usa los botones de acción o escribe 'huir'", "combat")
-            if "huir" in user_input.lower():
-                self.end_combat(fled=True)
+    def narration_lines(self) -> int:
+        """Líneas que contiene ahora el área de narración"""
+        return int(self.narration_text.index("end-1c").split(".")[0])
+    
+    def on_game_event(self, event: GameEvent):
+        """Refleja en la interfaz los eventos del motor de juego"""
+        if event.type == EventType.NARRATION:
+            self.add_narration(event.text, event.tag)
+        elif event.type == EventType.CHARACTER_CHANGED:
+            self.update_character_panel()
+            self.update_illustrations()
+            self.update_combat_view()
+            if self.character:
+                self.check_level_up()
+        elif event.type == EventType.COMBAT_ROUND:
+            data = event.data
+            self.combat_view.show_attack(data["attacker"], data["target"], data["damage"], data["hp"],
+                                         data["hp_max"], data["attack_roll"], data["faces"])
+        elif event.type == EventType.COMBAT_STARTED:
+            # Habilitar botones de combate
+            self.attack_button.config(state=tk.NORMAL)
+            self.defend_button.config(state=tk.NORMAL)
+            self.auto_button.config(state=tk.NORMAL)
+            self.rest_button.config(state=tk.DISABLED)
+            self.update_combat_view()
+            self.show_illustration(self.scene_canvas, enemy_portrait_prompt(event.data["enemy"]),
+                                   self.SCENE_SIZE)
+        elif event.type == EventType.COMBAT_ENDED:
+            # Deshabilitar botones de combate
+            self.attack_button.config(state=tk.DISABLED)
+            self.defend_button.config(state=tk.DISABLED)
+            self.auto_button.config(state=tk.DISABLED)
+            self.rest_button.config(state=tk.NORMAL)
+            self.combat_view.clear()
+            self.scene_location = None
+            self.update_illustrations()
+        elif event.type == EventType.LOCATION_CHANGED:
+            self.update_illustrations()
+        elif event.type == EventType.SAVE_REQUESTED:
+            self.save_game()
+        elif event.type == EventType.WARNING:
+            messagebox.showwarning("Advertencia", event.text)
+    
+    def update_combat_view(self):
+        """Sincroniza la vista de combate con la sesión (inicio, rebobinado o cambios de HP)"""
+        if not self.session.in_combat:
             return
-        
-        # Verificar si la acción resulta en un encuentro
-        enemy_type = self.gm.determine_encounter(user_input)
-        if enemy_type:
-            self.start_combat(enemy_type)
+        enemy_key = self.session.enemy_key()
+        if enemy_key not in self.combat_view.bars:
+            enemy = self.current_enemy
+            self.combat_view.start((self.character.name, self.character.hp_actual, self.character.hp_max),
+                                   [(enemy_key, enemy.type, enemy.hp_current, enemy.hp_max)])
         else:
-            # Generar narración normal
-            narration = self.gm.generate_narration(user_input, self.character)
-            self.add_narration(narration, "narration")
+            self.combat_view.update_hp(enemy_key, self.current_enemy.hp_current, self.current_enemy.hp_max)
+        self.combat_view.update_hp(CombatView.PLAYER, self.character.hp_actual, self.character.hp_max)
     
-    def start_combat(self, enemy_type: str):
-        """Inicia un combate"""
-        self.current_enemy = Enemy(enemy_type)
-        self.character.in_combat = True
+    def show_illustration(self, canvas: tk.Canvas, prompt: str, size: Tuple[int, int]):
+        """Pide una ilustración y la dibuja al llegar si sigue siendo la vigente"""
+        canvas.requested_prompt = prompt
+        
+        def draw(image):
+            if canvas.requested_prompt != prompt:
+                return
+            canvas.delete("all")
+            canvas.create_image(size[0] // 2, size[1] // 2, image=image)
+            canvas.image = image  # Tk necesita una referencia viva a la imagen
+        
+        self.illustrations.request(prompt, size, draw)
+    
+    def update_illustrations(self):
+        """Actualiza retrato y escena solo cuando cambia lo que representan"""
+        if not self.character:
+            return
         
-        # Habilitar botones de combate
-        self.attack_button.config(state=tk.NORMAL)
-        self.defend_button.config(state=tk.NORMAL)
-        self.rest_button.config(state=tk.DISABLED)
+        portrait = character_portrait_prompt(self.character)
+        if portrait != self.portrait_prompt:
+            self.portrait_prompt = portrait
+            self.show_illustration(self.char_image_canvas, portrait, self.AVATAR_SIZE)
         
-        # Narración de combate
-        self.add_narration(f"\n⚔️ ¡COMBATE! ⚔️", "combat")
-        self.add_narration(f"¡Un {enemy_type} aparece!", "combat")
-        self.add_narration(self.current_enemy.description, "narration")
-        self.add_narration(f"HP del enemigo: {self.current_enemy.hp_current}/{self.current_enemy.hp_max}", "combat")
+        if self.scene_location != self.current_location() and not self.session.in_combat:
+            self.show_scene()
+    
+    def current_location(self) -> str:
+        return self.gm.world_context.get("current_location") or "Entrada de la Habitación del Tiempo"
+    
+    def show_scene(self):
+        """Vuelve a pintar la escena del lugar actual en lugar del enemigo"""
+        self.scene_location = self.current_location()
+        self.show_illustration(self.scene_canvas, scene_prompt(self.scene_location), self.SCENE_SIZE)
+    
+    def process_input(self):
+        """Procesa la entrada del jugador"""
+        user_input = self.input_var.get().strip()
+        if self.character and user_input:
+            self.input_var.set("")
+        self.session.process_input(user_input)
     
     def quick_attack(self):
         """Ejecuta un ataque rápido"""
-        if not self.current_enemy or not self.current_enemy.is_alive:
-            return
-        
-        # Ataque del jugador
-        self.add_narration(f"\n{self.character.name} ataca al {self.current_enemy.type}!", "combat")
-        
-        result = self.combat_system.player_attack(self.character, self.current_enemy)
-        
-        self.add_narration(f"Tirada de ataque: {result['attack_desc']}", "dice")
-        self.add_narration(f"Defensa enemiga: {result['defense_desc']}", "dice")
-        
-        if result['damage'] > 0:
-            self.add_narration(f"¡Infliges {result['damage']} puntos de daño!", "combat")
-        else:
-            self.add_narration("¡El enemigo esquiva tu ataque!", "combat")
-        
-        if result['enemy_defeated']:
-            self.end_combat(victory=True)
-            return
-        
-        # Contraataque del enemigo
-        self.enemy_turn()
+        self.session.attack()
     
     def quick_defend(self):
         """Ejecuta una defensa (reduce daño del próximo ataque)"""
-        if not self.current_enemy or not self.current_enemy.is_alive:
-            return
-        
-        self.add_narration(f"\n{self.character.name} se prepara para defender...", "combat")
-        self.add_narration("Tu defensa aumenta temporalmente.", "system")
-        
-        # Por simplicidad, el enemigo ataca pero con menos daño
-        self.enemy_turn(defending=True)
+        self.session.defend()
     
-    def enemy_turn(self, defending=False):
-        """Turno del enemigo"""
-        if not self.current_enemy or not self.current_enemy.is_alive:
-            return
-        
-        self.add_narration(f"\n¡El {self.current_enemy.type} ataca!", "combat")
-        
-        result = self.combat_system.enemy_attack(self.current_enemy, self.character)
-        
-        self.add_narration(f"Ataque enemigo: {result['attack_desc']}", "dice")
-        self.add_narration(f"Tu defensa: {result['defense_desc']}", "dice")
-        
-        damage = result['damage']
-        if defending:
-            damage = int(damage * 0.5)
-            self.add_narration("¡Tu postura defensiva reduce el daño a la mitad!", "system")
-        
-        if damage > 0:
-            self.character.take_damage(damage)
-            self.add_narration(f"¡Recibes {damage} puntos de daño!", "combat")
-        else:
-            self.add_narration("¡Esquivas el ataque!", "combat")
-        
-        # Actualizar panel
-        self.update_character_panel()
-        
-        if result['player_defeated']:
-            self.game_over()
-    
-    def end_combat(self, victory: bool = False, fled: bool = False):
-        """Termina el combate"""
-        self.character.in_combat = False
-        
-        # Deshabilitar botones de combate
-        self.attack_button.config(state=tk.DISABLED)
-        self.defend_button.config(state=tk.DISABLED)
-        self.rest_button.config(state=tk.NORMAL)
-        
-        if victory and self.current_enemy:
-            self.add_narration(f"\n¡VICTORIA! Has derrotado al {self.current_enemy.type}.", "combat")
-            
-            # Calcular recompensas
-            gold = random.randint(*self.current_enemy.gold_range)
-            exp = self.current_enemy.exp_reward
-            
-            self.add_narration(f"\n🎉 Recompensas:", "reward")
-            self.add_narration(f"   +{exp} puntos de experiencia", "reward")
-            self.add_narration(f"   +{gold} monedas de oro", "reward")
-            
-            # Aplicar recompensas
-            self.character.gold += gold
-            old_level = self.character.level
-            self.character.add_experience(exp)
-            self.character.kills += 1
-            
-            if self.character.level > old_level:
-                self.add_narration(f"\n¡SUBISTE DE NIVEL! Ahora eres nivel {self.character.level}", "reward")
-                self.add_narration("Tus estadísticas han mejorado.", "system")
-            
-            self.update_character_panel()
-            
-        elif fled:
-            self.add_narration(f"\n¡Huyes del combate!", "combat")
-            self.add_narration("A veces la retirada es la mejor estrategia...", "system")
-        
-        self.current_enemy = None
+    def auto_battle(self):
+        """Resuelve el combate con la política automática de la sesión"""
+        self.session.auto_battle()
     
     def roll_perception(self):
         """Realiza una tirada de percepción"""
-        if not self.character:
-            return
-        
-        if self.character.in_combat:
-            self.add_narration("¡No puedes hacer eso en combate!", "system")
-            return
-        
-        bonus = self.character.get_attribute_bonus('sabiduria')
-        roll, desc = self.dice_system.roll_d100_with_bonus(bonus)
-        
-        self.add_narration(f"\nTirada de Percepción: {desc}", "dice")
-        
-        # Determinar resultado
-        if roll >= 90:
-            self.add_narration("¡Éxito crítico! Percibes cada detalle del entorno.", "system")
-            self.add_narration("Notas una anomalía en el espacio... parece un portal a otra zona.", "narration")
-        elif roll >= 70:
-            self.add_narration("Éxito. Detectas movimiento en la distancia.", "system")
-            self.add_narration("Parece que hay criaturas merodeando por aquí.", "narration")
-        elif roll >= 50:
-            self.add_narration("Éxito parcial. Percibes lo básico del entorno.", "system")
-        else:
-            self.add_narration("Fallo. No notas nada fuera de lo común.", "system")
+        self.session.roll_perception()
     
     def rest(self):
         """Permite al personaje descansar y recuperarse"""
+        self.session.rest()
+    
+    def train(self):
+        """Pide las horas y lanza un entrenamiento acelerado"""
         if not self.character:
             return
-        
-        if self.character.in_combat:
-            self.add_narration("¡No puedes descansar en combate!", "system")
+        hours = simpledialog.askinteger("Entrenamiento acelerado",
+                                        "¿Cuántas horas entrenará tu personaje en la Habitación?",
+                                        parent=self, minvalue=1, maxvalue=TrainingSimulator.MAX_HOURS)
+        if hours:
+            self.session.train(hours)
+    
+    def open_improvements(self):
+        """Abre el reparto de puntos de mejora (si hay puntos y no hay combate)"""
+        if not self.character or self.improvement_dialog is not None:
             return
-        
-        self.add_narration("\n🏕️ Te tomas un momento para descansar...", "system")
-        
-        # Recuperar HP y Maná
-        hp_recovered = int(self.character.hp_max * 0.3)
-        mana_recovered = int(self.character.mana_max * 0.5)
-        
-        self.character.heal(hp_recovered)
-        self.character.restore_mana(mana_recovered)
-        
-        self.add_narration(f"Recuperas {hp_recovered} puntos de vida.", "system")
-        self.add_narration(f"Recuperas {mana_recovered} puntos de maná.", "system")
-        
-        # Pequeña penalización de tiempo
-        if random.random() < 0.2:
-            self.add_narration("\nMientras descansas, sientes que algo se acerca...", "narration")
-        
-        self.update_character_panel()
+        if not self.character.improvement_points:
+            messagebox.showinfo("Puntos de mejora", "No tienes puntos de mejora sin asignar")
+            return
+        if self.session.in_combat:
+            messagebox.showinfo("Puntos de mejora", "Podrás repartir los puntos al terminar el combate")
+            return
+        self.improvement_dialog = ImprovementDialog(self, self.character, ALLOCATION_SOLVER,
+                                                    self.session.allocate_points, self.session.encounter_table())
+        self.improvement_dialog.bind("<Destroy>", lambda e: e.widget is self.improvement_dialog
+                                     and setattr(self, "improvement_dialog", None))
     
-    def game_over(self):
-        """Maneja el fin del juego"""
-        self.add_narration("\n💀 HAS MUERTO 💀", "combat")
-        self.add_narration("Tu entrenamiento termina aquí... por ahora.", "system")
-        
-        self.character.deaths += 1
-        self.character.hp_actual = int(self.character.hp_max * 0.5)
-        
-        self.add_narration("\nLa Habitación del Tiempo te revive con la mitad de tu vitalidad.", "system")
-        self.add_narration("Aprende de tus errores y hazte más fuerte.", "system")
-        
-        self.update_character_panel()
+    def check_level_up(self):
+        """Al subir de nivel fuera de combate se abre el reparto de puntos"""
+        character = self.character
+        seen = (character.name, character.level)
+        leveled = self.last_level is not None and seen[0] == self.last_level[0] and seen[1] > self.last_level[1]
+        self.last_level = seen
+        if leveled and character.improvement_points and not self.session.in_combat:
+            self.after_idle(self.open_improvements)
+    
+    def open_journal(self):
+        """Abre el buscador del diario de partida"""
+        JournalSearchDialog(self, self.journal, self.character.name if self.character else None)
     
     def save_game(self):
         """Guarda el estado del juego"""
@@ -1381,18 +7139,7 @@ class GameUI(tk.Tk):
             messagebox.showwarning("Advertencia", "No hay personaje para guardar")
             return
         
-        save_data = {
-            "character": self.character.to_dict(),
-            "gm_history": self.gm.conversation_history[-10:],
-            "world_context": self.gm.world_context,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        filename = f"save_{self.character.name.lower().replace(' ', '_')}.json"
-        with open(filename, "w", encoding='utf-8') as f:
-            json.dump(save_data, f, indent=2, ensure_ascii=False)
-        
-        self.add_narration(f"\n💾 Juego guardado como: {filename}", "system")
+        self.session.save_game()
     
     def load_game(self):
         """Carga un juego guardado"""
@@ -1405,35 +7152,7 @@ class GameUI(tk.Tk):
         
         if filename:
             try:
-                with open(filename, "r", encoding='utf-8') as f:
-                    save_data = json.load(f)
-                
-                # Reconstruir personaje
-                char_data = save_data["character"]
-                self.character = Character(char_data["name"], char_data["race"], char_data["class"])
-                
-                # Restaurar stats
-                for key, value in char_data["stats"].items():
-                    setattr(self.character.stats, key, value)
-                for key, value in char_data["attributes"].items():
-                    setattr(self.character.attributes, key, value)
-                
-                # Restaurar otros datos
-                self.character.level = char_data["level"]
-                self.character.experience = char_data["experience"]
-                self.character.exp_to_next = char_data["exp_to_next"]
-                self.character.gold = char_data["gold"]
-                self.character.hp_actual = char_data["hp_actual"]
-                self.character.mana_actual = char_data["mana_actual"]
-                self.character.kills = char_data.get("kills", 0)
-                self.character.deaths = char_data.get("deaths", 0)
-                
-                # Restaurar contexto del GM
-                self.gm.conversation_history = save_data.get("gm_history", [])
-                self.gm.world_context = save_data.get("world_context", {})
-                
-                self.update_character_panel()
-                self.add_narration(f"\n💾 Partida cargada: {self.character.name} - Nivel {self.character.level}", "system")
+                self.session.load_game(filename)
                 
             except Exception as e:
                 messagebox.showerror("Error", f"Error al cargar: {str(e)}")
@@ -1452,9 +7171,23 @@ COMANDOS Y ACCIONES:
 - Botón Atacar: Realiza un ataque básico
 - Botón Defender: Reduce el daño del próximo ataque
 - Escribe 'huir' para escapar del combate
+- Botón Auto o 'auto [agresivo|prudente|superviviente]': resuelve el combate
+  al instante ('auto defender 40 huir 10' fija los umbrales de HP en %)
+- Los enemigos piensan: atacan, se ponen en guardia, descargan golpes
+  brutales o huyen malheridos (sin recompensa si escapan)
 
 🏕️ General:
 - Botón Descansar: Recupera HP y Maná (no disponible en combate)
+- Comandos instantáneos (sin esperar al GM): atacar, defender, huir,
+  descansar, percepción, guardar, inventario, estado y sus sinónimos
+- 'entrenar 8 horas': entrenamiento acelerado con un resumen final
+- 'deshacer' o 'rebobinar 3': devuelve la partida a turnos anteriores
+- 'equipar <objeto>' / 'quitarme <objeto>': cambia el equipo
+- 'inventario armas raro por valor': filtra y ordena la mochila
+- 'ir al norte' (sur, este, oeste): viaja a la zona vecina; 'mapa' muestra
+  lo explorado. Cuanto más lejos de la entrada, más peligro
+- 'repartir puntos [victoria|rapidez]': gasta los puntos de mejora con el
+  mejor reparto calculado (o a mano en Juego > Puntos de mejora)
 - Las tiradas de dados son automáticas
 - Tu personaje sube de nivel con la experiencia
 
@@ -1488,12 +7221,60 @@ Creado con Python, Tkinter y OpenAI GPT-4
 
 def main():
     """Función principal"""
+    parser = argparse.ArgumentParser(description="Prototipo Habitación del Tiempo")
+    parser.add_argument("--servidor", action="store_true", help="Inicia el servidor multijugador TCP en lugar de la interfaz")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=7777)
+    parser.add_argument("--offline", action="store_true", help="Usa solo el narrador local, sin OpenAI")
+    parser.add_argument("--motor-separado", action="store_true",
+                        help="Ejecuta el motor en otro proceso para que la interfaz no se bloquee")
+    parser.add_argument("--diagnostico-memoria", type=float, default=MEMORY_DIAGNOSTICS, metavar="SEGUNDOS",
+                        help=f"Escribe un informe de memoria en {MEMORY_REPORT_PATH} cada SEGUNDOS")
+    parser.add_argument("--repartos", metavar="NIVELES",
+                        help="Escribe la tabla de repartos óptimos de puntos de mejora (p. ej. 1-30) y sale")
+    parser.add_argument("--objetivo", choices=StatAllocationSolver.OBJECTIVES, default="victoria",
+                        help="Criterio de la tabla de repartos")
+    parser.add_argument("--salida", help="Archivo CSV de la tabla de repartos (por defecto, por pantalla)")
+    args = parser.parse_args()
+    
+    if args.repartos:
+        table = allocation_table_csv(ALLOCATION_SOLVER.batch(parse_levels(args.repartos), args.objetivo))
+        if args.salida:
+            with open(args.salida, "w", encoding="utf-8", newline="") as f:
+                f.write(table)
+        else:
+            print(table, end="")
+        return
+    
+    if args.servidor:
+        telemetry = CombatTelemetry() if TELEMETRY_DIR else None
+        server = GameServer(args.host, args.puerto, offline=args.offline, telemetry=telemetry)
+        print(f"Servidor de la Habitación del Tiempo en {args.host}:{args.puerto}")
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if telemetry:
+                telemetry.close()
+        return
+    
     try:
-        app = GameUI()
+        app = GameUI(separate_engine=args.motor_separado, offline=args.offline,
+                     memory_diagnostics=args.diagnostico_memoria)
         app.mainloop()
+        if app.memory_diagnostics:
+            app.memory_diagnostics.report("cierre")
+        if isinstance(app.session, EngineProxy):
+            app.session.close()
+        app.combat_view.close()
+        app.illustrations.close()
+        app.journal.close()
+        if app.telemetry:
+            app.telemetry.close()
     except Exception as e:
         print(f"Error: {e}")
         messagebox.showerror("Error Fatal", f"Error al iniciar el juego:\n{str(e)}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()